@@ -2,22 +2,38 @@
 ================
 Due agenti distinti – uno genera la Specifica Funzionale (SF) dal documento ARU,
 l'altro calcola gli Unadjusted Function Point (UFP) a partire dalla SF.
-Le utility originali (FAISS, clamp, Agile‑context, ecc.) restano invariate.
+Le utility originali (clamp, Agile‑context, ecc.) restano invariate; quelle
+FAISS sul manuale sono in manual_retrieval.py.
 """
 import os
 import re
-import pickle
+import sys
 import logging
-import numpy as np
-import faiss
+from concurrent.futures import ThreadPoolExecutor
 import openai
-from sentence_transformers import SentenceTransformer
-from PyPDF2 import PdfReader
 from dotenv import load_dotenv
 
 # Funzioni di estrazione proprietarie
-from estrazione_damas_wave import get_functional_requirements
-from estrazione_dati_utili_wave import parse_aru_docx
+from estrazione_damas_wave import (PROMPT_REQ_VERSION, REQUIREMENTS_EXTRACTION_VERSION,
+                                   find_requirements_section, get_functional_requirements)
+from estrazione_dati_utili_wave import (PROMPT_FP_STRUCTURED_VERSION, PROMPT_FP_VERSION,
+                                        PROMPT_SUMMARY_VERSION, build_aru_text, analyze_fp,
+                                        analyze_fp_structured, summarize_aru)
+from aru_document import load_aru_document
+from llm_client import chat_completion
+from llm_transport import CassetteNotFoundError
+from ocr_engine import ocr_images
+from pipeline_dag import PipelineGraph, PipelineRun, registered_stages
+from result_store import lookup_result, store_result
+from requirement_classifier import (PROMPT_RF_CLASSIFY_VERSION, classify_requirements,
+                                    split_requirements)
+from sfp_engine import compute_sfp, render_sfp_report
+from text_compaction import compaction_signature
+# PDF manuale & FAISS: in manual_retrieval.py (indice costruito da manual_ingest.py)
+from manual_retrieval import (MANUAL_CONTEXT_ENABLED, MANUAL_PDF_PATH, manual_contexts,
+                              manual_signature)
+from metrics import (metrics_run, record_degraded, save_run_metrics, stage_timer,
+                     write_prometheus_textfile)
 
 ###############################################################################
 # ENV & OpenAI
@@ -43,50 +59,23 @@ if not logger.handlers:
     sh.setFormatter(fmt); fh.setFormatter(fmt)
     logger.addHandler(sh); logger.addHandler(fh)
 
-###############################################################################
-# PDF manuale & FAISS (copia invariata rispetto allo script originale)
-###############################################################################
-def read_pdf_and_chunk(pdf_path: str, chunk_size: int = 500):
-    logger.info("Lettura PDF %s", pdf_path)
-    with open(pdf_path, "rb") as f:
-        pages = [p.extract_text().strip() for p in PdfReader(f).pages if p.extract_text()]
-    big = "\n".join(pages)
-    return [big[i:i+chunk_size] for i in range(0, len(big), chunk_size)]
-
-
-def build_faiss_index(chunks, model, idx_path="manual_FP_calc.index", emb_path="manual_FP_calc.npy"):
-    if os.path.exists(idx_path) and os.path.exists(emb_path):
-        logger.info("Caricamento FAISS index da cache")
-        return faiss.read_index(idx_path)
-    logger.info("Creazione FAISS index nuovo")
-    emb = model.encode(chunks)
-    idx = faiss.IndexFlatL2(emb.shape[1]); idx.add(emb.astype("float32"))
-    faiss.write_index(idx, idx_path); np.save(emb_path, emb)
-    return idx
-
-
-def retrieve_context(query, idx, chunks, model, k=2):
-    qemb = model.encode([query]).astype("float32")
-    _, ids = idx.search(qemb, k)
-    ctx = "\n".join(chunks[i] for i in ids[0])
-    return ctx[:2000]
-
-
-def get_manual_chunks(pdf_path: str, chunk_size=500, cache="manual_chunks.pkl"):
-    if os.path.exists(cache):
-        return pickle.load(open(cache, "rb"))
-    ch = read_pdf_and_chunk(pdf_path, chunk_size)
-    pickle.dump(ch, open(cache, "wb")); return ch
-
 ###############################################################################
 # Clamp & Agile helpers (immutati)
 ###############################################################################
 CLAMP_MIN, CLAMP_MAX = 20, 200
 
+def parse_total_ufp(answer: str):
+    """Valore di "Totale UFP = N" nel report, None se assente."""
+    m = re.search(r"Totale UFP\s*=\s*(\d+)", answer or "")
+    return int(m.group(1)) if m else None
+
+def clamp_value(ufp: int, lo=CLAMP_MIN, hi=CLAMP_MAX) -> int:
+    return max(min(ufp, hi), lo)
+
 def clamp_range(answer: str, lo=CLAMP_MIN, hi=CLAMP_MAX):
     m = re.search(r"Totale UFP\s*=\s*(\d+)", answer)
     if m:
-        old = int(m.group(1)); new = max(min(old, hi), lo)
+        old = int(m.group(1)); new = clamp_value(old, lo, hi)
         if new != old:
             answer = re.sub(r"Totale UFP\s*=\s*\d+", f"Totale UFP = {new}", answer)
             logger.info("Clamp UFP %d→%d", old, new)
@@ -103,13 +92,16 @@ AGILE_KWS = {"product backlog","sprint","agile","metodologia agile"}
 def is_agile(text: str):
     t = text.lower(); return any(kw in t for kw in AGILE_KWS)
 
+def agile_value(ufp: int, req: str, factor=0.4) -> int:
+    return int(ufp * factor) if is_agile(req) else ufp
+
 def adjust_for_agile(answer: str, req: str, factor=0.4):
     if not is_agile(req):
         return answer
     m = re.search(r"Totale UFP\s*=\s*(\d+)", answer)
     if not m:
         return answer
-    old = int(m.group(1)); new = int(old * factor)
+    old = int(m.group(1)); new = agile_value(old, req, factor)
     logger.info("Agile context → UFP %d→%d", old, new)
     return re.sub(r"Totale UFP\s*=\s*\d+", f"Totale UFP = {new}", answer)
 
@@ -117,6 +109,9 @@ def adjust_for_agile(answer: str, req: str, factor=0.4):
 # Agent 1 – Generatore di Specifica Funzionale
 ###############################################################################
 
+# Versione del template: incrementarla quando il prompt cambia (invalida la cache LLM)
+PROMPT_SF_VERSION = "sf-v1"
+
 PROMPT_SF_TEMPLATE = """
 Hai l'obiettivo di convertire un documento di Analisi Requisiti Utente (ARU) in un documento di Specifica Funzionale (SF) utile a un successivo calcolo dei function point secondo standard IFPUG con metodologia "Simple Function Point (SFP)" e specifico riferimento al "Counting Practices Manual (Release 2.2)". 
 Il documento deve essere il più lungo e completo possibile. Considera che deve essere almeno 3-4 pagine. Se non riesci a dare l'output in un'unica risposta dividi in più risposte.
@@ -186,7 +181,8 @@ Ogni sezione del documento di specifica deve essere chiaramente separata e etich
 """
 
 
-def agent_generate_sf(aru_text: str, summary: str = "", ufp_info: str = "") -> str:
+def agent_generate_sf(aru_text: str, summary: str = "", ufp_info: str = "", on_token=None) -> str:
+    """Con `on_token` la SF viene prodotta in streaming (un frammento per chiamata)."""
 
     messages = [
         {"role":"system","content":"Sei un analista senior di Specifiche Funzionali."},
@@ -207,14 +203,17 @@ def agent_generate_sf(aru_text: str, summary: str = "", ufp_info: str = "") -> s
         {PROMPT_SF_TEMPLATE}
         """}
     ]
-    resp = openai.ChatCompletion.create(engine=DEPLOYMENT_NAME, messages=messages, max_tokens=6000, temperature=0.0)
-    sf = resp.choices[0].message.content.strip()
+    with stage_timer("sf"):
+        sf = chat_completion(messages, max_tokens=6000, temperature=0.0,
+                             prompt_version=PROMPT_SF_VERSION, on_token=on_token).strip()
     logger.info("Specifiche Funzionali generate (agent 1)")
     return sf
 
 ###############################################################################
 # Agent 2 – Calcolo UFP
 ###############################################################################
+PROMPT_UFP_VERSION = "ufp-v1"
+
 PROMPT_UFP_TEMPLATE = """
 [SPECIFICA FUNZIONALE]
 {sf}
@@ -259,18 +258,99 @@ UFP = EP + LF
 Ricorda di essere preciso e coerente in tutte le tue valutazioni. Giustifica chiaramente ogni decisione che ha un impatto significativo sul conteggio finale. Se ci sono ambiguità nei requisiti, esplicita le tue assunzioni e spiega come queste influenzano il conteggio.
 """
 
-def agent_calculate_ufp(sf_text: str, requirements_text: str) -> str:
+def agent_calculate_ufp(sf_text: str, requirements_text: str, on_token=None) -> str:
+    """
+    Con `on_token` il report viene prodotto in streaming; clamp e fattore Agile
+    sono applicati al testo completo, quindi il valore ritornato è quello finale.
+    """
     messages = [
         {"role":"system","content":"Sei un analista Function Point IFPUG esperto."},
         {"role":"user",  "content": PROMPT_UFP_TEMPLATE.format(sf=sf_text)}
     ]
-    resp = openai.ChatCompletion.create(engine=DEPLOYMENT_NAME, messages=messages, max_tokens=4000, temperature=0.0)
-    answer = resp.choices[0].message.content.strip()
-    answer = clamp_range(answer)
-    answer = adjust_for_agile(answer, requirements_text)
+    with stage_timer("ufp"):
+        answer = chat_completion(messages, max_tokens=4000, temperature=0.0,
+                                 prompt_version=PROMPT_UFP_VERSION, on_token=on_token).strip()
+    with stage_timer("ufp_adjust"):
+        answer = clamp_range(answer)
+        answer = adjust_for_agile(answer, requirements_text)
     logger.info("Report UFP generato (agent 2)")
     return answer
 
+###############################################################################
+# Conteggio UFP map-reduce per requisito (alternativa all'Agent 2)
+###############################################################################
+# "llm"        = report completo dell'Agent 2
+# "mapreduce"  = classificazione per RF + calcolo locale
+# "structured" = analisi FP in JSON validato + calcolo locale (nessuna chiamata in più)
+UFP_COUNT_MODE = os.getenv("UFP_COUNT_MODE", "llm").lower()
+# Con conteggio locale, genera comunque il report narrativo dell'Agent 2 in background
+UFP_NARRATIVE = os.getenv("UFP_NARRATIVE", "0") == "1"
+
+def count_ufp_mapreduce(requirements_text: str):
+    """
+    Map: ogni requisito RF classificato in ILF/EIF/EI/EO/EQ con una chiamata
+    piccola e parallela. Reduce: conteggio e formule SFP in Python.
+    Ritorna (SfpResult, funzioni), oppure None (si usa l'Agent 2) se il testo
+    non ha label RF o se un requisito non può essere classificato.
+    """
+    reqs = split_requirements(requirements_text)
+    if not reqs:
+        return None
+    # Contesto del manuale IFPUG per ogni requisito: un solo encode + una sola search
+    contexts = manual_contexts([r.body for r in reqs]) if MANUAL_CONTEXT_ENABLED else None
+    with stage_timer("ufp_map"):
+        try:
+            by_label = classify_requirements(reqs, contexts=contexts)
+        except CassetteNotFoundError:
+            raise
+        except Exception as e:
+            # Il conteggio parziale sarebbe sottostimato: report dell'Agent 2, run non archiviata
+            record_degraded("ufp_counts", f"classificazione per requisito fallita: {e}")
+            return None
+    functions = [fn for r in reqs for fn in by_label[r.label]]
+    with stage_timer("ufp_reduce"):
+        result = compute_sfp(functions)
+    logger.info("Conteggio map-reduce: %d requisiti, %d funzioni, UFP %.1f",
+                len(reqs), len(functions), result.ufp)
+    return result, functions
+
+def ufp_report_from_counts(counts, requirements_text: str, title="Conteggio SFP per requisito") -> str:
+    """Report UFP da conteggi strutturati, con clamp e fattore Agile applicati ai numeri."""
+    result, functions = counts
+    raw = int(round(result.ufp))
+    notes, final = [], clamp_value(raw)
+    if final != raw:
+        notes.append(f"Clamp nell'intervallo {CLAMP_MIN}–{CLAMP_MAX}: {raw} → {final}")
+        logger.info("Clamp UFP %d→%d", raw, final)
+    adjusted = agile_value(final, requirements_text)
+    if adjusted != final:
+        notes.append(f"Contesto Agile: {final} → {adjusted}")
+        logger.info("Agile context → UFP %d→%d", final, adjusted)
+    return render_sfp_report(result, functions, adjustments=notes, final_ufp=adjusted,
+                             title=title)
+
+_narrative_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ufp-narrative")
+
+def submit_ufp_narrative(sf_text: str, requirements_text: str, output_dir="."):
+    """
+    Report narrativo dell'Agent 2 come extra asincrono: non blocca la pipeline,
+    viene scritto in `ufp_narrativa.md` quando pronto. Ritorna il Future.
+    """
+    def narrative():
+        text = agent_calculate_ufp(sf_text, requirements_text)
+        _atomic_write(os.path.join(output_dir, "ufp_narrativa.md"), text)
+        return text
+
+    def log_failure(future):
+        # Nessuno attende il Future: gli errori vanno almeno nel log
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Report narrativo UFP non generato (%s): %s",
+                         output_dir, future.exception())
+
+    future = _narrative_pool.submit(narrative)
+    future.add_done_callback(log_failure)
+    return future
+
 ###############################################################################
 # Agenti per app.py
 ###############################################################################
@@ -300,34 +380,252 @@ def calculate_ufp(sf_text: str, requirements_text: str) -> str:
 ###############################################################################
 # Pipeline completa
 ###############################################################################
-PDF_MANUAL_PATH = r"C:\Users\A395959\PycharmProjects\UFP_estimator\Function_Point_calcManual.pdf"
+PDF_MANUAL_PATH = MANUAL_PDF_PATH
 
 
-def run_pipeline(docx_path: str):
-    # 0) Estrai testo ARU
-    logger.info("Estrazione ARU da %s", docx_path)
-    aru_text            = get_functional_requirements(docx_path, use_regex=True)
-    pre_analysis        = quick_pre_analysis(aru_text)
-    ufp_info, _, summary      = parse_aru_docx(docx_path)
+# Fasi notificate alla callback `progress` di run_pipeline, in ordine
+PIPELINE_STAGES = [
+    ("estrazione", "Estrazione testo ARU"),
+    ("ocr",        "OCR immagini"),
+    ("analisi",    "Analisi requisiti e Function Point"),
+    ("sf",         "Generazione Specifica Funzionale"),
+    ("ufp",        "Calcolo UFP"),
+]
 
-    # 1) Agent 1 – Specifiche Funzionali
-    sf_text = agent_generate_sf(aru_text, summary=summary, ufp_info=ufp_info)
 
-    with open("specifica_funzionale.md", "w", encoding="utf-8") as f:
-        f.write(sf_text)
+def _streaming_writer(f, on_token=None):
+    """Callback che scrive (e flusha) ogni frammento su file e lo inoltra alla UI."""
+    def write(token):
+        f.write(token); f.flush()
+        if on_token:
+            on_token(token)
+    return write
 
-    # 2) Agent 2 – Calcolo UFP
-    ufp_report = agent_calculate_ufp(sf_text, aru_text)
-    with open("ufp_report.md", "w", encoding="utf-8") as f:
-        f.write(ufp_report)
 
-    return sf_text, ufp_report, pre_analysis, ufp_info
+def _stream_to_file(path, generate, on_token=None):
+    """
+    Esegue `generate(on_token=...)` scrivendo lo streaming in `<path>.partial`,
+    poi sostituisce atomicamente `path` con il testo finale. Se la generazione
+    fallisce (anche per annullamento del job) il file parziale viene rimosso.
+    """
+    partial = path + ".partial"
+    try:
+        with open(partial, "w", encoding="utf-8") as f:
+            text = generate(on_token=_streaming_writer(f, on_token))
+        _atomic_write(path, text)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return text
+
+
+def _atomic_write(path, text):
+    """Scrive il file completo in un temporaneo e lo sostituisce in un colpo solo."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+# Nodo del DAG -> fase mostrata all'utente (PIPELINE_STAGES)
+_DAG_TO_STAGE = {
+    "document": "estrazione", "ocr": "ocr",
+    "requirements": "analisi", "aru_text": "analisi", "fp_analysis": "analisi",
+    "summary": "analisi", "ufp_counts": "analisi",
+    "fp_structured": "analisi", "sf": "sf", "ufp": "ufp",
+}
+
+
+def build_pipeline_graph(on_sf_token=None, on_ufp_token=None, output_dir=".",
+                         document=None) -> PipelineGraph:
+    """
+    Grafo delle fasi di run_pipeline (più quelle registrate con
+    `pipeline_dag.register_stage`). Estrazione requisiti, analisi FP e
+    riassunto girano in parallelo; SF e UFP sono "inline" perché le callback
+    di streaming devono girare nel thread chiamante (Streamlit).
+    I risultati della fase "ocr" arrivano in memoria alle fasi che usano il
+    testo delle immagini. Se `document` (già caricato) ha la sezione requisiti
+    nell'outline, l'estrazione dei requisiti non attende l'OCR.
+    I file .md vengono scritti in `output_dir`: durante lo streaming in
+    `<nome>.md.partial`, poi sostituiti atomicamente dal testo finale.
+    """
+    sf_path = os.path.join(output_dir, "specifica_funzionale.md")
+    ufp_path = os.path.join(output_dir, "ufp_report.md")
+
+    def ocr(document):
+        # OCR una sola volta: i risultati passano alle fasi successive (anche le immagini fallite)
+        return ocr_images(document.image_blobs) if document.images else []
+
+    def sf(requirements, fp_analysis, summary):
+        # Agent 1 – Specifiche Funzionali (scritta sul file man mano che arriva)
+        return _stream_to_file(sf_path,
+                               lambda on_token: agent_generate_sf(requirements, summary=summary,
+                                                                  ufp_info=fp_analysis,
+                                                                  on_token=on_token),
+                               on_sf_token)
+
+    def ufp_counts(requirements):
+        # In modalità map-reduce la classificazione per RF parte subito, in parallelo alla SF
+        return count_ufp_mapreduce(requirements) if UFP_COUNT_MODE == "mapreduce" else None
+
+    def ufp(sf, requirements, ufp_counts):
+        if ufp_counts is not None:
+            title = ("Conteggio SFP (analisi FP strutturata)" if UFP_COUNT_MODE == "structured"
+                     else "Conteggio SFP per requisito")
+            ufp_report = ufp_report_from_counts(ufp_counts, requirements, title=title)
+            if on_ufp_token:
+                on_ufp_token(ufp_report)
+            _atomic_write(ufp_path, ufp_report)
+            return ufp_report
+        # Agent 2 – Calcolo UFP (il file viene riscritto con il valore finale dopo clamp/Agile)
+        return _stream_to_file(ufp_path,
+                               lambda on_token: agent_calculate_ufp(sf, requirements,
+                                                                    on_token=on_token),
+                               on_ufp_token)
+
+    graph = PipelineGraph()
+    graph.add_stage("document", lambda docx_path: load_aru_document(docx_path), deps=("docx_path",))
+    graph.add_stage("ocr", ocr, deps=("document",))
+    if document is not None and find_requirements_section(document):
+        # Sezione requisiti trovata per titolo: il testo OCR non serve
+        graph.add_stage("requirements",
+                        lambda document: get_functional_requirements(document, use_regex=True),
+                        deps=("document",))
+    else:
+        graph.add_stage("requirements",
+                        lambda document, ocr: get_functional_requirements(document, use_regex=True,
+                                                                          ocr_texts=ocr),
+                        deps=("document", "ocr"))
+    graph.add_stage("pre_analysis", lambda requirements: quick_pre_analysis(requirements),
+                    deps=("requirements",), executor="inline")
+    graph.add_stage("aru_text", lambda document, ocr: build_aru_text(document, ocr_texts=ocr),
+                    deps=("document", "ocr"))
+    if UFP_COUNT_MODE == "structured":
+        # Una sola chiamata: l'analisi strutturata alimenta sia la SF sia il calcolo locale
+        graph.add_stage("fp_structured", lambda aru_text: analyze_fp_structured(aru_text),
+                        deps=("aru_text",))
+        graph.add_stage("fp_analysis",
+                        lambda aru_text, fp_structured: (fp_structured.as_text()
+                                                         or analyze_fp(aru_text)),
+                        deps=("aru_text", "fp_structured"))
+        graph.add_stage("ufp_counts",
+                        lambda fp_structured: ((compute_sfp(fp_structured.functions),
+                                                fp_structured.functions)
+                                               if fp_structured.functions else None),
+                        deps=("fp_structured",), executor="inline")
+    else:
+        graph.add_stage("fp_analysis", lambda aru_text: analyze_fp(aru_text), deps=("aru_text",))
+        graph.add_stage("ufp_counts", ufp_counts, deps=("requirements",))
+    graph.add_stage("summary", lambda aru_text: summarize_aru(aru_text), deps=("aru_text",))
+    graph.add_stage("sf", sf, deps=("requirements", "fp_analysis", "summary"), executor="inline")
+    graph.add_stage("ufp", ufp, deps=("sf", "requirements", "ufp_counts"), executor="inline")
+    for stage in registered_stages():
+        graph.add(stage)
+    return graph
+
+
+def pipeline_signature() -> dict:
+    """
+    Versioni dei prompt, deployment, compattazione e (con MANUAL_CONTEXT=1)
+    indice e parametri di retrieval del manuale: fanno parte della chiave
+    dell'archivio risultati.
+    """
+    return {
+        "deployment": DEPLOYMENT_NAME,
+        "prompts": {"requirements": PROMPT_REQ_VERSION,
+                    "requirements_extraction": REQUIREMENTS_EXTRACTION_VERSION,
+                    "fp": PROMPT_FP_VERSION,
+                    "summary": PROMPT_SUMMARY_VERSION, "sf": PROMPT_SF_VERSION,
+                    "ufp": PROMPT_UFP_VERSION, "rf_classify": PROMPT_RF_CLASSIFY_VERSION,
+                    "fp_structured": PROMPT_FP_STRUCTURED_VERSION},
+        "ufp_count_mode": UFP_COUNT_MODE,
+        "manual_context": manual_signature(),
+        "compaction": compaction_signature(),
+    }
+
+
+def _stored_run(stored, document, output_dir, on_sf_token=None, on_ufp_token=None):
+    """PipelineRun ricostruito dall'archivio risultati (nessuna fase eseguita)."""
+    _atomic_write(os.path.join(output_dir, "specifica_funzionale.md"), stored["sf"])
+    _atomic_write(os.path.join(output_dir, "ufp_report.md"), stored["ufp"])
+    if on_sf_token:
+        on_sf_token(stored["sf"])
+    if on_ufp_token:
+        on_ufp_token(stored["ufp"])
+    return PipelineRun(results={"document": document, **stored})
+
+
+def run_pipeline_graph(docx_path: str, progress=None, on_sf_token=None, on_ufp_token=None,
+                       output_dir=".", use_result_store=True):
+    """
+    Esegue il DAG completo e ritorna il `PipelineRun` (risultati di tutte le fasi).
+    `run.metrics` contiene il record delle metriche per fase, salvato anche in
+    METRICS_DIR come JSON e aggregato nel file Prometheus (vedi metrics.py).
+    Se lo stesso contenuto è già stato stimato con gli stessi prompt e
+    deployment, i risultati arrivano dall'archivio (result_store.py) senza
+    eseguire la pipeline; `use_result_store=False` forza una nuova stima.
+    """
+    logger.info("Estrazione ARU da %s", docx_path)
+    notified = set()
+
+    def on_stage_start(name):
+        stage = _DAG_TO_STAGE.get(name)
+        if progress and stage and stage not in notified:
+            notified.add(stage); progress(stage)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with metrics_run(label=os.path.basename(docx_path)) as run_metrics:
+        with stage_timer("result_store"):
+            document = load_aru_document(docx_path)
+            signature = pipeline_signature()
+            stored = lookup_result(document.content_hash, signature) if use_result_store else None
+        if stored is not None:
+            logger.info("Risultati già in archivio per %s (impronta %s)",
+                        os.path.basename(docx_path), document.content_hash[:12])
+            run = _stored_run(stored, document, output_dir, on_sf_token, on_ufp_token)
+        else:
+            graph = build_pipeline_graph(on_sf_token=on_sf_token, on_ufp_token=on_ufp_token,
+                                         output_dir=output_dir, document=document)
+            run = graph.run({"docx_path": docx_path, "document": document},
+                            on_stage_start=on_stage_start)
+            run.degraded = [f"{d['stage']}: {d['reason']}" for d in run_metrics.degraded]
+            store_result(document.content_hash, signature, run.results,
+                         filename=os.path.basename(docx_path), degraded=run.degraded)
+            if UFP_NARRATIVE and run.results.get("ufp_counts") is not None:
+                run.results["ufp_narrative"] = submit_ufp_narrative(
+                    run.results["sf"], run.results["requirements"], output_dir)
+    run.metrics = run_metrics.to_dict()
+    try:
+        save_run_metrics(run_metrics)
+        write_prometheus_textfile()
+    except OSError as e:
+        logger.warning("Impossibile salvare le metriche: %s", e)
+    return run
+
+
+def run_pipeline(docx_path: str, progress=None, on_sf_token=None, on_ufp_token=None,
+                 output_dir=".", use_result_store=True):
+    """
+    Pipeline completa ARU -> SF -> UFP (eseguita come DAG, vedi build_pipeline_graph).
+      progress      – callback(stage_key) chiamata all'inizio di ogni fase (PIPELINE_STAGES)
+      on_sf_token   – callback(str) per lo streaming della SF
+      on_ufp_token  – callback(str) per lo streaming del report UFP
+      output_dir    – cartella dove scrivere specifica_funzionale.md e ufp_report.md
+      use_result_store – False per ignorare i risultati già in archivio
+    """
+    run = run_pipeline_graph(docx_path, progress=progress,
+                             on_sf_token=on_sf_token, on_ufp_token=on_ufp_token,
+                             output_dir=output_dir, use_result_store=use_result_store)
+    r = run.results
+    return r["sf"], r["ufp"], r["pre_analysis"], r["fp_analysis"]
 
 ###############################################################################
 # MAIN
 ###############################################################################
 if __name__ == "__main__":
     DOCX_PATH = r"C:\Users\A395959\PycharmProjects\UFP_estimator\ARU_dir\ARU - STL 2023 Wave 1.docx"
+    if len(sys.argv) > 1:
+        DOCX_PATH = sys.argv[1]  # per più documenti usare batch_estimate.py
     sf, report, pre, info = run_pipeline(DOCX_PATH)
     print("\n=== PRE‑ANALISI ===\n", pre)
     print("\n=== INFO UFP (dal docx) ===\n", info)
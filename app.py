@@ -1,9 +1,12 @@
 import streamlit as st
-import tempfile, os
+import os, time
 
-# Importiamo sia le singole funzioni che la pipeline completa
+# Agenti e fasi della pipeline (la pipeline gira nei job, vedi job_queue.py)
 import agente_calcolo as agent     # contiene ancora generate_sf() & calculate_ufp()
-from agente_calcolo import run_pipeline
+from job_queue import DONE, FAILED, CANCELLED, get_job_queue
+from metrics import start_metrics_server
+from result_store import RESULT_STORE_ENABLED, clear_results, evict_result, list_results
+from warmup import warm_up
 
 # ─────────────────────────  CONFIG  ────────────────────────────────
 st.set_page_config(
@@ -47,12 +50,48 @@ st.markdown("""
 st.image("img2_software.png", width=80)
 st.markdown("</div>", unsafe_allow_html=True)
 
-# ─────────────────────────  UTILS  ─────────────────────────────────
-def _make_temp_copy(file) -> str:
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-    tmp.write(file.getvalue())
-    tmp.close()
-    return tmp.name
+# ─────────────────────────  WARM-UP  ───────────────────────────────
+@st.cache_resource(show_spinner="Caricamento modelli…")
+def _warm_up() -> dict:
+    # Eseguito una sola volta per processo Streamlit, non a ogni richiesta;
+    # carica solo i componenti usati dalla pipeline configurata (vedi warmup.py)
+    return warm_up()
+
+_warm_up()
+
+@st.cache_resource
+def _metrics_endpoint():
+    # Endpoint Prometheus locale, solo se richiesto con METRICS_PORT
+    return start_metrics_server() if os.getenv("METRICS_PORT") else None
+
+_metrics_endpoint()
+
+@st.cache_resource
+def _job_queue():
+    # Pool di worker condiviso da tutte le sessioni del server
+    return get_job_queue()
+
+jobs = _job_queue()
+POLL_SECONDS = 1.0
+
+# ─────────────────────────  ADMIN: ARCHIVIO RISULTATI  ─────────────
+if RESULT_STORE_ENABLED and os.getenv("UFP_ADMIN", "0") == "1":
+    with st.sidebar.expander("🗄️ Archivio risultati"):
+        entries = list_results()
+        st.caption(f"{len(entries)} stime in archivio")
+        if entries:
+            st.dataframe([{k: v for k, v in e.items() if k != "key"} for e in entries],
+                         use_container_width=True)
+            labels = {f"{e['filename']} · {e['stored_at']} · {e['key'][:12]}": e["key"]
+                      for e in entries}
+            selected = st.multiselect("Voci da rimuovere", list(labels))
+            if st.button("Rimuovi selezionate") and selected:
+                for label in selected:
+                    evict_result(labels[label])
+                st.rerun()
+            if st.button("Svuota archivio"):
+                clear_results()
+                st.rerun()
 
 # ─────────────────────────  SESSION STATE  ────────────────────────
 if "sf_text" not in st.session_state:
@@ -60,29 +99,56 @@ if "sf_text" not in st.session_state:
     st.session_state.ufp_report   = None
     st.session_state.pre_analysis = None
     st.session_state.ufp_info     = None
+    st.session_state.run_metrics  = None
+    st.session_state.job_id       = None
+    st.session_state.loaded_job   = None
 
 # ─────────────────────────  FILE UPLOAD  ──────────────────────────
 uploaded = st.file_uploader("📄 Scegli un file .docx", type="docx")
 
 if uploaded:
-    tmp_path = _make_temp_copy(uploaded)
     st.success("File caricato con successo!")
 
     # -------- STEP 1: genera SF + calcola UFP ----------------------
     if st.button("➊ Genera Specifica Funzionale"):
-        with st.spinner("Esecuzione pipeline (SF + UFP)…"):
-            try:
-                # Esegue l'intera pipeline: SF + UFP
-                sf_text, ufp_report, pre_analysis, ufp_info = run_pipeline(tmp_path)
-                # Salva in session state
-                st.session_state.sf_text      = sf_text
-                st.session_state.ufp_report   = ufp_report
-                st.session_state.pre_analysis = pre_analysis
-                st.session_state.ufp_info     = ufp_info
-                st.success("Pipeline completata: SF e UFP pronti!")
-            except Exception as e:
-                st.error(f"Errore durante l'esecuzione: {e}")
+        # La pipeline gira in background: la sessione resta libera
+        st.session_state.job_id  = jobs.submit(uploaded.getvalue(), uploaded.name)
+        st.session_state.sf_text = None
+
+job = jobs.get(st.session_state.job_id) if st.session_state.job_id else None
+if job is not None and not job.finished:
+    stage_keys   = [key for key, _ in agent.PIPELINE_STAGES]
+    stage_labels = dict(agent.PIPELINE_STAGES)
+    if job.stage in stage_keys:
+        idx = stage_keys.index(job.stage)
+        st.progress(idx / len(stage_keys),
+                    text=f"{idx + 1}/{len(stage_keys)} · {stage_labels[job.stage]}…")
+    else:
+        st.progress(0, text=f"Job {job.job_id} in coda…")
+    if st.button("✖ Annulla"):
+        jobs.cancel(job.job_id)
+    if job.sf_partial:
+        st.markdown(f"### 📄 Specifica Funzionale (in generazione…)\n\n{job.sf_partial}")
+    if job.ufp_partial:
+        st.markdown(f"### 📊 Report UFP (in generazione…)\n\n{job.ufp_partial}")
+    time.sleep(POLL_SECONDS)
+    st.rerun()
+elif job is not None and job.job_id != st.session_state.loaded_job:
+    # Job concluso: carica i risultati una sola volta
+    st.session_state.loaded_job = job.job_id
+    if job.status == DONE:
+        st.session_state.sf_text      = job.results["sf"]
+        st.session_state.ufp_report   = job.results["ufp"]
+        st.session_state.pre_analysis = job.results["pre_analysis"]
+        st.session_state.ufp_info     = job.results["fp_analysis"]
+        st.session_state.run_metrics  = job.metrics
+        st.success("Pipeline completata: SF e UFP pronti!")
+    elif job.status == FAILED:
+        st.error(f"Errore durante l'esecuzione: {job.error}")
+    elif job.status == CANCELLED:
+        st.warning("Elaborazione annullata.")
 
+if uploaded:
     # Se abbiamo già generato la SF, la mostriamo
     if st.session_state.sf_text:
         st.markdown("### 📄 Specifica Funzionale")
@@ -93,11 +159,14 @@ if uploaded:
             st.markdown("### 📊 Report UFP")
             st.write(st.session_state.ufp_report)
 
+        # Tempi per fase dell'ultima esecuzione
+        if st.session_state.run_metrics:
+            with st.expander(f"⏱️ Tempi per fase (totale {st.session_state.run_metrics['wall_s']:.1f} s)"):
+                st.dataframe(st.session_state.run_metrics["breakdown"], use_container_width=True)
+
         # (Facoltativo) Mostra anche pre-analysis e ufp_info
         # st.markdown("**Pre-analysis:**")
         # st.write(st.session_state.pre_analysis)
         # st.markdown("**UFP info:**")
         # st.write(st.session_state.ufp_info)
 
-    # Pulizia file temporaneo
-    os.remove(tmp_path)
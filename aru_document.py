@@ -0,0 +1,185 @@
+"""aru_document.py
+=================
+Modello in memoria di un documento ARU (.docx).
+
+Il file viene aperto e attraversato UNA sola volta: paragrafi, righe di
+tabella e immagini vengono letti in un unico passaggio e poi condivisi tra
+tutte le fasi della pipeline (estrazione requisiti, analisi FP, OCR, ...),
+invece di riaprire lo stesso zip/XML in ogni modulo.
+
+`AruDocument.outline` è l'indice dei titoli (vedi document_outline.py),
+costruito alla prima richiesta a partire dai livelli registrati nei blocchi.
+"""
+import os
+import re
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from document_outline import DocumentOutline, build_outline
+from metrics import stage_timer
+
+
+@dataclass(frozen=True)
+class TextBlock:
+    """Blocco di testo nell'ordine del documento (paragrafo o riga di tabella)."""
+    kind: str               # "paragraph" | "table_row"
+    text: str
+    style: str = ""         # nome dello stile Word (solo per i paragrafi)
+    table_index: int = -1   # indice della tabella di appartenenza (solo righe)
+    level: int = 0          # livello di titolo (stile "Heading N" o outlineLvl), 0 = testo
+
+
+@dataclass(frozen=True)
+class AruImage:
+    """Immagine incorporata nel DOCX, mantenuta come blob in memoria."""
+    name: str
+    blob: bytes
+    sha256: str
+
+
+@dataclass
+class AruDocument:
+    path: str
+    blocks: List[TextBlock] = field(default_factory=list)
+    tables: List[List[List[str]]] = field(default_factory=list)
+    images: List[AruImage] = field(default_factory=list)
+    content_hash: str = ""
+    _outline: Optional[DocumentOutline] = field(default=None, repr=False, compare=False)
+
+    @property
+    def paragraphs(self) -> List[str]:
+        return [b.text for b in self.blocks if b.kind == "paragraph"]
+
+    @property
+    def table_rows(self) -> List[str]:
+        return [b.text for b in self.blocks if b.kind == "table_row"]
+
+    @property
+    def text(self) -> str:
+        """
+        Testo di paragrafi + tabelle nello stesso formato storico di
+        `extract_text_from_docx`: prima tutti i paragrafi, poi le righe di
+        tabella unite da " | ". Mantiene invariati prompt e chiavi di cache.
+        """
+        return "\n".join(self.paragraphs + self.table_rows)
+
+    @property
+    def image_blobs(self) -> List[bytes]:
+        return [img.blob for img in self.images]
+
+    @property
+    def outline(self) -> DocumentOutline:
+        if self._outline is None:
+            self._outline = build_outline(self.blocks)
+        return self._outline
+
+
+_HEADING_STYLE_RE = re.compile(r"^(heading|titolo)\s*(\d)$", re.IGNORECASE)
+
+
+def _heading_level(par) -> int:
+    """Livello di titolo dallo stile (anche ereditato) o da w:outlineLvl; 0 se testo."""
+    style = par.style
+    for _ in range(5):
+        if style is None:
+            break
+        m = _HEADING_STYLE_RE.match(style.name or "")
+        if m:
+            return int(m.group(2))
+        style = style.base_style
+    for ppr in (par._p.pPr, par.style.element.pPr if par.style is not None else None):
+        lvl = ppr.find(qn("w:outlineLvl")) if ppr is not None else None
+        if lvl is not None and int(lvl.get(qn("w:val"), 9)) < 9:
+            return int(lvl.get(qn("w:val"))) + 1
+    return 0
+
+
+def _row_text(row) -> str:
+    cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+    return " | ".join(cells)
+
+
+def _compute_content_hash(blocks, images) -> str:
+    # Testo normalizzato (spazi compressi): modifiche di sola formattazione
+    # non cambiano l'impronta del documento
+    h = hashlib.sha256()
+    for b in blocks:
+        h.update(" ".join(b.text.split()).encode("utf-8")); h.update(b"\n")
+    for img in images:
+        h.update(img.sha256.encode("ascii"))
+    return h.hexdigest()
+
+
+def load_aru_document(docx_path: str) -> AruDocument:
+    """
+    Apre il DOCX una sola volta e costruisce l'`AruDocument`:
+      - blocchi di testo (paragrafi e righe di tabella) in ordine di documento
+      - tabelle come matrici di celle
+      - immagini incorporate come blob + hash SHA-256
+      - hash del contenuto (testo + hash immagini)
+    """
+    if not os.path.exists(docx_path):
+        raise FileNotFoundError(f"Il file {docx_path} non esiste.")
+
+    with stage_timer("docx_parse"):
+        return _load(docx_path)
+
+
+def _load(docx_path: str) -> AruDocument:
+    doc = Document(docx_path)
+    blocks, tables = [], []
+
+    for child in doc.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            par = Paragraph(child, doc)
+            text = par.text.strip()
+            if text:
+                style = par.style.name if par.style is not None else ""
+                blocks.append(TextBlock("paragraph", text, style=style, level=_heading_level(par)))
+        elif tag == "tbl":
+            table = Table(child, doc)
+            t_idx = len(tables)
+            rows = []
+            for row in table.rows:
+                rows.append([cell.text.strip() for cell in row.cells])
+                row_text = _row_text(row)
+                if row_text:
+                    blocks.append(TextBlock("table_row", row_text, table_index=t_idx))
+            tables.append(rows)
+
+    images = []
+    with stage_timer("docx_images"):
+        for rel in doc.part.rels.values():
+            try:
+                if rel.is_external or "image" not in rel.target_ref:
+                    continue
+                blob = rel.target_part.blob
+                images.append(AruImage(
+                    name=os.path.basename(rel.target_ref),
+                    blob=blob,
+                    sha256=hashlib.sha256(blob).hexdigest(),
+                ))
+            except Exception as e:
+                print(f"Immagine non valida ignorata: {e}")
+
+    return AruDocument(
+        path=docx_path,
+        blocks=blocks,
+        tables=tables,
+        images=images,
+        content_hash=_compute_content_hash(blocks, images),
+    )
+
+
+def as_aru_document(source: Union[str, AruDocument]) -> AruDocument:
+    """Accetta un path o un `AruDocument` già caricato (compatibilità)."""
+    if isinstance(source, AruDocument):
+        return source
+    return load_aru_document(source)
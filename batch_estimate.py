@@ -0,0 +1,201 @@
+"""batch_estimate.py
+==================
+Stima in batch di una cartella (o di un glob) di documenti ARU.
+
+I documenti vengono elaborati in parallelo da N worker (thread dello stesso
+processo, quindi condividono il lettore OCR già caricato e le cache LLM/OCR).
+Per ogni documento viene creata una cartella `<nome>-<hash>/` con SF, report
+UFP, pre-analisi, info FP, metriche e un `result.json`; alla fine (e dopo ogni
+documento) viene aggiornato il manifest riassuntivo `manifest.json` /
+`manifest.csv` con i totali UFP e i tempi.
+
+La stima è riprendibile: i documenti con `result.json` in stato "ok" vengono
+saltati (salvo --force), quindi dopo un crash basta rilanciare lo stesso comando.
+
+Uso:
+    python batch_estimate.py ARU_dir/ --workers 4 --output-dir batch_output
+    python batch_estimate.py "ARU_dir/**/*.docx" --force
+"""
+import os
+import csv
+import glob
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+logger = logging.getLogger("UFP_Agents.batch")
+
+RESULT_FILE = "result.json"
+MANIFEST_FIELDS = ["document", "status", "ufp_total", "seconds", "output_dir",
+                   "finished_at", "error"]
+
+
+def discover_documents(inputs):
+    """Espande cartelle e glob in una lista ordinata e senza duplicati di .docx."""
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*.docx")
+        else:
+            pattern = item
+        for path in glob.glob(pattern, recursive=True):
+            name = os.path.basename(path)
+            if name.lower().endswith(".docx") and not name.startswith("~$"):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def document_output_dir(output_dir, docx_path, digest):
+    """Cartella degli artefatti: nome del file + prefisso dell'hash del contenuto."""
+    stem = os.path.splitext(os.path.basename(docx_path))[0]
+    return os.path.join(output_dir, f"{stem}-{digest[:10]}")
+
+
+def _write_json(path, payload):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _write_text(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text or "")
+    os.replace(tmp, path)
+
+
+def load_result(doc_dir):
+    path = os.path.join(doc_dir, RESULT_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Manifest:
+    """Manifest riassuntivo (JSON + CSV), riscritto in modo atomico a ogni aggiornamento."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.rows = {}
+        self._lock = threading.Lock()
+
+    def update(self, row):
+        with self._lock:
+            self.rows[row["document"]] = row
+            self._flush()
+
+    def _flush(self):
+        rows = sorted(self.rows.values(), key=lambda r: r["document"])
+        done = [r for r in rows if r["status"] == "ok"]
+        _write_json(os.path.join(self.output_dir, "manifest.json"), {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "documents": len(rows),
+            "completed": len(done),
+            "failed": sum(r["status"] == "error" for r in rows),
+            "ufp_total": sum(r["ufp_total"] or 0 for r in done),
+            "results": rows,
+        })
+        tmp = os.path.join(self.output_dir, "manifest.csv.tmp")
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp, os.path.join(self.output_dir, "manifest.csv"))
+
+
+def estimate_document(docx_path, output_dir, force=False):
+    """Stima un documento scrivendo gli artefatti nella sua cartella; ritorna la riga del manifest."""
+    import agente_calcolo  # import ritardato: legge l'ambiente (.env) all'import
+
+    digest = _file_sha256(docx_path)
+    doc_dir = document_output_dir(output_dir, docx_path, digest)
+    previous = load_result(doc_dir)
+    if previous and previous.get("status") == "ok" and not force:
+        logger.info("Già stimato, salto: %s", docx_path)
+        return dict(previous, skipped=True)
+
+    os.makedirs(doc_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    row = {"document": docx_path, "output_dir": doc_dir, "sha256": digest}
+    try:
+        run = agente_calcolo.run_pipeline_graph(docx_path, output_dir=doc_dir,
+                                                use_result_store=not force)
+        r = run.results
+        _write_text(os.path.join(doc_dir, "pre_analisi.md"), r["pre_analysis"])
+        _write_text(os.path.join(doc_dir, "info_fp.md"), r["fp_analysis"])
+        _write_json(os.path.join(doc_dir, "metrics.json"), run.metrics)
+        row.update(status="ok", ufp_total=agente_calcolo.parse_total_ufp(r["ufp"]), error=None)
+    except Exception as e:
+        logger.exception("Stima fallita per %s", docx_path)
+        row.update(status="error", ufp_total=None, error=f"{type(e).__name__}: {e}")
+    row.update(seconds=round(time.perf_counter() - t0, 3),
+               finished_at=datetime.now().isoformat(timespec="seconds"))
+    # result.json è scritto per ultimo: segna il documento come completato
+    _write_json(os.path.join(doc_dir, RESULT_FILE), row)
+    return row
+
+
+def run_batch(inputs, output_dir="batch_output", workers=2, force=False, warm_up=True):
+    """Stima tutti i documenti trovati in `inputs`; ritorna le righe del manifest."""
+    documents = discover_documents(inputs)
+    if not documents:
+        logger.warning("Nessun documento .docx trovato in %s", ", ".join(inputs))
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+    if warm_up:
+        # Carica i modelli una sola volta, prima di avviare i worker
+        from warmup import warm_up
+        warm_up()
+
+    manifest = Manifest(output_dir)
+    logger.info("Stima batch di %d documenti con %d worker", len(documents), workers)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(estimate_document, p, output_dir, force): p for p in documents}
+        for n, fut in enumerate(as_completed(futures), start=1):
+            row = fut.result()
+            manifest.update({k: row.get(k) for k in MANIFEST_FIELDS})
+            state = "saltato" if row.get("skipped") else row["status"]
+            logger.info("[%d/%d] %s – %s (UFP=%s, %.1fs)", n, len(documents),
+                        os.path.basename(futures[fut]), state, row.get("ufp_total"),
+                        row.get("seconds") or 0.0)
+    logger.info("Batch completato in %.1fs – manifest in %s",
+                time.perf_counter() - t0, os.path.join(output_dir, "manifest.json"))
+    return sorted(manifest.rows.values(), key=lambda r: r["document"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stima UFP in batch di documenti ARU")
+    parser.add_argument("inputs", nargs="+", help="cartelle o glob di file .docx")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_WORKERS", "2")))
+    parser.add_argument("--force", action="store_true",
+                        help="ristima anche i documenti già completati")
+    parser.add_argument("--no-warmup", action="store_true", help="non precarica i modelli (OCR, manuale)")
+    args = parser.parse_args(argv)
+    import agente_calcolo  # noqa: F401 – configura il logger "UFP_Agents"
+    rows = run_batch(args.inputs, output_dir=args.output_dir, workers=args.workers,
+                     force=args.force, warm_up=not args.no_warmup)
+    return 1 if any(r["status"] == "error" for r in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
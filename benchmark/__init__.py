@@ -0,0 +1 @@
+"""Benchmark end-to-end della pipeline UFP (corpus ARU sintetico + stub OpenAI locale)."""
@@ -0,0 +1,145 @@
+"""openai_stub.py
+================
+Server HTTP locale compatibile con le Chat Completions di OpenAI / Azure OpenAI,
+con latenza e throughput di generazione configurabili. Serve per misurare la
+pipeline senza un deployment Azure reale.
+
+Percorsi supportati:
+  POST /openai/deployments/<deployment>/chat/completions?api-version=...   (Azure)
+  POST /v1/chat/completions                                                (OpenAI)
+Supporta anche `stream: true` (Server-Sent Events).
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_FILLER = ("analisi funzione processo elementare dati logici interfaccia utente "
+           "report consultazione inserimento archivio").split()
+
+
+_FUNCTION_TYPES = ("ILF", "EIF", "EI", "EO", "EQ")
+
+
+def _json_functions(digest):
+    """Array JSON di 1-4 funzioni, come le risposte ai prompt di classificazione."""
+    return json.dumps([
+        {"type": _FUNCTION_TYPES[digest[2 + i] % len(_FUNCTION_TYPES)],
+         "name": f"{_FILLER[digest[8 + i] % len(_FILLER)]} {_FILLER[digest[16 + i] % len(_FILLER)]} {i + 1}",
+         "justification": "stub"}
+        for i in range(1 + digest[1] % 4)
+    ], ensure_ascii=False)
+
+
+def default_responder(messages, max_tokens):
+    """
+    Risposta deterministica (dipende solo dai messaggi): ai prompt che chiedono
+    un array JSON (classificazione per requisito, analisi FP strutturata) un
+    array di funzioni; agli altri testo di riempimento con una riga
+    "Totale UFP = N", come i report reali, così clamp e Agile vengono esercitati.
+    """
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+    if messages and "array JSON" in messages[-1].get("content", ""):
+        return _json_functions(digest)
+    n_words = min(max_tokens or 256, 200 + digest[0])
+    words = [_FILLER[(digest[i % len(digest)] + i) % len(_FILLER)] for i in range(n_words)]
+    return " ".join(words) + f"\n\nTotale UFP = {50 + digest[1]}"
+
+
+class StubConfig:
+    def __init__(self, latency=0.5, tokens_per_second=50.0, responder=default_responder):
+        self.latency = latency                      # attesa prima del primo token (s)
+        self.tokens_per_second = tokens_per_second  # 0 = generazione istantanea
+        self.responder = responder
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+def _make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0]
+            if not path.endswith("/chat/completions"):
+                self.send_error(404); return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            config.count()
+            messages = body.get("messages", [])
+            content = config.responder(messages, body.get("max_tokens"))
+            tokens = content.split(" ")
+            prompt_tokens = sum(len(m.get("content", "")) // 4 for m in messages)
+            per_token = 1.0 / config.tokens_per_second if config.tokens_per_second else 0.0
+
+            time.sleep(config.latency)
+            if body.get("stream"):
+                self._stream(tokens, per_token)
+            else:
+                time.sleep(per_token * len(tokens))
+                self._json({
+                    "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                              "total_tokens": prompt_tokens + len(tokens)},
+                })
+
+        def _json(self, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, tokens, per_token):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, tok in enumerate(tokens):
+                time.sleep(per_token)
+                delta = {"content": tok if i == 0 else " " + tok}
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(host="127.0.0.1", port=0, config=None):
+    """Avvia lo stub in un thread daemon; ritorna (server, base_url)."""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True, name="openai-stub").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub locale OpenAI/Azure Chat Completions")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tps", type=float, default=50.0, help="token/s generati (0 = istantaneo)")
+    args = parser.parse_args()
+    srv, url = start_stub(port=args.port, config=StubConfig(args.latency, args.tps))
+    print(f"Stub OpenAI in ascolto su {url} (Ctrl+C per terminare)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,178 @@
+"""run_benchmark.py
+==================
+Runner end-to-end: genera un corpus ARU sintetico, avvia lo stub OpenAI locale
+e misura `run_pipeline`, `get_functional_requirements`, `parse_aru_docx` e gli
+helper testuali (`remove_index_from_text`, `extract_text_from_docx`,
+`clamp_range`). Riporta percentili di latenza e throughput (documenti/ora) e
+salva i risultati in JSON per confrontare i commit.
+
+Uso (dalla root del repository):
+    python -m benchmark.run_benchmark --profile medium --docs 5 --latency 0.2 --tps 200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+from benchmark.openai_stub import StubConfig, start_stub
+from benchmark.synthetic_aru import PROFILES, AruProfile, generate_corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    """Percentile con interpolazione lineare (q in [0, 100])."""
+    if not values:
+        return None
+    data = sorted(values)
+    k = (len(data) - 1) * q / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+def summarize(samples):
+    return {
+        "n": len(samples),
+        "mean_s": sum(samples) / len(samples) if samples else None,
+        "p50_s": percentile(samples, 50),
+        "p90_s": percentile(samples, 90),
+        "p99_s": percentile(samples, 99),
+        "min_s": min(samples) if samples else None,
+        "max_s": max(samples) if samples else None,
+    }
+
+
+def timeit(fn, *args, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def _configure_environment(base_url, work_dir, warm_cache):
+    """Punta openai allo stub e isola cache/metriche/output nella cartella di lavoro."""
+    os.environ.update({
+        "OPENAI_API_TYPE": "azure",
+        "OPENAI_API_BASE": base_url,
+        "OPENAI_API_VERSION": "2023-05-15",
+        "OPENAI_API_KEY": "stub",
+        "DEPLOYMENT_NAME": "stub-deployment",
+        "UFP_CACHE_DIR": os.path.join(work_dir, ".cache"),
+        "METRICS_DIR": os.path.join(work_dir, "metrics"),
+    })
+    if not warm_cache:
+        os.environ["LLM_CACHE"] = "0"
+        os.environ["RESULT_STORE"] = "0"
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="ufp_bench_")
+    stub, base_url = start_stub(config=StubConfig(args.latency, args.tps))
+    _configure_environment(base_url, work_dir, args.warm_cache)
+
+    # Import dopo la configurazione: i moduli leggono l'ambiente all'import
+    sys.path.insert(0, REPO_ROOT)
+    import openai
+    import agente_calcolo
+    import estrazione_damas_wave as damas
+    import estrazione_dati_utili_wave as dati_utili
+    from aru_document import load_aru_document
+    openai.api_type, openai.api_base = "azure", base_url
+    openai.api_version, openai.api_key = "2023-05-15", "stub"
+
+    profile = PROFILES[args.profile]
+    overrides = {k: getattr(args, k) for k in ("paragraphs", "tables", "rows", "images",
+                                               "requirements")
+                 if getattr(args, k) is not None}
+    profile = AruProfile(**{**profile.__dict__, **overrides})
+    corpus = generate_corpus(os.path.join(work_dir, "corpus"), profile, args.docs)
+    sizes = [os.path.getsize(p) for p in corpus]
+
+    os.chdir(work_dir)  # run_pipeline scrive i .md nella cartella corrente
+    texts = [load_aru_document(p).text for p in corpus]
+    samples = {name: [] for name in ("extract_text_from_docx", "remove_index_from_text",
+                                     "clamp_range", "get_functional_requirements",
+                                     "parse_aru_docx", "run_pipeline")}
+    report_sample = "Totale UFP = 350\n" + "riga di report\n" * 200
+
+    for path, text in zip(corpus, texts):
+        samples["extract_text_from_docx"] += timeit(damas.extract_text_from_docx, path,
+                                                    repeat=args.repeat)
+        samples["remove_index_from_text"] += timeit(damas.remove_index_from_text, text,
+                                                    repeat=args.repeat)
+        samples["clamp_range"] += timeit(agente_calcolo.clamp_range, report_sample,
+                                         repeat=args.repeat)
+        samples["get_functional_requirements"] += timeit(
+            lambda p: damas.get_functional_requirements(p, use_regex=True), path,
+            repeat=args.repeat)
+        samples["parse_aru_docx"] += timeit(dati_utili.parse_aru_docx, path, repeat=args.repeat)
+        samples["run_pipeline"] += timeit(agente_calcolo.run_pipeline, path, repeat=args.repeat)
+
+    stats = {name: summarize(s) for name, s in samples.items()}
+    mean_pipeline = stats["run_pipeline"]["mean_s"]
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "profile": profile.__dict__,
+        "docs": args.docs,
+        "repeat": args.repeat,
+        "avg_docx_bytes": sum(sizes) // len(sizes),
+        "stub": {"latency_s": args.latency, "tokens_per_second": args.tps,
+                 "requests": stub.config.requests},
+        "warm_cache": args.warm_cache,
+        "functions": stats,
+        "throughput_docs_per_hour": (3600.0 / mean_pipeline) if mean_pipeline else None,
+    }
+    stub.shutdown()
+
+    out_dir = os.path.abspath(os.path.join(REPO_ROOT, args.output_dir))
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f"bench-{result['commit']}-{args.profile}-"
+                                     f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"\n=== Benchmark {args.profile} ({args.docs} doc × {args.repeat}) ===")
+    for name, st in stats.items():
+        print(f"{name:30s} p50={st['p50_s']:.4f}s  p90={st['p90_s']:.4f}s  "
+              f"p99={st['p99_s']:.4f}s")
+    print(f"Throughput run_pipeline: {result['throughput_docs_per_hour']:.1f} doc/ora")
+    print(f"Risultati salvati in {out_path}")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end della pipeline UFP")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    parser.add_argument("--docs", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--paragraphs", type=int)
+    parser.add_argument("--tables", type=int)
+    parser.add_argument("--rows", type=int)
+    parser.add_argument("--images", type=int)
+    parser.add_argument("--requirements", type=int)
+    parser.add_argument("--latency", type=float, default=0.2, help="latenza stub prima del primo token (s)")
+    parser.add_argument("--tps", type=float, default=200.0, help="token/s generati dallo stub")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="non disabilita cache LLM e archivio risultati (misura le riesecuzioni)")
+    parser.add_argument("--output-dir", default="benchmark/results")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""synthetic_aru.py
+==================
+Generatore di documenti ARU (.docx) sintetici di dimensione configurabile:
+numero di paragrafi, tabelle, righe per tabella, immagini incorporate e
+presenza della sezione "REQUISITI FUNZIONALI". Stesso seed -> stesso documento.
+"""
+import io
+import os
+import zlib
+import random
+import struct
+import argparse
+from dataclasses import dataclass
+
+from docx import Document
+from docx.shared import Inches
+
+_WORDS = (
+    "il sistema deve consentire all utente di gestire anagrafiche clienti fornitori "
+    "contratti ordini fatture report mensili estrazione dati interfaccia servizio "
+    "autenticazione profilo ruolo amministratore operatore consultazione ricerca "
+    "inserimento modifica cancellazione validazione notifica email archivio storico "
+    "integrazione sistema esterno flusso giornaliero batch elaborazione esito"
+).split()
+
+_ENTITIES = ["Cliente", "Fornitore", "Contratto", "Ordine", "Fattura", "Utente",
+             "Prodotto", "Pagamento", "Richiesta", "Pratica"]
+_ACTIONS = ["inserire", "modificare", "consultare", "cancellare", "esportare",
+            "ricercare", "stampare", "validare"]
+
+
+@dataclass
+class AruProfile:
+    paragraphs: int = 40
+    tables: int = 3
+    rows: int = 10
+    images: int = 2
+    requirements: int = 15          # numero di RF; 0 = nessuna sezione requisiti
+    seed: int = 0
+
+
+PROFILES = {
+    "small":  AruProfile(paragraphs=20,  tables=1,  rows=5,  images=0, requirements=8),
+    "medium": AruProfile(paragraphs=120, tables=6,  rows=15, images=4, requirements=30),
+    "large":  AruProfile(paragraphs=600, tables=20, rows=40, images=12, requirements=120),
+}
+
+
+def _sentence(rnd, n_min=8, n_max=25):
+    words = [rnd.choice(_WORDS) for _ in range(rnd.randint(n_min, n_max))]
+    return " ".join(words).capitalize() + "."
+
+
+def _png(rnd, width=64, height=32, noise=True) -> bytes:
+    """PNG RGB minimale generato senza dipendenze (rumore o tinta unita)."""
+    base = rnd.randrange(256)
+    rows = []
+    for _ in range(height):
+        px = bytes(rnd.randrange(256) if noise else base for _ in range(width * 3))
+        rows.append(b"\x00" + px)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"".join(rows)))
+            + chunk(b"IEND", b""))
+
+
+def generate_aru(path: str, profile: AruProfile) -> str:
+    rnd = random.Random(profile.seed)
+    doc = Document()
+    doc.add_heading(f"Analisi Requisiti Utente – Progetto {profile.seed:04d}", 0)
+
+    # Indice (esercita remove_index_from_text)
+    doc.add_paragraph("Indice")
+    for i, title in enumerate(["Introduzione", "Contesto", "Requisiti Funzionali",
+                               "Requisiti Non Funzionali"], start=1):
+        doc.add_paragraph(f"{i}. {title} {rnd.randint(2, 40)}")
+
+    doc.add_heading("1. Introduzione", 1)
+    # Il logo aziendale si ripete identico in ogni documento del corpus
+    logo = _png(random.Random(42), noise=False)
+    image_slots = sorted(rnd.sample(range(max(profile.paragraphs, 1)),
+                                    min(profile.images, max(profile.paragraphs, 1))))
+    table_slots = sorted(rnd.sample(range(max(profile.paragraphs, 1)),
+                                    min(profile.tables, max(profile.paragraphs, 1))))
+
+    for i in range(profile.paragraphs):
+        if i and i % 25 == 0:
+            doc.add_heading(f"{1 + i // 25}. Sezione {i // 25}", 1)
+        doc.add_paragraph(" ".join(_sentence(rnd) for _ in range(rnd.randint(1, 4))))
+        if i in image_slots:
+            blob = logo if image_slots.index(i) == 0 else _png(rnd)
+            doc.add_picture(io.BytesIO(blob), width=Inches(1.5))
+        if i in table_slots:
+            table = doc.add_table(rows=profile.rows + 1, cols=3)
+            for c, h in enumerate(["Versione", "Data", "Descrizione"]):
+                table.cell(0, c).text = h
+            for r in range(1, profile.rows + 1):
+                table.cell(r, 0).text = f"1.{r}"
+                table.cell(r, 1).text = f"2024-0{1 + r % 9}-1{r % 9}"
+                table.cell(r, 2).text = _sentence(rnd, 3, 8)
+
+    if profile.requirements:
+        doc.add_heading("REQUISITI FUNZIONALI", 1)
+        for n in range(1, profile.requirements + 1):
+            entity, action = rnd.choice(_ENTITIES), rnd.choice(_ACTIONS)
+            doc.add_paragraph(f"RF{n:03d} – Il sistema deve consentire di {action} "
+                              f"i dati di {entity}. {_sentence(rnd)}")
+        doc.add_paragraph("FINE REQUISITI")
+
+    doc.add_heading("Requisiti Non Funzionali", 1)
+    for _ in range(5):
+        doc.add_paragraph(_sentence(rnd))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    doc.save(path)
+    return path
+
+
+def generate_corpus(directory: str, profile: AruProfile, count: int):
+    """Genera `count` documenti con seed consecutivi a partire da profile.seed."""
+    paths = []
+    for i in range(count):
+        p = AruProfile(**{**profile.__dict__, "seed": profile.seed + i})
+        paths.append(generate_aru(os.path.join(directory, f"aru_{p.seed:04d}.docx"), p))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera ARU .docx sintetici")
+    parser.add_argument("directory")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="medium")
+    parser.add_argument("--paragraphs", type=int)
+    parser.add_argument("--tables", type=int)
+    parser.add_argument("--rows", type=int)
+    parser.add_argument("--images", type=int)
+    parser.add_argument("--requirements", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base = PROFILES[args.profile]
+    overrides = {k: v for k, v in vars(args).items()
+                 if k in base.__dict__ and v is not None}
+    prof = AruProfile(**{**base.__dict__, **overrides})
+    for out in generate_corpus(args.directory, prof, args.count):
+        print(out)
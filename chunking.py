@@ -0,0 +1,134 @@
+"""chunking.py
+=============
+Chunking condiviso, basato su token reali invece che sulla stima len/4.
+
+- `count_tokens` usa il tokenizer locale di tiktoken (encoding configurabile
+  con TOKENIZER_ENCODING); se tiktoken non è disponibile si ricade sulla
+  vecchia euristica ~4 caratteri/token.
+- `chunk_text` divide SOLO su confini strutturali (titoli, paragrafi, righe di
+  tabella = righe del testo estratto), con overlap configurabile, riempiendo
+  ogni chunk il più vicino possibile al budget del modello. Una singola riga più
+  lunga del budget viene spezzata prima per frasi e solo in ultima istanza per token.
+"""
+import os
+import re
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger("UFP_Agents.chunking")
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+# Finestra di contesto del deployment (prompt + risposta)
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "16384"))
+DEFAULT_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "128"))
+
+_HEADING_RE = re.compile(r"^(\d+(\.\d+)*\.?\s+\S|[A-ZÀ-Ü0-9][A-ZÀ-Ü0-9 '’/&-]{3,80}$)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning("Tokenizer tiktoken non disponibile (%s): uso stima len/4", e)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def input_budget(max_output_tokens: int, *prompt_parts: str,
+                 context_tokens: int = None, margin: int = 64) -> int:
+    """
+    Token disponibili per il contenuto di un singolo chunk, sottraendo alla
+    finestra di contesto la risposta attesa e le parti fisse del prompt.
+    """
+    context_tokens = context_tokens or MODEL_CONTEXT_TOKENS
+    fixed = sum(count_tokens(p) for p in prompt_parts)
+    return max(256, context_tokens - max_output_tokens - fixed - margin)
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    return bool(line) and len(line) <= 120 and bool(_HEADING_RE.match(line))
+
+
+def _split_by_tokens(text: str, max_tokens: int):
+    enc = _encoding()
+    if enc is None:
+        step = max_tokens * 4
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    ids = enc.encode(text, disallowed_special=())
+    return [enc.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+
+
+def _split_oversized(unit: str, max_tokens: int):
+    """Spezza una riga troppo lunga: prima per frasi, poi per token."""
+    pieces, current, current_tokens = [], [], 0
+    for sentence in _SENTENCE_RE.split(unit):
+        n = count_tokens(sentence)
+        if n > max_tokens:
+            if current:
+                pieces.append(" ".join(current)); current, current_tokens = [], 0
+            pieces.extend(_split_by_tokens(sentence, max_tokens))
+            continue
+        if current and current_tokens + n + 1 > max_tokens:
+            pieces.append(" ".join(current)); current, current_tokens = [], 0
+        current.append(sentence); current_tokens += n + 1
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def split_units(text: str, max_tokens: int):
+    """Unità strutturali (righe non vuote), ciascuna entro `max_tokens`."""
+    units = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if count_tokens(line) > max_tokens:
+            units.extend(_split_oversized(line, max_tokens))
+        else:
+            units.append(line)
+    return units
+
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int = 0,
+               heading_break_ratio: float = 0.8):
+    """
+    Impacchetta le unità strutturali del testo in chunk di al più `max_tokens`
+    token. Un titolo che arriva quando il chunk è già pieno oltre
+    `heading_break_ratio` apre un nuovo chunk, per non lasciarlo orfano in coda.
+    Con `overlap_tokens` > 0 ogni chunk ripete in testa le ultime unità del
+    precedente (fino a quel numero di token).
+    L'output è deterministico: stesso testo e parametri -> stessi chunk.
+    """
+    if not text.strip():
+        return []
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    units = split_units(text, max_tokens - overlap_tokens - 1)
+    sizes = [count_tokens(u) + 1 for u in units]  # +1 per il separatore di riga
+
+    chunks, current, current_tokens, fresh = [], [], 0, 0
+    for unit, size in zip(units, sizes):
+        full = current_tokens + size > max_tokens
+        heading_break = (fresh and is_heading(unit)
+                         and current_tokens >= heading_break_ratio * max_tokens)
+        if current and fresh and (full or heading_break):
+            chunks.append("\n".join(u for u, _ in current))
+            tail, tail_tokens = [], 0
+            for u, s in reversed(current):
+                if tail_tokens + s > overlap_tokens:
+                    break
+                tail.insert(0, (u, s)); tail_tokens += s
+            current, current_tokens, fresh = tail, tail_tokens, 0
+        current.append((unit, size)); current_tokens += size; fresh += 1
+    if current and fresh:
+        chunks.append("\n".join(u for u, _ in current))
+    return chunks
@@ -0,0 +1,104 @@
+"""document_outline.py
+====================
+Indice dei titoli (outline) di un `AruDocument`.
+
+Costruito in un solo passaggio sui blocchi del documento: ogni titolo apre
+una sezione che termina al titolo successivo di livello uguale o superiore,
+quindi ogni sezione è un intervallo di blocchi [start, end) con le proprie
+sottosezioni. I livelli arrivano dagli stili Word ("Heading N"/"Titolo N")
+o dal livello di struttura (outlineLvl) registrati in `TextBlock.level`; solo
+se il documento non ha alcun titolo con stile si ricade sui titoli
+riconosciuti dal testo (numerati "3.2 ..." o in maiuscolo).
+
+Così una sezione (es. "Requisiti Funzionali") si recupera direttamente per
+titolo, senza regex sull'intero testo né chiamate LLM.
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from chunking import is_heading
+
+_NUMBERED_RE = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+\S")
+_TOC_STYLE_RE = re.compile(r"^(toc|sommario|indice)", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class OutlineSection:
+    title: str
+    level: int
+    start: int      # indice del blocco del titolo
+    end: int        # primo blocco dopo la sezione (sottosezioni incluse)
+    styled: bool    # titolo da stile/outlineLvl, non riconosciuto dal testo
+
+    @property
+    def body_blocks(self) -> int:
+        return self.end - self.start - 1
+
+
+def normalize_title(title: str) -> str:
+    """Titolo senza numerazione iniziale, minuscolo e con spazi compattati."""
+    m = _NUMBERED_RE.match(title)
+    if m:
+        title = title[len(m.group(1)):].lstrip(". ")
+    return " ".join(title.split()).casefold()
+
+
+def text_heading_level(block) -> int:
+    """Livello di un titolo riconosciuto dal solo testo (documenti senza stili)."""
+    if block.kind != "paragraph" or _TOC_STYLE_RE.match(block.style) or not is_heading(block.text):
+        return 0
+    m = _NUMBERED_RE.match(block.text)
+    return m.group(1).count(".") + 1 if m else 1
+
+
+class DocumentOutline:
+    def __init__(self, blocks, sections: List[OutlineSection]):
+        self.blocks = blocks
+        self.sections = sections
+        self.by_title: Dict[str, OutlineSection] = {}
+        for s in sections:
+            self.by_title.setdefault(normalize_title(s.title), s)
+
+    def find(self, pattern) -> Optional[OutlineSection]:
+        """
+        Sezione il cui titolo contiene `pattern` (regex, senza distinzione di
+        maiuscole). Le sezioni vuote (es. voci di un indice) sono ignorate e i
+        titoli con stile hanno la precedenza su quelli riconosciuti dal testo.
+        """
+        rx = re.compile(pattern, re.IGNORECASE)
+        matches = [s for s in self.sections if s.body_blocks > 0 and rx.search(s.title)]
+        return min(matches, key=lambda s: (not s.styled, s.start)) if matches else None
+
+    def section_text(self, section: OutlineSection, stop=None) -> str:
+        """Titolo e contenuto della sezione in ordine di documento, fino a `stop` (escluso)."""
+        stop = re.compile(stop, re.IGNORECASE) if isinstance(stop, str) else stop
+        lines = []
+        for block in self.blocks[section.start:section.end]:
+            if stop is not None and lines and stop.match(block.text):
+                break
+            lines.append(block.text)
+        return "\n".join(lines)
+
+    def lookup(self, pattern, stop=None) -> str:
+        """Testo della sezione cercata per titolo, stringa vuota se non presente."""
+        section = self.find(pattern)
+        return self.section_text(section, stop) if section else ""
+
+
+def build_outline(blocks) -> DocumentOutline:
+    """Outline dei blocchi in un solo passaggio (pila delle sezioni aperte)."""
+    styled = any(b.level for b in blocks)
+    sections, open_sections = [], []
+    for i, block in enumerate(blocks):
+        level = block.level if styled else text_heading_level(block)
+        if block.kind != "paragraph" or not level:
+            continue
+        while open_sections and open_sections[-1][0] >= level:
+            lvl, title, start = open_sections.pop()
+            sections.append(OutlineSection(title, lvl, start, i, styled))
+        open_sections.append((level, block.text, i))
+    for lvl, title, start in open_sections:
+        sections.append(OutlineSection(title, lvl, start, len(blocks), styled))
+    sections.sort(key=lambda s: s.start)
+    return DocumentOutline(blocks, sections)
@@ -0,0 +1,167 @@
+"""embedding_cache.py
+===================
+Cache degli embedding delle query di retrieval.
+
+Chiave: nome del modello + testo normalizzato (spazi compattati, Unicode NFC);
+il modello codifica sempre il testo normalizzato, quindi due query che
+differiscono solo per spazi o a capo hanno lo stesso vettore.
+
+Due livelli:
+  - LRU in memoria di processo (EMBEDDING_CACHE_LRU voci);
+  - cache SQLite su disco, condivisa tra processi ed esecuzioni.
+
+`encode_cached` risolve un intero batch con una lookup per livello e manda al
+modello, in un solo `encode`, soltanto i testi mancanti. Frasi ricorrenti
+negli ARU ("gestione anagrafiche", "reportistica", ...) non passano più dal
+forward pass del modello.
+"""
+import os
+import base64
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+from metrics import stage_timer
+from sqlite_cache import SQLiteCache, cache_path
+
+logger = logging.getLogger("UFP_Agents.embeddings")
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "1") != "0"
+EMBEDDING_CACHE_LRU = int(os.getenv("EMBEDDING_CACHE_LRU", "4096"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return f"{model_name}:{hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()}"
+
+
+def _dumps(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype="float32").tobytes()).decode("ascii")
+
+
+def _loads(value: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(value), dtype="float32")
+
+
+class EmbeddingCache:
+    def __init__(self, disk: SQLiteCache = None, lru_size=EMBEDDING_CACHE_LRU):
+        self.disk = disk
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, vector):
+        # Da chiamare con il lock acquisito
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def lookup(self, keys) -> dict:
+        """Vettori già noti per le chiavi date (memoria, poi disco in una sola query)."""
+        found, missing = {}, []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                else:
+                    missing.append(key)
+            self.memory_hits += len(found)
+        from_disk = {}
+        if missing and self.disk is not None:
+            from_disk = {k: _loads(v) for k, v in self.disk.get_many(missing).items()}
+        with self._lock:
+            for key, vector in from_disk.items():
+                self._remember(key, vector)
+            self.disk_hits += len(from_disk)
+            self.misses += len(missing) - len(from_disk)
+        found.update(from_disk)
+        return found
+
+    def store(self, vectors: dict):
+        with self._lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+        if self.disk is not None:
+            self.disk.set_many((k, _dumps(v)) for k, v in vectors.items())
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.memory_hits + self.disk_hits) / lookups) if lookups else 0.0,
+                "lru_entries": len(self._lru),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(SQLiteCache(cache_path("embedding_cache.sqlite"),
+                                                    max_entries=EMBEDDING_CACHE_MAX_ENTRIES))
+    return _cache
+
+
+def encode_cached(model, texts: List[str], model_name: str, batch_size=64,
+                  use_cache=EMBEDDING_CACHE_ENABLED) -> np.ndarray:
+    """
+    Embedding (float32) di `texts`, nello stesso ordine. Solo i testi mai visti
+    con questo modello vengono codificati, in un unico batch.
+    """
+    normalized = [normalize_text(t) for t in texts]
+    if not use_cache:
+        unique = list(dict.fromkeys(normalized))
+        emb = np.asarray(model.encode(unique, batch_size=batch_size), dtype="float32")
+        pos = {t: i for i, t in enumerate(unique)}
+        return emb[[pos[t] for t in normalized]]
+
+    cache = get_embedding_cache()
+    keys = [embedding_key(model_name, t) for t in normalized]
+    vectors = cache.lookup(keys)
+    misses = list(dict.fromkeys(k for k in keys if k not in vectors))
+    if misses:
+        text_of = dict(zip(keys, normalized))
+        with stage_timer("embedding_encode"):
+            emb = np.asarray(model.encode([text_of[k] for k in misses], batch_size=batch_size),
+                             dtype="float32")
+        fresh = dict(zip(misses, emb))
+        cache.store(fresh)
+        vectors.update(fresh)
+    logger.debug("Embedding: %d testi, %d codificati", len(texts), len(misses))
+    return np.vstack([vectors[k] for k in keys]) if keys else np.zeros((0, 0), "float32")
+
+
+def embedding_cache_stats() -> dict:
+    """Hit rate per livello (memoria/disco) e dimensione della cache su disco."""
+    cache = get_embedding_cache()
+    stats = cache.stats()
+    stats["disk"] = cache.disk.stats() if cache.disk is not None else None
+    return stats
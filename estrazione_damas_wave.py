@@ -1,11 +1,16 @@
 import os
 import re
-import tempfile
 import openai
-import easyocr
-from docx import Document
 from dotenv import load_dotenv
 
+from aru_document import as_aru_document, load_aru_document
+from ocr_engine import ocr_images
+from llm_client import chat_completion, run_concurrently
+from chunking import chunk_text, count_tokens, input_budget
+from metrics import record_degraded, stage_timer
+from llm_transport import CassetteNotFoundError
+from text_compaction import compact_for_llm
+
 
 # Carica variabili d'ambiente dal file .env (opzionale)
 load_dotenv()
@@ -17,6 +22,15 @@ openai.api_version = os.getenv("OPENAI_API_VERSION")
 openai.api_key = os.getenv("OPENAI_API_KEY")
 DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
 
+# Versione del prompt di estrazione: incrementarla invalida le risposte in cache
+PROMPT_REQ_VERSION = "req-extract-v1"
+# Versione della logica di estrazione (outline → regex/AI): fa parte della firma dei risultati
+REQUIREMENTS_EXTRACTION_VERSION = "outline-v1"
+
+# Titolo della sezione requisiti nell'outline del documento e marcatore di fine sezione
+REQUIREMENTS_SECTION_TITLE = r"requisiti\s+funzionali"
+REQUIREMENTS_END_MARKER = r"FINE\s+REQ"
+
 
 # =========================================
 # 1. Estrazione testo da DOCX (paragrafi + tabelle + immagini OCR)
@@ -25,114 +39,73 @@ def extract_text_from_docx(docx_path):
     """
     Estrae testo dai paragrafi e dalle tabelle di un file DOCX.
     Ritorna il testo concatenato.
+    (Wrapper di compatibilità: la pipeline usa direttamente `AruDocument`.)
     """
     try:
-        doc = Document(docx_path)
-        extracted_text = []
-
-        # Estrarre testo dai paragrafi
-        for paragraph in doc.paragraphs:
-            text = paragraph.text.strip()
-            if text:
-                extracted_text.append(text)
-
-        # Estrarre testo dalle tabelle
-        for table in doc.tables:
-            for row in table.rows:
-                row_text = [cell.text.strip() for cell in row.cells if cell.text.strip()]
-                if row_text:
-                    extracted_text.append(" | ".join(row_text))
-
-        return "\n".join(extracted_text)
+        return load_aru_document(docx_path).text
     except Exception as e:
         print(f"Errore durante l'estrazione del testo da docx: {e}")
         return ""
 
 
-def extract_images_from_docx(docx_path, temp_dir):
-    """
-    Estrae tutte le immagini dal file .docx, salvandole in temp_dir.
-    Ritorna la lista dei percorsi delle immagini estratte.
-    """
-    try:
-        doc = Document(docx_path)
-        image_paths = []
-
-        for rel in doc.part._rels.values():
-            if "image" in rel.target_ref:
-                image_data = rel.target_part.blob
-                image_filename = os.path.join(temp_dir, os.path.basename(rel.target_ref))
-                with open(image_filename, "wb") as img_file:
-                    img_file.write(image_data)
-                image_paths.append(image_filename)
-
-        return image_paths
-    except Exception as e:
-        print(f"Errore durante l'estrazione delle immagini: {e}")
-        return []
-
-
-def extract_text_from_images(image_paths):
+def extract_text_from_images(images, ocr_texts=None):
     """
-    Esegue OCR sulle immagini in image_paths utilizzando EasyOCR.
-    Ignora errori su immagini non leggibili.
+    Esegue OCR sulle immagini (blob in memoria o path) utilizzando il
+    Reader EasyOCR condiviso e la cache OCR su disco (vedi ocr_engine.py).
+    `ocr_texts` sono i risultati già calcolati (output di `ocr_images`):
+    se presenti l'OCR non viene rieseguito.
+    Le immagini non leggibili producono testo vuoto.
     """
     try:
-        reader = easyocr.Reader(['it', 'en'], gpu=False)
-        ocr_texts = []
-        for img_path in image_paths:
-            try:
-                result = reader.readtext(img_path, detail=0)
-                ocr_texts.append(" ".join(result).strip())
-            except Exception as e:
-                print(f"Errore OCR su immagine {img_path}: {e}")
-        return "\n".join(ocr_texts)
+        if ocr_texts is None:
+            ocr_texts = ocr_images(images)
+        return "\n".join(" ".join(result).strip() for result in ocr_texts)
     except Exception as e:
         print(f"Errore OCR complessivo: {e}")
+        record_degraded("ocr", e)
         return ""
 
 
-def extract_all_content(docx_path):
+def extract_all_content(document, ocr_texts=None):
     """
     Unisce testo da paragrafi/tabelle + testo estratto da immagini.
+    `document` è un `AruDocument` già caricato (o, per compatibilità, un path);
+    `ocr_texts` sono i risultati OCR delle sue immagini, se già calcolati.
     """
     try:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            text_paragraphs_tables = extract_text_from_docx(docx_path)
-            image_paths = extract_images_from_docx(docx_path, temp_dir)
-            text_images = extract_text_from_images(image_paths)
-
-        full_text = text_paragraphs_tables
-        if text_images:
-            full_text += "\n\n[TESTO ESTRATTO DA IMMAGINI]\n" + text_images
+        document = as_aru_document(document)
+        full_text = document.text
+        if document.images:
+            text_images = extract_text_from_images(document.image_blobs, ocr_texts)
+            if text_images:
+                full_text += "\n\n[TESTO ESTRATTO DA IMMAGINI]\n" + text_images
 
         return full_text
     except Exception as e:
         print(f"Errore durante l'estrazione del contenuto: {e}")
+        record_degraded("requirements", e)
         return ""
 
 
 # =========================================
 # 2. Rimozione eventuali indici / sommari (facoltativo)
 # =========================================
+_INDEX_LINE_RE = re.compile(
+    r"^\d+\.\s+.*\s+\d+$"           # Esempio: "1. Introduzione  3"
+    r"|^(?i:indice).*$"              # Linea che inizia con "Indice"
+    r"|^(?i:sommario).*$"
+    r"|^\d+\s+[A-Za-z].*\d+$"         # "1 Titolo 1"
+    r"|^[IVXLCDM]+\.\s+.*$",           # Numerazione romana: "I. Titolo"
+    re.MULTILINE,
+)
+
 def remove_index_from_text(full_text):
     """
-    Rimuove parti di testo che assomigliano a un indice / sommario.
+    Rimuove parti di testo che assomigliano a un indice / sommario,
+    con un solo passaggio della regex combinata `_INDEX_LINE_RE`.
     """
     try:
-        patterns = [
-            re.compile(r"^\d+\.\s+.*\s+\d+$", re.MULTILINE),  # Esempio: "1. Introduzione  3"
-            re.compile(r"^Indice.*$", re.IGNORECASE | re.MULTILINE),  # Linea che inizia con "Indice"
-            re.compile(r"^Sommario.*$", re.IGNORECASE | re.MULTILINE),
-            re.compile(r"^\d+\s+[A-Za-z].*\d+$", re.MULTILINE),  # "1 Titolo 1"
-            re.compile(r"^[IVXLCDM]+\.\s+.*$", re.MULTILINE)  # Numerazione romana: "I. Titolo"
-        ]
-
-        filtered_text = full_text
-        for pattern in patterns:
-            filtered_text = re.sub(pattern, "", filtered_text)
-
-        return filtered_text
+        return _INDEX_LINE_RE.sub("", full_text)
     except Exception as e:
         print(f"Errore durante la rimozione dell'indice: {e}")
         return full_text
@@ -189,19 +162,16 @@ def extract_functional_requirements_with_ai(full_text):
         )
 
         # --------------------------------------------------------------------
-        # 4a) Evita chunking se la lunghezza < soglia (e.g., 7000 token).
-        #     In caso di modelli con contesti più ampi (es. GPT-3.5 16k),
-        #     puoi regolare la soglia.
-        #     NB: qui non facciamo conti di token precisi, è un esempio.
+        # 4a) Evita chunking se il testo sta nel budget del modello.
+        #     Il budget è calcolato in token reali (chunking.py) sottraendo alla
+        #     finestra di contesto (MODEL_CONTEXT_TOKENS) risposta e prompt di sistema.
         # --------------------------------------------------------------------
-        # Verifica lunghezza approssimativa in token (semplificato)
-        approx_token_len = int(len(full_text) / 4)  # stima rozza (1 token ~ 4 caratteri)
-        TOKEN_LIMIT = 7000
+        token_len = count_tokens(full_text)
+        TOKEN_LIMIT = input_budget(3000, system_message)
 
-        if approx_token_len <= TOKEN_LIMIT:
+        if token_len <= TOKEN_LIMIT:
             # Chiediamo direttamente con un singolo prompt
-            response = openai.ChatCompletion.create(
-                engine=DEPLOYMENT_NAME,
+            response = chat_completion(
                 messages=[
                     {"role": "system", "content": system_message},
                     {"role": "user", "content": full_text}
@@ -210,33 +180,27 @@ def extract_functional_requirements_with_ai(full_text):
                 temperature=0.0,
                 top_p=1.0,
                 presence_penalty=0,
-                frequency_penalty=0
+                frequency_penalty=0,
+                prompt_version=PROMPT_REQ_VERSION
             )
-            extracted = response['choices'][0]['message']['content'].strip()
+            extracted = response.strip()
             return extracted
         else:
             # ----------------------------------------------------------------
-            # 4b) Se il testo è troppo grande, dividiamo in chunk fissi.
-            #     Mantieni SEMPRE la stessa dimensione, stesso ordine.
+            # 4b) Se il testo è troppo grande, dividiamo in chunk su confini
+            #     strutturali (titoli, paragrafi, righe di tabella), riempiti
+            #     fino al budget in token. Stesso testo -> stessi chunk.
+            #     Nessun overlap: il testo viene copiato letteralmente e un
+            #     overlap produrrebbe righe duplicate nel risultato.
             # ----------------------------------------------------------------
-            chunk_size = 6000  # Approssimazione in "caratteri"
-            # Se vuoi più rigore, usa un contatore di token esatto (es: tiktoken).
-            chunks = []
-            start = 0
-            while start < len(full_text):
-                end = start + chunk_size
-                chunk = full_text[start:end]
-                chunks.append(chunk)
-                start = end
+            chunks = chunk_text(full_text, input_budget(2000, system_message))
 
             # Ora estraiamo i requisiti da ogni chunk e uniamo.
             # Attenzione: potresti ricevere "pezzi" di testo tronchi tra chunk.
             # Se la sezione Requisiti Funz. si spezza su più chunk, c’è da definire
             # come gestire la continuità. Per semplicità, concateno direttamente i risultati.
-            extracted_sections = []
-            for c in chunks:
-                response = openai.ChatCompletion.create(
-                    engine=DEPLOYMENT_NAME,
+            def extract_chunk(c):
+                response = chat_completion(
                     messages=[
                         {"role": "system", "content": system_message},
                         {"role": "user", "content": c}
@@ -245,45 +209,76 @@ def extract_functional_requirements_with_ai(full_text):
                     temperature=0.0,
                     top_p=1.0,
                     presence_penalty=0,
-                    frequency_penalty=0
+                    frequency_penalty=0,
+                    prompt_version=PROMPT_REQ_VERSION
                 )
-                part_extracted = response['choices'][0]['message']['content'].strip()
-                extracted_sections.append(part_extracted)
+                return response.strip()
+
+            # I chunk vengono inviati in parallelo (concorrenza limitata da
+            # LLM_MAX_CONCURRENCY) ma i risultati restano nell'ordine dei chunk.
+            extracted_sections = run_concurrently(lambda c=c: extract_chunk(c) for c in chunks)
 
             # Unisci in modo meccanico (fai attenzione a non perdere continuità se la sezione è tagliata a metà)
             # In modo super-semplice:
             return "\n".join(extracted_sections)
 
+    except CassetteNotFoundError:
+        # In replay una richiesta non registrata deve fallire in modo esplicito
+        raise
     except Exception as e:
         print(f"Errore durante l'estrazione AI dei requisiti funzionali: {e}")
+        record_degraded("requirements", e)
         return "Errore AI durante l'estrazione."
 
 
 # =========================================
 # 5. Funzione Principale
 # =========================================
-def get_functional_requirements(docx_path, use_regex=False):
+def find_requirements_section(document):
     """
-    Data la path di un file docx, estrae il contenuto, filtra indici/sommari
-    e cerca la sezione 'Requisiti Funzionali'.
-    Se use_regex=True, usa un pattern fisso (se la struttura del doc è prevedibile).
-    Altrimenti, usa AI in modo deterministico.
+    Testo della sezione 'Requisiti Funzionali' trovata per titolo
+    nell'outline dell'`AruDocument`, stringa vuota se non presente.
     """
-    if not os.path.exists(docx_path):
-        print(f"Errore: il file {docx_path} non esiste o non è accessibile.")
+    with stage_timer("requirements_outline"):
+        return document.outline.lookup(REQUIREMENTS_SECTION_TITLE, stop=REQUIREMENTS_END_MARKER)
+
+
+def get_functional_requirements(document, use_regex=False, ocr_texts=None):
+    """
+    Dato un `AruDocument` (o la path di un file docx), cerca la sezione
+    'Requisiti Funzionali' nell'indice dei titoli del documento (outline).
+    Solo se l'outline non la contiene estrae il contenuto (testo più OCR delle
+    immagini, riusando `ocr_texts` se già calcolati), filtra indici/sommari e
+    usa un pattern fisso (use_regex=True, se la struttura del doc è
+    prevedibile) oppure l'AI in modo deterministico.
+    """
+    try:
+        document = as_aru_document(document)
+    except FileNotFoundError:
+        print(f"Errore: il file {document} non esiste o non è accessibile.")
         return ""
 
+    # 0) Sezione trovata per titolo: nessuna regex sul testo intero, nessuna chiamata LLM
+    section_text = find_requirements_section(document)
+    if section_text:
+        return compact_for_llm(section_text, "requisiti")
+
     # 1) Estrai tutto
-    full_content = extract_all_content(docx_path)
+    full_content = extract_all_content(document, ocr_texts)
     # 2) Rimuovi eventuali indici / sommari
     filtered_content = remove_index_from_text(full_content)
+    # 3) Compatta il testo (boilerplate, righe ripetute, spazi): lo stesso
+    #    testo arriva poi ai prompt di estrazione, SF e UFP
+    filtered_content = compact_for_llm(filtered_content, "requisiti")
 
     if use_regex:
         # Estraggo via Regex (se la struttura è nota)
-        return extract_functional_requirements_regex(filtered_content)
+        with stage_timer("requirements_regex"):
+            return extract_functional_requirements_regex(filtered_content)
     else:
         # Estraggo via AI con parametri deterministici
-        return extract_functional_requirements_with_ai(filtered_content)
+        with stage_timer("requirements_ai"):
+            return extract_functional_requirements_with_ai(filtered_content)
 
 
 # =========================================
@@ -1,13 +1,24 @@
 
 
 import os
-import tempfile
 import re
+import logging
 import openai
-from docx import Document
-from easyocr import Reader
+from dataclasses import dataclass, field
+from typing import List
 from dotenv import load_dotenv
 
+from aru_document import as_aru_document
+from ocr_engine import ocr_images
+from llm_client import chat_completion, run_concurrently
+from llm_transport import CassetteNotFoundError
+from chunking import DEFAULT_OVERLAP_TOKENS, chunk_text, count_tokens, input_budget
+from sfp_engine import FUNCTION_TYPES, FunctionItem, parse_functions_json, unique_functions
+from text_compaction import compact_for_llm
+from metrics import record_degraded
+
+logger = logging.getLogger("UFP_Agents.fp")
+
 # Carica le variabili d'ambiente dal file .env
 load_dotenv()
 
@@ -18,12 +29,15 @@ openai.api_version = os.getenv("OPENAI_API_VERSION")
 openai.api_key = os.getenv("OPENAI_API_KEY")
 DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
 
+# Versioni dei prompt: incrementarle invalida le risposte in cache
+PROMPT_FP_VERSION = "aru-fp-v1"
+PROMPT_SUMMARY_VERSION = "aru-summary-v1"
+PROMPT_FP_STRUCTURED_VERSION = "aru-fp-json-v1"
+
 # ============================================================================
 # 1) Funzioni di normalizzazione
 # ============================================================================
 
-import hashlib
-
 def normalize_text(text):
     """
     Rimuove spazi multipli, interruzioni extra e converte il testo in minuscolo.
@@ -31,101 +45,32 @@ def normalize_text(text):
     """
     return " ".join(text.split()).lower()
 
-_cache = {}  # Cache globale, se vuoi puoi anche salvarla su file
-
-def call_azure_openai_cached(full_text, system_prompt, user_prompt):
+def call_azure_openai_cached(full_text, system_prompt, user_prompt, prompt_version="aru-v1"):
     """
-    Esegue la chiamata ad Azure/OpenAI in maniera deterministica e utilizza una cache per
-    restituire sempre lo stesso output se l'input e i prompt sono identici.
+    Esegue la chiamata ad Azure/OpenAI in maniera deterministica. La cache è
+    quella persistente di `chat_completion` (llm_client), per singola chiamata:
+    solo le risposte riuscite vengono salvate, quindi un errore transitorio su
+    un chunk non viene mai riproposto come analisi vuota.
     """
-    # Normalizza il testo in ingresso per creare una chiave coerente
-    norm_text = normalize_text(full_text)
-    key_input = norm_text + system_prompt + user_prompt
-    key = hashlib.md5(key_input.encode("utf-8")).hexdigest()
-
-    if key in _cache:
-        print(f"[CACHE] Riutilizzo risultato per chiave: {key}")
-        return _cache[key]
-    else:
-        # Esegui la chiamata (qui usiamo la funzione deterministica già esistente)
-        result = call_azure_openai_deterministic(full_text, system_prompt, user_prompt)
-        _cache[key] = result
-        return result
+    return call_azure_openai_deterministic(full_text, system_prompt, user_prompt,
+                                           prompt_version=prompt_version)
 
 
 
 # ============================================================================
-# 1) Funzioni di estrazione testo e OCR
+# 1) OCR sulle immagini del documento
+#    (testo e immagini arrivano già dall'`AruDocument`, vedi aru_document.py)
 # ============================================================================
-def extract_text_from_docx(docx_path):
-    """
-    Estrae testo da paragrafi e tabelle di un file DOCX.
-    Ritorna una stringa unica con i contenuti (senza righe vuote).
-    """
-    doc = Document(docx_path)
-    text_blocks = []
-
-    # Legge i paragrafi
-    for paragraph in doc.paragraphs:
-        ptext = paragraph.text.strip()
-        if ptext:
-            text_blocks.append(ptext)
-
-    # Legge le tabelle
-    for table in doc.tables:
-        for row in table.rows:
-            row_text = [cell.text.strip() for cell in row.cells if cell.text.strip()]
-            if row_text:
-                text_blocks.append(" | ".join(row_text))
-
-    return "\n".join(text_blocks)
-
-
-def extract_images_from_docx(docx_path):
-    """
-    Estrae eventuali immagini dal DOCX, salvandole in una cartella temporanea.
-    Ritorna la lista dei path alle immagini estratte.
-    """
-    image_paths = []
-    with tempfile.TemporaryDirectory() as temp_dir:
-        try:
-            doc = Document(docx_path)
-            for rel in doc.part.rels.values():
-                try:
-                    # Se la relazione è un'immagine
-                    if "image" in rel.target_ref:
-                        image_data = rel.target_part.blob
-                        image_name = os.path.basename(rel.target_ref)
-                        image_path = os.path.join(temp_dir, image_name)
-                        with open(image_path, "wb") as f:
-                            f.write(image_data)
-                        image_paths.append(image_path)
-                except Exception as e:
-                    print(f"Immagine non valida ignorata: {e}")
-        except Exception as e:
-            print(f"Errore durante l'estrazione delle immagini: {e}")
-
-        # Nota: al termine del blocco with, la temp dir viene rimossa,
-        # per cui conviene se possibile processare i file subito
-        # (vedi `ocr_on_images`).
-    return image_paths
-
-
-def ocr_on_images(image_paths):
+def ocr_on_images(images, ocr_texts=None):
     """
-    Esegue OCR con EasyOCR su ciascuna immagine estratta e
-    concatena il testo trovato in un'unica stringa.
+    Esegue OCR con il Reader EasyOCR condiviso su ciascuna immagine
+    (blob in memoria o path), passando dalla cache OCR su disco, e
+    concatena il testo trovato in un'unica stringa. Con `ocr_texts`
+    (risultati di `ocr_images` già calcolati) l'OCR non viene rieseguito.
     """
-    reader = Reader(["it", "en"], gpu=False)
-    extracted_texts = []
-
-    for img_path in image_paths:
-        try:
-            results = reader.readtext(img_path, detail=0)  # detail=0 -> solo testo
-            if results:
-                extracted_texts.append("\n".join(results))
-        except Exception as e:
-            print(f"Errore OCR su immagine {img_path}: {e}")
+    if ocr_texts is None:
+        ocr_texts = ocr_images(images)
+    extracted_texts = ["\n".join(results) for results in ocr_texts if results]
 
     # Concatena testo OCR di tutte le immagini
     if extracted_texts:
@@ -136,7 +81,7 @@ def ocr_on_images(image_paths):
 # ============================================================================
 # 2) Funzione 'deterministica' per la chiamata ad Azure/OpenAI
 # ============================================================================
-def call_azure_openai_deterministic(full_text, system_prompt, user_prompt):
+def call_azure_openai_deterministic(full_text, system_prompt, user_prompt, prompt_version="aru-v1"):
     """
     Esegue la richiesta al modello Chat (Azure/OpenAI) con parametri
     'deterministici' per ridurre la variabilità di output:
@@ -148,14 +93,14 @@ def call_azure_openai_deterministic(full_text, system_prompt, user_prompt):
     In caso di testi lunghi, suddivide in chunk e concatena i risultati
     per evitare di superare i limiti di token.
     """
-    # Stima approssimata del numero di token
-    approx_token_len = len(full_text) // 4  # ~ 1 token ogni 4 caratteri (euristica)
-    TOKEN_LIMIT = 16000  # es. per GPT-4 o GPT-3.5 se supporta contesti ampi
+    # Numero reale di token e budget per chunk (finestra di contesto meno
+    # risposta e parti fisse del prompt, vedi chunking.py)
+    token_len = count_tokens(full_text)
+    TOKEN_LIMIT = input_budget(3000, system_prompt, user_prompt)
 
     def single_chunk_call(txt_chunk):
         try:
-            response = openai.ChatCompletion.create(
-                engine=DEPLOYMENT_NAME,
+            return chat_completion(
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt.format(content=txt_chunk)},
@@ -164,28 +109,29 @@ def call_azure_openai_deterministic(full_text, system_prompt, user_prompt):
                 top_p=1.0,
                 presence_penalty=0.0,
                 frequency_penalty=0.0,
-                max_tokens=3000  # ipotesi -> puoi regolare
+                max_tokens=3000,  # ipotesi -> puoi regolare
+                prompt_version=prompt_version
             )
-            return response["choices"][0]["message"]["content"]
+        except CassetteNotFoundError:
+            # In replay una richiesta non registrata deve fallire in modo esplicito
+            raise
         except Exception as e:
             print(f"Errore nella chiamata OpenAI su chunk: {e}")
+            record_degraded(f"llm:{prompt_version}", e)
             return ""
 
-    if approx_token_len <= TOKEN_LIMIT:
+    if token_len <= TOKEN_LIMIT:
         # Se il testo è nei limiti, effettua un'unica chiamata
         return single_chunk_call(full_text).strip()
     else:
-        # Suddivisione del testo in chunk
-        chunk_size = TOKEN_LIMIT * 4  # *4 perché la stima token->caratteri
-        start = 0
-        partial_results = []
-
-        while start < len(full_text):
-            end = start + chunk_size
-            chunk = full_text[start:end]
-            partial_res = single_chunk_call(chunk)
-            partial_results.append(partial_res.strip())
-            start = end
+        # Suddivisione del testo in chunk su confini strutturali, con overlap
+        chunks = chunk_text(full_text, TOKEN_LIMIT, overlap_tokens=DEFAULT_OVERLAP_TOKENS)
+
+        # I chunk sono indipendenti: chiamate in parallelo, risultati in ordine
+        partial_results = [
+            res.strip() for res in
+            run_concurrently(lambda c=c: single_chunk_call(c) for c in chunks)
+        ]
 
         # Concatena tutti i parziali
         return "\n".join(partial_results).strip()
@@ -194,65 +140,154 @@ def call_azure_openai_deterministic(full_text, system_prompt, user_prompt):
 # ============================================================================
 # 3) Funzione principale parse_aru_docx
 # ============================================================================
-def parse_aru_docx(docx_path):
+# Prompt di sistema: contesto per l'analisi FP
+SYSTEM_PROMPT_FP = (
+    "Sei un analista esperto di Function Point Analysis (IFPUG). "
+    "Il compito è interpretare il documento ARU, cercando: ILF, EIF, EI, EO, EQ, "
+    "e le informazioni per stimare DET, RET e qualsiasi altro aspetto utile. "
+    "Mantieni stabilità e chiarezza, senza introdurre dettagli casuali."
+)
+
+# Prompt utente: la richiesta di informazioni FP
+USER_PROMPT_FP = (
+    "Ecco il testo del documento (ARU):\n"
+    "{content}\n\n"
+    "1) Elenca le funzioni dati (ILF, EIF), se presenti. "
+    "2) Elenca le funzioni transazionali (EI, EO, EQ) menzionate o inferibili. "
+    "3) Fornisci indicazioni su DET/RET se possibile. "
+    "4) Non unificare mai più sorgenti (EIF) se il documento le cita come separate. "
+    "5) Se un requisito descrive più modalità di consultazione, classificale come EQ distinte. "
+    "6) In generale, fornisci tutti i dettagli utili al calcolo dei function point, in modo coerente e ripetibile."
+)
+
+# Prompt di sistema: contesto per un riassunto
+SYSTEM_PROMPT_SUMMARY = (
+    "Sei un assistente che riassume il contenuto del documento. "
+    "Non aggiungere nulla oltre a ciò che leggi."
+)
+
+# Prompt utente: generazione di mezza pagina di sintesi
+USER_PROMPT_SUMMARY = (
+    "Testo ARU:\n{content}\n\n"
+    "Genera un riassunto di circa mezza pagina (max 200 parole) "
+    "spiegando di cosa tratta la ARU, lo scopo del software e il contesto/committente."
+)
+
+
+# Prompt utente: analisi FP in forma strutturata (JSON validato, vedi sfp_engine.py)
+USER_PROMPT_FP_STRUCTURED = (
+    "Ecco il testo del documento (ARU):\n"
+    "{content}\n\n"
+    "Elenca le funzioni dati (ILF, EIF) e le funzioni transazionali (EI, EO, EQ) "
+    "menzionate o inferibili. Non unificare più sorgenti (EIF) se il documento le cita come "
+    "separate; più modalità di consultazione dello stesso requisito sono EQ distinte.\n"
+    "Rispondi SOLO con un array JSON, senza testo aggiuntivo, con un oggetto per funzione:\n"
+    '[{{"type": "ILF|EIF|EI|EO|EQ", "name": "...", "justification": "...", '
+    '"requirement": "label del requisito di origine (es. RF001) o null"}}]'
+)
+
+
+@dataclass
+class FpAnalysis:
+    """Analisi FP strutturata: funzioni tipizzate e validate."""
+    functions: List[FunctionItem] = field(default_factory=list)
+
+    def as_text(self) -> str:
+        """Versione testuale, usata come `ufp_info` nel prompt della SF."""
+        lines = []
+        for t in FUNCTION_TYPES:
+            items = [fn for fn in self.functions if fn.type == t]
+            if items:
+                lines.append(f"{t} ({len(items)}):")
+                lines += [f"- {fn.name}" + (f" [{fn.requirement}]" if fn.requirement else "")
+                          + (f": {fn.justification}" if fn.justification else "") for fn in items]
+        return "\n".join(lines)
+
+
+def build_aru_text(document, ocr_texts=None):
     """
-    1) Estrae testo dal DOCX (incluse immagini via OCR).
-    2) Esegue:
-       A) analisi interpretativa per i Function Point (IFPUG)
-       B) un breve riassunto (~mezza pagina) su scopo dell'ARU
-    3) Ritorna (fp_analysis, summary).
+    Testo dell'`AruDocument` (paragrafi + tabelle) più il testo OCR delle
+    immagini (`ocr_texts` se già calcolati), compattato per i prompt di
+    analisi FP e riassunto.
     """
-    if not os.path.exists(docx_path):
-        raise FileNotFoundError(f"Il file {docx_path} non esiste.")
+    document = as_aru_document(document)
 
     # Estrazione testo
-    base_text = extract_text_from_docx(docx_path)
-    image_paths = extract_images_from_docx(docx_path)
+    base_text = document.text
 
     # Esecuzione OCR se ci sono immagini
-    if image_paths:
-        ocr_text = ocr_on_images(image_paths)
+    if document.images:
+        ocr_text = ocr_on_images(document.image_blobs, ocr_texts)
         if ocr_text:
             base_text += "\n\n[TESTO ESTRATTO DA IMMAGINI]\n" + ocr_text
+    return compact_for_llm(base_text, "aru_text")
 
-    # Prompt di sistema: contesto per l'analisi FP
-    system_prompt_fp = (
-        "Sei un analista esperto di Function Point Analysis (IFPUG). "
-        "Il compito è interpretare il documento ARU, cercando: ILF, EIF, EI, EO, EQ, "
-        "e le informazioni per stimare DET, RET e qualsiasi altro aspetto utile. "
-        "Mantieni stabilità e chiarezza, senza introdurre dettagli casuali."
-    )
-
-    # Prompt utente: la richiesta di informazioni FP
-    user_prompt_fp = (
-        "Ecco il testo del documento (ARU):\n"
-        "{content}\n\n"
-        "1) Elenca le funzioni dati (ILF, EIF), se presenti. "
-        "2) Elenca le funzioni transazionali (EI, EO, EQ) menzionate o inferibili. "
-        "3) Fornisci indicazioni su DET/RET se possibile. "
-        "4) Non unificare mai più sorgenti (EIF) se il documento le cita come separate. "
-        "5) Se un requisito descrive più modalità di consultazione, classificale come EQ distinte. "
-        "6) In generale, fornisci tutti i dettagli utili al calcolo dei function point, in modo coerente e ripetibile."
-    )
 
+def analyze_fp(base_text):
+    """Analisi interpretativa per i Function Point (IFPUG)."""
     # Lato function points con caching per massimizzare la ripetibilità
-    fp_analysis = call_azure_openai_cached(base_text, system_prompt_fp, user_prompt_fp)
-    # Prompt di sistema: contesto per un riassunto
-    system_prompt_summary = (
-        "Sei un assistente che riassume il contenuto del documento. "
-        "Non aggiungere nulla oltre a ciò che leggi."
-    )
-
-    # Prompt utente: generazione di mezza pagina di sintesi
-    user_prompt_summary = (
-        "Testo ARU:\n{content}\n\n"
-        "Genera un riassunto di circa mezza pagina (max 200 parole) "
-        "spiegando di cosa tratta la ARU, lo scopo del software e il contesto/committente."
-    )
-
-    half_page_summary = call_azure_openai_cached(base_text, system_prompt_summary, user_prompt_summary)
+    return call_azure_openai_cached(base_text, SYSTEM_PROMPT_FP, USER_PROMPT_FP,
+                                    prompt_version=PROMPT_FP_VERSION).strip()
+
+
+def analyze_fp_structured(base_text) -> FpAnalysis:
+    """
+    Analisi FP con output JSON validato. Testi lunghi vengono suddivisi in chunk
+    (senza overlap); le funzioni dati (ILF/EIF) trovate in più chunk sono
+    contate una volta, le transazionali tutte (come in sfp_engine). Un chunk
+    con risposta non valida viene saltato (run degradata); se nessun chunk è
+    valido l'analisi è vuota e il chiamante ripiega sull'analisi testuale.
+    """
+    budget = input_budget(3000, SYSTEM_PROMPT_FP, USER_PROMPT_FP_STRUCTURED)
+    chunks = [base_text] if count_tokens(base_text) <= budget else chunk_text(base_text, budget)
+
+    def call(i, chunk):
+        try:
+            answer = chat_completion(
+                messages=[{"role": "system", "content": SYSTEM_PROMPT_FP},
+                          {"role": "user", "content": USER_PROMPT_FP_STRUCTURED.format(content=chunk)}],
+                max_tokens=3000, temperature=0.0, top_p=1.0,
+                prompt_version=PROMPT_FP_STRUCTURED_VERSION,
+                validate=parse_functions_json,
+            )
+            return parse_functions_json(answer)
+        except CassetteNotFoundError:
+            raise
+        except Exception as e:
+            record_degraded("fp_structured", f"chunk {i + 1}/{len(chunks)}: {e}")
+            return None
+
+    results = run_concurrently(lambda i=i, c=c: call(i, c) for i, c in enumerate(chunks))
+    if all(r is None for r in results):
+        logger.warning("Analisi FP strutturata non disponibile")
+        return FpAnalysis()
+    return FpAnalysis(unique_functions(fn for r in results if r for fn in r))
+
+
+def summarize_aru(base_text):
+    """Riassunto di circa mezza pagina su scopo e contesto dell'ARU."""
+    return call_azure_openai_cached(base_text, SYSTEM_PROMPT_SUMMARY, USER_PROMPT_SUMMARY,
+                                    prompt_version=PROMPT_SUMMARY_VERSION).strip()
+
+
+def parse_aru_docx(document):
+    """
+    1) Usa il testo dell'`AruDocument` già caricato (incluse immagini via OCR).
+       Per compatibilità accetta anche la path del DOCX.
+    2) Esegue:
+       A) analisi interpretativa per i Function Point (IFPUG)
+       B) un breve riassunto (~mezza pagina) su scopo dell'ARU
+    3) Ritorna (fp_analysis, summary).
+    """
+    base_text = build_aru_text(document)
+
+    # Analisi FP e riassunto sono indipendenti: vengono eseguiti in parallelo
+    fp_analysis, half_page_summary = run_concurrently([
+        lambda: analyze_fp(base_text),
+        lambda: summarize_aru(base_text),
+    ])
     _=[]
-    return fp_analysis.strip(),_, half_page_summary.strip()
+    return fp_analysis,_, half_page_summary
 
 
 # ============================================================================
@@ -0,0 +1,312 @@
+"""incremental_estimate.py
+========================
+Ri-stima incrementale di una nuova revisione di un ARU.
+
+La stima è conservata come "snapshot": requisiti RF (label, impronta del
+testo, funzioni classificate) più totali SFP. Per la nuova revisione:
+  - i requisiti con la stessa impronta di un requisito della revisione
+    precedente riusano la classificazione salvata (anche se rinumerati);
+  - solo i requisiti aggiunti o modificati vengono classificati con l'LLM
+    (in parallelo, vedi requirement_classifier.py);
+  - i totali SFP sono ricalcolati localmente (sfp_engine.py) e confrontati
+    con la revisione precedente in un report delta (quali EP/LF cambiano e
+    di quanti UFP).
+
+Gli snapshot sono salvati in una cache SQLite (chiave: impronta del documento +
+firma di prompt/deployment) e come `estimate_snapshot.json` nella cartella di
+output; la revisione precedente si può indicare come .docx già stimato o come
+snapshot JSON.
+
+Uso:
+    python incremental_estimate.py ARU_v2.docx --previous ARU_v1.docx --output-dir out/
+"""
+import os
+import json
+import time
+import argparse
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aru_document import load_aru_document
+from estrazione_damas_wave import (extract_all_content, get_functional_requirements,
+                                   remove_index_from_text)
+from llm_client import DEPLOYMENT_NAME
+from metrics import stage_timer
+from requirement_classifier import (PROMPT_RF_CLASSIFY_VERSION, Requirement,
+                                    classify_requirements, split_requirements)
+from sfp_engine import (DATA_TYPES, EP_WEIGHT, FUNCTION_TYPES, LF_WEIGHT, FunctionItem,
+                        SfpResult, compute_sfp, sfp_delta, unique_functions)
+from sqlite_cache import SQLiteCache, cache_path
+from text_compaction import compact_for_llm, compaction_signature
+
+logger = logging.getLogger("UFP_Agents.incremental")
+
+SNAPSHOT_FILE = "estimate_snapshot.json"
+DELTA_REPORT_FILE = "delta_report.md"
+SNAPSHOT_MAX_ENTRIES = int(os.getenv("SNAPSHOT_MAX_ENTRIES", "2000"))
+
+_store = None
+
+
+def get_snapshot_store() -> SQLiteCache:
+    global _store
+    if _store is None:
+        _store = SQLiteCache(cache_path("estimate_snapshots.sqlite"),
+                             max_entries=SNAPSHOT_MAX_ENTRIES)
+    return _store
+
+
+def classification_signature() -> dict:
+    return {"deployment": DEPLOYMENT_NAME, "prompt": PROMPT_RF_CLASSIFY_VERSION,
+            "compaction": compaction_signature()}
+
+
+def _snapshot_key(content_hash, signature):
+    return (f"{content_hash}:{signature['deployment']}:{signature['prompt']}"
+            f":{signature.get('compaction', '')}")
+
+
+@dataclass
+class RequirementChange:
+    label: str
+    status: str                      # invariato | rinominato | modificato | aggiunto | rimosso
+    previous_label: Optional[str] = None
+
+
+@dataclass
+class IncrementalResult:
+    snapshot: dict
+    sfp: SfpResult
+    previous_sfp: Optional[SfpResult]
+    delta: Optional[dict]
+    changes: List[RequirementChange] = field(default_factory=list)
+    function_changes: List[dict] = field(default_factory=list)
+    classified: int = 0
+    reused: int = 0
+    report: str = ""
+
+
+###############################################################################
+# Estrazione requisiti e snapshot
+###############################################################################
+def load_requirements(docx_path):
+    """Documento e requisiti RF (sezione "Requisiti Funzionali", altrimenti tutto il testo)."""
+    document = load_aru_document(docx_path)
+    text = get_functional_requirements(document, use_regex=True)
+    if not text:
+        text = compact_for_llm(remove_index_from_text(extract_all_content(document)), "requisiti")
+    return document, split_requirements(text)
+
+
+def _functions_from(entry) -> List[FunctionItem]:
+    return [FunctionItem(**f) for f in entry["functions"]]
+
+
+def snapshot_functions(snapshot) -> List[FunctionItem]:
+    return [fn for entry in snapshot["requirements"] for fn in _functions_from(entry)]
+
+
+def build_snapshot(docx_path, document, reqs: List[Requirement],
+                   functions: Dict[str, List[FunctionItem]], signature) -> dict:
+    all_functions = [fn for r in reqs for fn in functions[r.label]]
+    return {
+        "document": os.path.basename(docx_path),
+        "content_hash": document.content_hash,
+        "signature": signature,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "requirements": [{"label": r.label, "fingerprint": r.fingerprint, "text": r.text,
+                          "functions": [fn.to_dict() for fn in functions[r.label]]}
+                         for r in reqs],
+        "sfp": compute_sfp(all_functions).to_dict(),
+    }
+
+
+def save_snapshot(snapshot, output_dir=None):
+    get_snapshot_store().set(_snapshot_key(snapshot["content_hash"], snapshot["signature"]),
+                             json.dumps(snapshot, ensure_ascii=False))
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        _write_atomic(os.path.join(output_dir, SNAPSHOT_FILE),
+                      json.dumps(snapshot, ensure_ascii=False, indent=2))
+
+
+def _write_atomic(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def resolve_previous(previous, signature) -> Optional[dict]:
+    """
+    Snapshot della revisione precedente da: dict, file JSON di snapshot o .docx.
+    Per un .docx mai stimato con questa firma viene eseguita una stima completa.
+    """
+    if previous is None or isinstance(previous, dict):
+        return previous
+    if previous.lower().endswith(".json"):
+        with open(previous, encoding="utf-8") as f:
+            return json.load(f)
+    document = load_aru_document(previous)
+    raw = get_snapshot_store().get(_snapshot_key(document.content_hash, signature))
+    if raw is not None:
+        return json.loads(raw)
+    logger.info("Nessuno snapshot per %s: stima completa della revisione precedente",
+                os.path.basename(previous))
+    return estimate_incremental(previous).snapshot
+
+
+###############################################################################
+# Diff e stima
+###############################################################################
+def _diff_requirements(reqs: List[Requirement], previous: dict):
+    """
+    Stato di ogni requisito e classificazioni riusabili (per impronta).
+    Prima si abbinano le impronte; poi un requisito non abbinato è
+    "modificato" solo se la sua label precedente non è già stata abbinata per
+    impronta a un altro requisito (es. un RF inserito prima di un blocco invariato
+    e rinumerato è "aggiunto").
+    """
+    prev_by_label = {e["label"]: e for e in previous["requirements"]}
+    prev_by_fp = {}
+    for e in previous["requirements"]:
+        prev_by_fp.setdefault(e["fingerprint"], e)
+
+    status, reused, used_labels = {}, {}, set()
+    for r in reqs:
+        old = prev_by_fp.get(r.fingerprint)
+        if old is not None:
+            reused[r.label] = [FunctionItem(**{**f, "requirement": r.label})
+                               for f in old["functions"]]
+            used_labels.add(old["label"])
+            status[r.label] = RequirementChange(
+                r.label, "invariato" if old["label"] == r.label else "rinominato", old["label"])
+    for r in reqs:
+        if r.label in status:
+            continue
+        if r.label in prev_by_label and r.label not in used_labels:
+            used_labels.add(r.label)
+            status[r.label] = RequirementChange(r.label, "modificato", r.label)
+        else:
+            status[r.label] = RequirementChange(r.label, "aggiunto")
+    changes = [status[r.label] for r in reqs]
+    for label in prev_by_label:
+        if label not in used_labels:
+            changes.append(RequirementChange(label, "rimosso", label))
+    return changes, reused
+
+
+def _function_changes(before: List[FunctionItem], after: List[FunctionItem]):
+    """Funzioni contate entrate/uscite dal conteggio, con il loro peso in UFP."""
+    def counted(functions):
+        items = unique_functions(functions)
+        return Counter(fn.key for fn in items), {fn.key: fn for fn in items}
+
+    old_count, old_fn = counted(before)
+    new_count, new_fn = counted(after)
+    rows = []
+    for key in sorted(set(old_count) | set(new_count)):
+        diff = new_count[key] - old_count[key]
+        if not diff:
+            continue
+        fn = new_fn.get(key) or old_fn[key]
+        weight = LF_WEIGHT if fn.type in DATA_TYPES else EP_WEIGHT
+        rows.append({"type": fn.type, "name": fn.name, "requirement": fn.requirement,
+                     "change": "aggiunta" if diff > 0 else "rimossa",
+                     "ufp": round(diff * weight, 1)})
+    return rows
+
+
+def estimate_incremental(docx_path, previous=None, output_dir=None) -> IncrementalResult:
+    """
+    Stima `docx_path` riusando le classificazioni di `previous` (dict, snapshot
+    JSON o .docx) per i requisiti invariati. Senza `previous` tutti i requisiti
+    vengono classificati e lo snapshot risultante fa da base per le revisioni future.
+    """
+    signature = classification_signature()
+    with stage_timer("incremental_extract"):
+        document, reqs = load_requirements(docx_path)
+    prev = resolve_previous(previous, signature)
+    if prev is not None and prev.get("signature") != signature:
+        logger.warning("Snapshot precedente con prompt/deployment diversi: nessun riuso")
+        changes, reused = [RequirementChange(r.label, "aggiunto") for r in reqs], {}
+    elif prev is not None:
+        changes, reused = _diff_requirements(reqs, prev)
+    else:
+        changes, reused = [RequirementChange(r.label, "aggiunto") for r in reqs], {}
+
+    to_classify = [r for r in reqs if r.label not in reused]
+    logger.info("Requisiti: %d totali, %d riusati, %d da classificare",
+                len(reqs), len(reused), len(to_classify))
+    with stage_timer("incremental_classify"):
+        functions = {**reused, **classify_requirements(to_classify)}
+
+    snapshot = build_snapshot(docx_path, document, reqs, functions, signature)
+    after = snapshot_functions(snapshot)
+    result = IncrementalResult(snapshot=snapshot, sfp=compute_sfp(after), previous_sfp=None,
+                               delta=None, changes=changes,
+                               classified=len(to_classify), reused=len(reused))
+    if prev is not None:
+        before = snapshot_functions(prev)
+        result.previous_sfp = compute_sfp(before)
+        result.delta = sfp_delta(result.previous_sfp, result.sfp)
+        result.function_changes = _function_changes(before, after)
+    result.report = render_delta_report(result, prev)
+
+    save_snapshot(snapshot, output_dir)
+    if output_dir:
+        _write_atomic(os.path.join(output_dir, DELTA_REPORT_FILE), result.report)
+    return result
+
+
+###############################################################################
+# Report
+###############################################################################
+def _fmt(value):
+    return f"{value:+g}" if isinstance(value, (int, float)) else str(value)
+
+
+def render_delta_report(result: IncrementalResult, previous: Optional[dict]) -> str:
+    new = result.sfp
+    title = result.snapshot["document"]
+    if previous:
+        title += f" rispetto a {previous['document']}"
+    lines = [f"# Delta stima SFP – {title}", "",
+             f"Requisiti classificati: {result.classified} · riusati: {result.reused}", ""]
+
+    old = result.previous_sfp or SfpResult()
+    lines += ["| Voce | Prima | Dopo | Δ |", "|---|---:|---:|---:|"]
+    for t in FUNCTION_TYPES:
+        lines.append(f"| {t} | {old.counts[t]} | {new.counts[t]} | "
+                     f"{_fmt(new.counts[t] - old.counts[t])} |")
+    for name, a, b in (("EP", old.ep, new.ep), ("LF", old.lf, new.lf),
+                       ("**UFP**", old.ufp, new.ufp)):
+        lines.append(f"| {name} | {a:g} | {b:g} | {_fmt(round(b - a, 1))} |")
+
+    touched = [c for c in result.changes if c.status != "invariato"]
+    lines += ["", "## Requisiti variati", ""]
+    if touched:
+        lines += ["| Requisito | Stato | Revisione precedente |", "|---|---|---|"]
+        lines += [f"| {c.label} | {c.status} | {c.previous_label or '–'} |" for c in touched]
+    else:
+        lines.append("Nessun requisito variato.")
+
+    if result.function_changes:
+        lines += ["", "## Funzioni variate", "",
+                  "| Tipo | Funzione | Requisito | Variazione | Δ UFP |", "|---|---|---|---|---:|"]
+        lines += [f"| {r['type']} | {r['name']} | {r['requirement'] or '–'} | {r['change']} | "
+                  f"{_fmt(r['ufp'])} |" for r in result.function_changes]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ri-stima incrementale di una revisione ARU")
+    parser.add_argument("docx")
+    parser.add_argument("--previous", help="revisione precedente (.docx già stimato o snapshot .json)")
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+    import agente_calcolo  # noqa: F401 – configura il logger "UFP_Agents"
+    res = estimate_incremental(args.docx, previous=args.previous, output_dir=args.output_dir)
+    print(res.report)
@@ -0,0 +1,242 @@
+"""job_queue.py
+============
+Coda locale di job di stima eseguiti in background.
+
+L'app Streamlit non esegue più la pipeline dentro la richiesta: sottomette il
+documento a una `JobQueue` (pool di worker del processo server) e ne interroga
+lo stato. Ogni job ha un ID, una cartella propria in JOBS_DIR (documento di
+input, SF, report UFP, `job.json` con stato e risultati) e può essere
+annullato: in coda non parte, in esecuzione si ferma alla prossima fase o al
+prossimo token in streaming.
+
+`job.json` è scritto in modo atomico a ogni cambio di stato e funge da
+archivio dei risultati: alla riapertura del processo i job conclusi vengono
+ricaricati, quelli rimasti a metà risultano interrotti. I job conclusi più
+vecchi di JOBS_MAX_AGE_DAYS giorni, o oltre i JOBS_MAX_COUNT più recenti,
+vengono eliminati con la loro cartella (all'avvio e a ogni nuovo job).
+"""
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("UFP_Agents.jobs")
+
+JOBS_DIR = os.getenv("UFP_JOBS_DIR", "jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOBS_MAX_AGE_DAYS = float(os.getenv("JOBS_MAX_AGE_DAYS", "14"))   # 0 = nessun limite di età
+JOBS_MAX_COUNT = int(os.getenv("JOBS_MAX_COUNT", "200"))          # 0 = nessun limite di numero
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "error", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Sollevata dentro la pipeline quando il job viene annullato."""
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+@dataclass
+class Job:
+    job_id: str
+    filename: str
+    output_dir: str
+    status: str = QUEUED
+    stage: Optional[str] = None
+    created_at: str = field(default_factory=_now)
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    results: Dict[str, str] = field(default_factory=dict)
+    metrics: Optional[dict] = None
+
+    def __post_init__(self):
+        # Stato di esecuzione, non persistito
+        self.sf_partial = ""
+        self.ufp_partial = ""
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def input_path(self):
+        return os.path.join(self.output_dir, os.path.basename(self.filename) or "input.docx")
+
+    @property
+    def finished(self):
+        return self.status in FINAL_STATES
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class JobQueue:
+    def __init__(self, workers=None, jobs_dir=None):
+        self.jobs_dir = jobs_dir or JOBS_DIR
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers or JOB_WORKERS,
+                                        thread_name_prefix="job")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._load_store()
+        self.prune()
+
+    # ── archivio su disco ──────────────────────────────────────────
+    def _load_store(self):
+        for name in sorted(os.listdir(self.jobs_dir)):
+            path = os.path.join(self.jobs_dir, name, "job.json")
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    job = Job(**json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning("job.json non leggibile (%s): %s", path, e)
+                continue
+            if not job.finished:
+                job.status, job.error = FAILED, "Interrotto (riavvio del server)"
+                self._save(job)
+            self._jobs[job.job_id] = job
+
+    def _save(self, job: Job):
+        path = os.path.join(job.output_dir, "job.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    # ── API ────────────────────────────────────────────────────────
+    def submit(self, docx_bytes: bytes, filename="documento.docx") -> str:
+        """Sottomette un documento; ritorna l'ID del job."""
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(job_id=job_id, filename=filename,
+                  output_dir=os.path.join(self.jobs_dir, job_id))
+        os.makedirs(job.output_dir, exist_ok=True)
+        with open(job.input_path, "wb") as f:
+            f.write(docx_bytes)
+        self._save(job)
+        with self._lock:
+            self._jobs[job_id] = job
+        job._future = self._pool.submit(self._run, job)
+        logger.info("Job %s in coda (%s)", job_id, filename)
+        self.prune()
+        return job_id
+
+    def get(self, job_id) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id) -> bool:
+        """Annulla un job in coda o in esecuzione; False se già concluso o inesistente."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            # Non ancora partito
+            self._finish(job, CANCELLED)
+        return True
+
+    def delete(self, job_id) -> bool:
+        """Rimuove dall'archivio un job concluso e la sua cartella."""
+        job = self.get(job_id)
+        if job is None or not job.finished:
+            return False
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        shutil.rmtree(job.output_dir, ignore_errors=True)
+        return True
+
+    def prune(self, max_age_days=None, max_count=None) -> int:
+        """
+        Elimina i job conclusi oltre la retention (età in giorni e numero
+        massimo di job conclusi da conservare); ritorna quanti ne ha rimossi.
+        """
+        max_age_days = JOBS_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        max_count = JOBS_MAX_COUNT if max_count is None else max_count
+        finished = [j for j in self.list_jobs() if j.finished]   # dal più recente
+        expired = finished[max_count:] if max_count else []
+        if max_age_days:
+            cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+            expired += [j for j in finished[:len(finished) - len(expired)]
+                        if (j.finished_at or j.created_at) < cutoff]
+        for job in expired:
+            self.delete(job.job_id)
+        if expired:
+            logger.info("Rimossi %d job conclusi oltre la retention", len(expired))
+        return len(expired)
+
+    def shutdown(self, wait=False):
+        for job in self.list_jobs():
+            job._cancel.set()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    # ── esecuzione ─────────────────────────────────────────────────
+    def _finish(self, job: Job, status, error=None):
+        job.status, job.error, job.finished_at = status, error, _now()
+        self._save(job)
+
+    def _run(self, job: Job):
+        import agente_calcolo  # import ritardato: legge l'ambiente (.env) all'import
+
+        def check_cancel(*_):
+            if job._cancel.is_set():
+                raise JobCancelled(job.job_id)
+
+        def on_stage(stage):
+            check_cancel()
+            job.stage = stage
+            self._save(job)
+
+        def on_sf_token(token):
+            check_cancel()
+            job.sf_partial += token
+
+        def on_ufp_token(token):
+            check_cancel()
+            job.ufp_partial += token
+
+        job.status, job.started_at = RUNNING, _now()
+        self._save(job)
+        try:
+            run = agente_calcolo.run_pipeline_graph(job.input_path, progress=on_stage,
+                                                    on_sf_token=on_sf_token,
+                                                    on_ufp_token=on_ufp_token,
+                                                    output_dir=job.output_dir)
+            r = run.results
+            job.results = {"sf": r["sf"], "ufp": r["ufp"],
+                           "pre_analysis": r["pre_analysis"], "fp_analysis": r["fp_analysis"]}
+            job.metrics = run.metrics
+            self._finish(job, DONE)
+        except JobCancelled:
+            logger.info("Job %s annullato", job.job_id)
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logger.exception("Job %s fallito", job.job_id)
+            self._finish(job, FAILED, f"{type(e).__name__}: {e}")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Coda condivisa dal processo (una per server Streamlit)."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
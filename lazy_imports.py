@@ -0,0 +1,80 @@
+"""lazy_imports.py
+================
+Import pigri delle dipendenze pesanti (faiss, sentence_transformers/torch,
+PyPDF2, easyocr).
+
+`lazy_module("faiss")` ritorna un modulo-facciata: l'import vero avviene al
+primo accesso a un attributo, quindi importare agente_calcolo (o rieseguire
+app.py in Streamlit) non carica FAISS, torch o i modelli finché la pipeline
+non li usa davvero. I tempi di ogni primo import sono registrati e leggibili
+con `import_report()`; il warm-up esplicito è in warmup.py.
+"""
+import sys
+import time
+import types
+import logging
+import importlib
+import threading
+from typing import Dict, List
+
+logger = logging.getLogger("UFP_Agents.imports")
+
+_import_seconds: Dict[str, float] = {}
+_import_lock = threading.RLock()
+
+
+def import_timed(name: str):
+    """`importlib.import_module` che registra il tempo del primo import."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with _import_lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        t0 = time.perf_counter()
+        module = importlib.import_module(name)
+        _import_seconds[name] = time.perf_counter() - t0
+        logger.info("Import di %s in %.2f s", name, _import_seconds[name])
+    return module
+
+
+class LazyModule(types.ModuleType):
+    """Facciata di un modulo importato al primo accesso a un suo attributo."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = import_timed(self.__name__)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self.__name__!r} ({'caricato' if self.loaded else 'non caricato'})>"
+
+
+_facades: Dict[str, LazyModule] = {}
+
+
+def lazy_module(name: str) -> LazyModule:
+    """Facciata condivisa per `name` (una per processo)."""
+    with _import_lock:
+        if name not in _facades:
+            _facades[name] = LazyModule(name)
+        return _facades[name]
+
+
+def import_report() -> List[dict]:
+    """Dipendenze pigre note: caricate o meno e secondi impiegati dal primo import."""
+    names = sorted(set(_facades) | set(_import_seconds))
+    return [{"module": n, "loaded": n in sys.modules,
+             "seconds": round(_import_seconds[n], 3) if n in _import_seconds else None}
+            for n in names]
@@ -0,0 +1,184 @@
+"""llm_client.py
+===============
+Punto unico di accesso ad Azure/OpenAI per tutti gli agenti.
+
+Ogni chiamata passa da una cache persistente su SQLite (vedi sqlite_cache.py):
+la chiave è costruita da deployment, parametri del modello, lista completa dei
+messaggi e versione del prompt template. Rieseguire la stima di un ARU
+invariato non costa alcuna latenza di API.
+
+Le chiamate indipendenti (analisi FP + riassunto, chunk dello stesso testo)
+possono essere eseguite in parallelo con `run_concurrently` / `achat_completion`;
+il numero di richieste in volo verso l'API è limitato a livello di processo da
+LLM_MAX_CONCURRENCY e i risultati tornano sempre nell'ordine delle chiamate.
+"""
+import os
+import json
+import asyncio
+import contextvars
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from sqlite_cache import SQLiteCache, cache_path
+from chunking import count_tokens
+from metrics import record_llm_usage, stage_timer
+from llm_transport import create_chat_completion
+
+load_dotenv()
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
+
+logger = logging.getLogger("UFP_Agents.llm")
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "720"))
+
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "4")))
+
+_cache = None
+_cache_lock = threading.Lock()
+_inflight = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+def get_llm_cache() -> SQLiteCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SQLiteCache(
+                    cache_path("llm_cache.sqlite"),
+                    max_entries=LLM_CACHE_MAX_ENTRIES,
+                    ttl_seconds=LLM_CACHE_TTL_HOURS * 3600 or None,
+                )
+    return _cache
+
+
+def _cache_key(messages, params, prompt_version) -> str:
+    payload = json.dumps(
+        {"deployment": DEPLOYMENT_NAME, "params": params, "messages": messages},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return f"{prompt_version}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def _stream_content(resp, on_token):
+    parts = []
+    for chunk in resp:
+        choices = chunk.get("choices") or []
+        if not choices:  # Azure invia prima i risultati dei content filter
+            continue
+        token = (choices[0].get("delta") or {}).get("content")
+        if token:
+            parts.append(token)
+            on_token(token)
+    return "".join(parts)
+
+
+def chat_completion(messages, max_tokens, temperature=0.0, prompt_version="v1",
+                    use_cache=True, on_token=None, validate=None, **params):
+    """
+    Esegue `openai.ChatCompletion.create` (attraverso il trasporto record/replay
+    di llm_transport.py) sul deployment configurato e ritorna
+    il contenuto del primo messaggio. Parametri aggiuntivi (top_p,
+    presence_penalty, ...) sono inoltrati così come sono e fanno parte della chiave.
+
+    Con `on_token` la risposta viene richiesta in streaming e ogni frammento
+    viene passato alla callback appena arriva; su un hit di cache la callback
+    riceve l'intera risposta in un'unica volta.
+
+    Con `validate` (callable che solleva ValueError su una risposta non
+    utilizzabile, es. JSON non valido) solo le risposte valide vengono salvate
+    in cache: una risposta non valida solleva l'errore al chiamante, e una
+    voce in cache non valida viene scartata e richiesta di nuovo.
+
+    Ogni chiamata è misurata come fase `llm:<prompt_version>` (vedi metrics.py).
+    """
+    with stage_timer(f"llm:{prompt_version}"):
+        return _chat_completion(messages, max_tokens, temperature, prompt_version,
+                                use_cache, on_token, validate, params)
+
+
+def _chat_completion(messages, max_tokens, temperature, prompt_version, use_cache,
+                     on_token, validate, params):
+    params = dict(params, max_tokens=max_tokens, temperature=temperature)
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    key = _cache_key(messages, params, prompt_version)
+
+    if use_cache:
+        cached = get_llm_cache().get(key)
+        content = json.loads(cached)["content"] if cached is not None else None
+        if content is not None and validate is not None:
+            try:
+                validate(content)
+            except ValueError as e:
+                logger.warning("Risposta LLM in cache non valida, scartata (%s): %s", key, e)
+                get_llm_cache().delete(key)
+                content = None
+        if content is not None:
+            logger.debug("[CACHE] Riutilizzo risposta LLM %s", key)
+            record_llm_usage(cached=True)
+            if on_token:
+                on_token(content)
+            return content
+
+    with _inflight:
+        if on_token:
+            resp = create_chat_completion(engine=DEPLOYMENT_NAME, messages=messages,
+                                          stream=True, **params)
+            content = _stream_content(resp, on_token)
+            # In streaming l'API non restituisce `usage`: conteggio con il tokenizer locale
+            record_llm_usage(sum(count_tokens(m["content"]) for m in messages),
+                             count_tokens(content))
+        else:
+            resp = create_chat_completion(engine=DEPLOYMENT_NAME, messages=messages, **params)
+            content = resp["choices"][0]["message"]["content"]
+            usage = resp.get("usage") or {}
+            record_llm_usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+    if validate is not None:
+        validate(content)
+    if use_cache:
+        get_llm_cache().set(key, json.dumps({"content": content}, ensure_ascii=False))
+    return content
+
+
+async def achat_completion(messages, max_tokens, **kwargs):
+    """Versione asyncio di `chat_completion` (la chiamata gira in un thread)."""
+    return await asyncio.to_thread(chat_completion, messages, max_tokens, **kwargs)
+
+
+def run_concurrently(calls, max_concurrency=None):
+    """
+    Esegue in parallelo una lista di callable senza argomenti (es. lambda che
+    chiamano `chat_completion`) e ritorna i risultati NELLO STESSO ORDINE
+    della lista, così l'output resta deterministico.
+    Un'eccezione in una chiamata viene propagata al chiamante.
+    """
+    calls = list(calls)
+    if len(calls) <= 1:
+        return [c() for c in calls]
+    workers = min(len(calls), max_concurrency or LLM_MAX_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm") as pool:
+        # Ogni thread eredita il contesto (metriche della fase chiamante)
+        futures = [pool.submit(contextvars.copy_context().run, c) for c in calls]
+        return [f.result() for f in futures]
+
+
+def invalidate_llm_cache(prompt_version=None) -> None:
+    """Svuota la cache LLM, o solo le voci di una specifica versione di prompt."""
+    cache = get_llm_cache()
+    if prompt_version is None:
+        cache.clear()
+        logger.info("Cache LLM svuotata")
+    else:
+        n = cache.delete_prefix(f"{prompt_version}:")
+        logger.info("Cache LLM: rimosse %d voci per il prompt %s", n, prompt_version)
+
+
+def llm_cache_stats() -> dict:
+    """Contatori hit/miss e dimensione della cache LLM."""
+    return get_llm_cache().stats()
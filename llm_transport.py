@@ -0,0 +1,133 @@
+"""llm_transport.py
+==================
+Trasporto sostituibile sotto tutte le chiamate `openai.ChatCompletion.create`
+(usato da llm_client.py). Modalità, scelte con LLM_TRANSPORT:
+
+  passthrough  (default) chiamata reale ad Azure/OpenAI
+  record       chiamata reale + salvataggio richiesta/risposta in una "cassetta"
+  replay       nessuna chiamata di rete: la risposta viene letta dalla cassetta;
+               una richiesta senza cassetta solleva `CassetteNotFoundError`
+
+Le cassette sono file JSON in LLM_CASSETTE_DIR, una per richiesta, indicizzate
+per hash di deployment + messaggi + parametri. In replay si può simulare la
+latenza con LLM_REPLAY_LATENCY (secondi, oppure "recorded" per la latenza
+registrata).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+
+import openai
+
+logger = logging.getLogger("UFP_Agents.transport")
+
+MODES = ("passthrough", "record", "replay")
+
+
+class CassetteNotFoundError(LookupError):
+    """Richiesta senza cassetta registrata in modalità replay."""
+
+
+def _mode():
+    mode = os.getenv("LLM_TRANSPORT", "passthrough").lower()
+    if mode not in MODES:
+        raise ValueError(f"LLM_TRANSPORT non valido: {mode} (ammessi: {', '.join(MODES)})")
+    return mode
+
+
+def _cassette_dir():
+    return os.getenv("LLM_CASSETTE_DIR", "cassettes")
+
+
+def request_key(engine, messages, params) -> str:
+    payload = json.dumps({"engine": engine, "messages": messages, "params": params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cassette_path(key):
+    return os.path.join(_cassette_dir(), f"{key}.json")
+
+
+def _save_cassette(key, engine, messages, params, content, usage, latency):
+    os.makedirs(_cassette_dir(), exist_ok=True)
+    path = _cassette_path(key)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"request": {"engine": engine, "messages": messages, "params": params},
+                   "response": {"content": content, "usage": usage},
+                   "latency_s": round(latency, 4),
+                   "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                  f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    logger.debug("Cassetta registrata: %s", path)
+
+
+def _load_cassette(key, messages):
+    path = _cassette_path(key)
+    if not os.path.exists(path):
+        preview = (messages[-1]["content"] if messages else "")[:120].replace("\n", " ")
+        raise CassetteNotFoundError(
+            f"Nessuna cassetta per la richiesta {key[:16]} in {_cassette_dir()} "
+            f"(ultimo messaggio: {preview!r}). Registrarla con LLM_TRANSPORT=record."
+        )
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _replay_sleep(cassette):
+    setting = os.getenv("LLM_REPLAY_LATENCY", "0")
+    delay = cassette.get("latency_s", 0.0) if setting == "recorded" else float(setting)
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _as_response(content, usage):
+    return {"choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": usage or {}}
+
+
+def _as_stream(content):
+    # Frammenti "a parola" per riprodurre lo streaming lato UI
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        yield {"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+
+
+def _recording_stream(resp, on_done):
+    parts = []
+    for chunk in resp:
+        choices = chunk.get("choices") or []
+        if choices:
+            parts.append((choices[0].get("delta") or {}).get("content") or "")
+        yield chunk
+    on_done("".join(parts))
+
+
+def create_chat_completion(engine, messages, stream=False, **params):
+    """Drop-in di `openai.ChatCompletion.create` secondo la modalità LLM_TRANSPORT."""
+    mode = _mode()
+    if mode == "passthrough":
+        return openai.ChatCompletion.create(engine=engine, messages=messages,
+                                            stream=stream, **params)
+
+    key = request_key(engine, messages, params)
+    if mode == "replay":
+        cassette = _load_cassette(key, messages)
+        _replay_sleep(cassette)
+        content = cassette["response"]["content"]
+        return _as_stream(content) if stream else _as_response(content,
+                                                               cassette["response"].get("usage"))
+
+    # record
+    t0 = time.perf_counter()
+    resp = openai.ChatCompletion.create(engine=engine, messages=messages, stream=stream, **params)
+    if stream:
+        return _recording_stream(resp, lambda content: _save_cassette(
+            key, engine, messages, params, content, None, time.perf_counter() - t0))
+    _save_cassette(key, engine, messages, params, resp["choices"][0]["message"]["content"],
+                   dict(resp.get("usage") or {}), time.perf_counter() - t0)
+    return resp
@@ -0,0 +1,421 @@
+"""manual_ingest.py
+=================
+Ingestione versionata del manuale di conteggio (PDF) per il retrieval.
+
+Tutti gli artefatti (chunk, embedding, indice FAISS) stanno in una cartella
+sotto MANUAL_INDEX_DIR il cui nome deriva da hash del PDF, parametri di
+chunking e nome del modello, descritta da un `manifest.json`: se uno di questi
+cambia la cartella è diversa e nulla di vecchio viene riusato per errore.
+
+- Le pagine vengono estratte in parallelo da processi worker (una sola
+  `extract_text` per pagina).
+- I chunk sono costruiti pagina per pagina (con overlap e con il titolo di
+  sezione corrente), quindi non attraversano le pagine.
+- Chunk ed embedding di ogni pagina sono conservati per hash del testo della
+  pagina: con una nuova release del manuale vengono ricalcolate solo le pagine
+  cambiate, in un unico batch di `model.encode`.
+
+L'indice esatto (`index-flat.faiss`) è l'unica copia dei vettori; le varianti
+compresse (MANUAL_INDEX_KIND = fp16 | pq | ivf | hnsw) sono derivate da esso al
+primo uso. Gli indici sono aperti in memory-map read-only, così i processi
+worker condividono le stesse pagine invece di tenerne ciascuno una copia, e
+vengono caricati solo al primo retrieval. `python manual_ingest.py report`
+confronta recall e latenza delle varianti con l'indice esatto.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from chunking import chunk_text, is_heading
+from lazy_imports import lazy_module
+from metrics import stage_timer
+from sqlite_cache import CACHE_DIR
+
+logger = logging.getLogger("UFP_Agents.manual")
+
+faiss = lazy_module("faiss")
+PyPDF2 = lazy_module("PyPDF2")
+
+MANUAL_INDEX_DIR = os.getenv("MANUAL_INDEX_DIR", os.path.join(CACHE_DIR, "manual"))
+MANUAL_INGEST_WORKERS = int(os.getenv("MANUAL_INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 2
+
+INDEX_KINDS = ("flat", "fp16", "pq", "ivf", "hnsw")
+MANUAL_INDEX_KIND = os.getenv("MANUAL_INDEX_KIND", "flat")
+MANUAL_INDEX_MMAP = os.getenv("MANUAL_INDEX_MMAP", "1") == "1"
+IVF_NPROBE = int(os.getenv("MANUAL_IVF_NPROBE", "4"))
+HNSW_EF_SEARCH = int(os.getenv("MANUAL_HNSW_EF_SEARCH", "64"))
+
+_load_lock = threading.Lock()
+
+
+@dataclass
+class ManualIndex:
+    """Indice del manuale su disco; chunk e indice FAISS sono caricati al primo accesso."""
+    directory: str
+    manifest: dict
+    kind: str = "flat"
+    _chunks: Optional[List[dict]] = field(default=None, repr=False)   # {"text", "page", "section"}
+    _index: object = field(default=None, repr=False)
+
+    @property
+    def chunks(self) -> List[dict]:
+        if self._chunks is None:
+            with _load_lock:
+                if self._chunks is None:
+                    with open(os.path.join(self.directory, self.manifest["chunks_file"]),
+                              encoding="utf-8") as f:
+                        self._chunks = json.load(f)
+        return self._chunks
+
+    @property
+    def texts(self) -> List[str]:
+        return [c["text"] for c in self.chunks]
+
+    @property
+    def index(self):
+        if self._index is None:
+            with _load_lock:
+                if self._index is None:
+                    with stage_timer("manual_index_load"):
+                        self._index = open_index(self.directory, self.kind)
+        return self._index
+
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _text_sha256(text) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+###############################################################################
+# Estrazione pagine (processi worker)
+###############################################################################
+def _extract_page_range(pdf_path, start, stop):
+    with open(pdf_path, "rb") as f:
+        pages = PyPDF2.PdfReader(f).pages
+        return [(n, (pages[n].extract_text() or "").strip()) for n in range(start, stop)]
+
+
+def extract_pages(pdf_path, workers=None) -> List[str]:
+    """Testo di ogni pagina (indice = numero di pagina), estratto in parallelo."""
+    with open(pdf_path, "rb") as f:
+        n_pages = len(PyPDF2.PdfReader(f).pages)
+    workers = max(1, min(workers or MANUAL_INGEST_WORKERS, n_pages))
+    step = -(-n_pages // workers)
+    ranges = [(s, min(s + step, n_pages)) for s in range(0, n_pages, step)]
+    if workers == 1:
+        parts = [_extract_page_range(pdf_path, s, e) for s, e in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_extract_page_range, *zip(*[(pdf_path, s, e) for s, e in ranges])))
+    texts = [""] * n_pages
+    for part in parts:
+        for n, text in part:
+            texts[n] = text
+    return texts
+
+
+###############################################################################
+# Chunk per pagina
+###############################################################################
+def chunk_page(text, page, section, chunk_size, overlap):
+    """Chunk di una pagina con pagina e sezione; ritorna anche la sezione corrente a fine pagina."""
+    chunks = []
+    for piece in chunk_text(text, chunk_size, overlap_tokens=overlap):
+        for line in piece.splitlines():
+            if is_heading(line):
+                section = line.strip()
+                break
+        chunks.append({"text": piece, "page": page + 1, "section": section})
+    for line in text.splitlines():
+        if is_heading(line):
+            section = line.strip()
+    return chunks, section
+
+
+def _params_key(chunk_size, overlap, model_name):
+    return _text_sha256(json.dumps({"v": MANIFEST_VERSION, "chunk_size": chunk_size,
+                                    "overlap": overlap, "model": model_name}, sort_keys=True))[:16]
+
+
+def manual_directory(pdf_sha, chunk_size, overlap, model_name, root=None):
+    root = root or MANUAL_INDEX_DIR
+    return os.path.join(root, f"{pdf_sha[:16]}-{_params_key(chunk_size, overlap, model_name)}")
+
+
+_index_key_cache = {}
+
+
+def manual_index_key(pdf_path, chunk_size, overlap, model_name) -> str:
+    """
+    Nome della cartella dell'indice per (PDF, parametri, modello), senza
+    caricare modello né indice. L'hash del PDF è ricalcolato solo se
+    cambiano dimensione o data di modifica del file.
+    """
+    st = os.stat(pdf_path)
+    stamp = (os.path.abspath(pdf_path), st.st_size, st.st_mtime_ns)
+    if _index_key_cache.get("stamp") != stamp:
+        _index_key_cache.update(stamp=stamp, sha=file_sha256(pdf_path))
+    return os.path.basename(manual_directory(_index_key_cache["sha"], chunk_size, overlap,
+                                             model_name, root="."))
+
+
+def _page_cache_paths(root, params_key, page_sha):
+    base = os.path.join(root, "pages", params_key, page_sha)
+    return base + ".json", base + ".npy"
+
+
+###############################################################################
+# Indici FAISS (esatto e varianti compresse)
+###############################################################################
+def index_path(directory, kind) -> str:
+    return os.path.join(directory, f"index-{kind}.faiss")
+
+
+def index_factory_string(kind, dim, n) -> str:
+    """Descrizione `faiss.index_factory` della variante, dimensionata sul numero di vettori."""
+    if kind == "flat":
+        return "Flat"
+    if kind == "fp16":
+        return "SQfp16"
+    if kind == "pq":
+        # ~4 dimensioni per sottoquantizzatore; 4 bit finché i vettori non bastano ad addestrarne 8
+        m = max(s for s in range(1, max(1, dim // 4) + 1) if dim % s == 0)
+        return f"PQ{m}x{8 if n >= 10000 else 4}"
+    if kind == "ivf":
+        return f"IVF{max(1, min(int(n ** 0.5), n // 39))},SQfp16"
+    if kind == "hnsw":
+        return "HNSW32,SQfp16"
+    raise ValueError(f"Tipo di indice non valido: {kind!r} (ammessi: {', '.join(INDEX_KINDS)})")
+
+
+def build_index_variant(directory, kind) -> str:
+    """Costruisce (se manca) la variante `kind` a partire dai vettori dell'indice esatto."""
+    path = index_path(directory, kind)
+    if os.path.exists(path):
+        return path
+    flat = faiss.read_index(index_path(directory, "flat"))
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    spec = index_factory_string(kind, flat.d, flat.ntotal)
+    logger.info("Costruzione indice %s (%s) su %d vettori", kind, spec, flat.ntotal)
+    with stage_timer("manual_index_build"):
+        idx = faiss.index_factory(flat.d, spec)
+        idx.train(vectors)
+        idx.add(vectors)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    faiss.write_index(idx, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def open_index(directory, kind=None, mmap=None):
+    """Indice `kind` del manuale, in memory-map read-only se MANUAL_INDEX_MMAP=1."""
+    kind = kind or MANUAL_INDEX_KIND
+    mmap = MANUAL_INDEX_MMAP if mmap is None else mmap
+    path = build_index_variant(directory, kind)
+    if mmap:
+        # IO_FLAG_MMAP_IFC (faiss >= 1.8) mappa anche i codici degli indici flat/SQ/PQ
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if mmap_flag is None:
+            logger.warning("faiss %s senza IO_FLAG_MMAP_IFC (richiede faiss >= 1.8): "
+                           "l'indice %s potrebbe essere caricato interamente in RAM",
+                           getattr(faiss, "__version__", "?"), kind)
+            mmap_flag = faiss.IO_FLAG_MMAP
+        idx = faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+    else:
+        idx = faiss.read_index(path)
+    if kind == "ivf":
+        ivf = faiss.extract_index_ivf(idx)
+        ivf.nprobe = min(IVF_NPROBE, ivf.nlist)
+    elif kind == "hnsw":
+        idx.hnsw.efSearch = HNSW_EF_SEARCH
+    return idx
+
+
+def load_manual_index(directory, kind=None) -> ManualIndex:
+    """Indice già costruito nella sua cartella (chunk e vettori caricati al primo accesso)."""
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    return ManualIndex(directory, manifest, kind or MANUAL_INDEX_KIND)
+
+
+###############################################################################
+# Ingestione
+###############################################################################
+def ingest_manual(pdf_path, model, model_name, chunk_size=128, overlap=16, root=None,
+                  workers=None, kind=None) -> ManualIndex:
+    """
+    Ritorna l'indice del manuale per (PDF, parametri, modello), costruendolo se
+    manca. Le pagine già viste (stesso testo, stessi parametri e modello)
+    riusano chunk ed embedding salvati. `kind` sceglie la variante di indice
+    usata per la ricerca (default MANUAL_INDEX_KIND).
+    """
+    root = root or MANUAL_INDEX_DIR
+    pdf_sha = file_sha256(pdf_path)
+    directory = manual_directory(pdf_sha, chunk_size, overlap, model_name, root)
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        logger.info("Indice del manuale aggiornato: %s", directory)
+        return load_manual_index(directory, kind)
+
+    params_key = _params_key(chunk_size, overlap, model_name)
+    with stage_timer("manual_extract"):
+        pages = extract_pages(pdf_path, workers)
+
+    # Chunk di ogni pagina: dalla cache per hash di pagina, oppure nuovi
+    page_chunks, page_emb, to_embed, section = [], {}, [], ""
+    for n, text in enumerate(pages):
+        page_sha = _text_sha256(f"{section}\x00{text}")
+        json_path, npy_path = _page_cache_paths(root, params_key, page_sha)
+        if os.path.exists(json_path) and os.path.exists(npy_path):
+            with open(json_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            # La pagina può essersi spostata rispetto alla release in cui è stata vista
+            chunks = [{**c, "page": n + 1} for c in cached["chunks"]]
+            section = cached["section_after"]
+            page_emb[n] = np.load(npy_path)
+        else:
+            chunks, section_after = chunk_page(text, n, section, chunk_size, overlap)
+            to_embed.append((n, page_sha, section_after))
+            section = section_after
+        page_chunks.append(chunks)
+
+    logger.info("Manuale %s: %d pagine, %d da (ri)calcolare",
+                os.path.basename(pdf_path), len(pages), len(to_embed))
+    if to_embed:
+        texts = [c["text"] for n, _, _ in to_embed for c in page_chunks[n]]
+        with stage_timer("manual_embed"):
+            emb = np.asarray(model.encode(texts, batch_size=ENCODE_BATCH_SIZE), dtype="float32")
+        offset = 0
+        for n, page_sha, section_after in to_embed:
+            count = len(page_chunks[n])
+            page_emb[n] = emb[offset:offset + count]
+            offset += count
+            json_path, npy_path = _page_cache_paths(root, params_key, page_sha)
+            os.makedirs(os.path.dirname(json_path), exist_ok=True)
+            np.save(npy_path, page_emb[n])
+            _write_atomic(json_path, json.dumps({"chunks": page_chunks[n],
+                                                 "section_after": section_after},
+                                                ensure_ascii=False).encode("utf-8"))
+
+    chunks = [c for pc in page_chunks for c in pc]
+    vectors = [page_emb[n] for n in range(len(pages)) if len(page_chunks[n])]
+    emb = np.vstack(vectors).astype("float32") if vectors else np.zeros((0, 1), "float32")
+    with stage_timer("manual_index"):
+        idx = faiss.IndexFlatL2(emb.shape[1])
+        idx.add(emb)
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "pdf": os.path.basename(pdf_path), "pdf_sha256": pdf_sha,
+        "chunk_size": chunk_size, "overlap": overlap, "model": model_name,
+        "pages": len(pages), "pages_rebuilt": len(to_embed), "chunks": len(chunks),
+        "dimension": int(emb.shape[1]),
+        "chunks_file": "chunks.json", "index_file": os.path.basename(index_path(directory, "flat")),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    _write_atomic(os.path.join(directory, "chunks.json"),
+                  json.dumps(chunks, ensure_ascii=False).encode("utf-8"))
+    faiss.write_index(idx, index_path(directory, "flat"))
+    # Il manifest è scritto per ultimo: la sua presenza indica un indice completo
+    _write_atomic(os.path.join(directory, MANIFEST_FILE),
+                  json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return ManualIndex(directory, manifest, kind or MANUAL_INDEX_KIND, _chunks=chunks)
+
+
+###############################################################################
+# Report recall / latenza delle varianti
+###############################################################################
+def sample_queries(flat, n_queries=200, seed=0) -> np.ndarray:
+    """Query sintetiche: punti medi di coppie casuali di chunk (non coincidono con nessun chunk)."""
+    rng = np.random.default_rng(seed)
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    a, b = (rng.integers(0, flat.ntotal, n_queries) for _ in range(2))
+    return ((vectors[a] + vectors[b]) / 2).astype("float32")
+
+
+def index_report(directory, kinds=INDEX_KINDS, queries=None, k=5, repeats=5) -> List[dict]:
+    """
+    Per ogni variante: dimensione su disco, latenza media per query e recall@k
+    rispetto ai risultati dell'indice esatto sulle stesse query.
+    """
+    flat = open_index(directory, "flat")
+    queries = sample_queries(flat) if queries is None else np.asarray(queries, dtype="float32")
+    _, exact = flat.search(queries, k)
+    rows = []
+    for kind in kinds:
+        idx = open_index(directory, kind)
+        idx.search(queries[:1], k)   # prima ricerca fuori dal tempo (page fault del mmap)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, found = idx.search(queries, k)
+        latency = (time.perf_counter() - start) / (repeats * len(queries))
+        recall = np.mean([len(set(e[e >= 0]) & set(f[f >= 0])) / max(1, (e >= 0).sum())
+                          for e, f in zip(exact, found)])
+        rows.append({"kind": kind,
+                     "index": index_factory_string(kind, flat.d, flat.ntotal),
+                     "size_kb": round(os.path.getsize(index_path(directory, kind)) / 1024, 1),
+                     "latency_us": round(latency * 1e6, 1),
+                     f"recall@{k}": round(float(recall), 3)})
+    return rows
+
+
+def render_index_report(rows) -> str:
+    cols = list(rows[0])
+    lines = ["| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    lines += ["| " + " | ".join(str(r[c]) for c in cols) + " |" for r in rows]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    import agente_calcolo  # noqa: F401 – configura il logger "UFP_Agents"
+    from manual_retrieval import (EMBEDDING_MODEL_NAME, MANUAL_CHUNK_OVERLAP, MANUAL_CHUNK_TOKENS,
+                                  MANUAL_PDF_PATH, encode_queries, load_embedding_model)
+
+    parser = argparse.ArgumentParser(description="Indice del manuale di conteggio")
+    parser.add_argument("command", choices=("build", "report"),
+                        help="build: costruisce indice e varianti; report: recall/latenza delle varianti")
+    parser.add_argument("--pdf", default=MANUAL_PDF_PATH)
+    parser.add_argument("--kinds", nargs="+", default=list(INDEX_KINDS), choices=INDEX_KINDS)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--queries", help="file di testo con una query per riga (altrimenti sintetiche)")
+    args = parser.parse_args()
+
+    model = load_embedding_model()
+    manual = ingest_manual(args.pdf, model, EMBEDDING_MODEL_NAME,
+                           chunk_size=MANUAL_CHUNK_TOKENS, overlap=MANUAL_CHUNK_OVERLAP)
+    if args.command == "build":
+        for kind in args.kinds:
+            build_index_variant(manual.directory, kind)
+        print(json.dumps(manual.manifest, ensure_ascii=False, indent=2))
+    else:
+        queries = None
+        if args.queries:
+            with open(args.queries, encoding="utf-8") as f:
+                queries = encode_queries(model, [line.strip() for line in f if line.strip()])
+        print(render_index_report(index_report(manual.directory, args.kinds, queries, k=args.k)))
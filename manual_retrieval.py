@@ -0,0 +1,146 @@
+"""manual_retrieval.py
+====================
+Recupero di contesto dal manuale IFPUG (PDF) tramite indice FAISS.
+
+`search_batch` riceve tutte le query di un documento (es. i requisiti RF),
+le codifica in un unico batch vettoriale e fa una sola `index.search` con la
+matrice completa; i chunk del manuale restituiti per più query sono tenuti
+una sola volta. `manual_contexts` è il punto d'ingresso usato dalla pipeline
+(MANUAL_CONTEXT=1): modello, chunk e indice vengono caricati al primo uso,
+dall'indice versionato costruito da manual_ingest.py (in memory-map, nella
+variante MANUAL_INDEX_KIND).
+"""
+import os
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from embedding_cache import encode_cached
+from lazy_imports import lazy_module
+from manual_ingest import (HNSW_EF_SEARCH, IVF_NPROBE, MANUAL_INDEX_KIND, ingest_manual,
+                           manual_index_key)
+from metrics import stage_timer
+
+logger = logging.getLogger("UFP_Agents.manual")
+
+# Caricati al primo uso (vedi lazy_imports.py): importare il modulo non carica torch
+faiss = lazy_module("faiss")
+sentence_transformers = lazy_module("sentence_transformers")
+
+MANUAL_PDF_PATH = os.getenv("MANUAL_PDF_PATH", "Function_Point_calcManual.pdf")
+MANUAL_CHUNK_TOKENS = int(os.getenv("MANUAL_CHUNK_TOKENS", "128"))
+MANUAL_CHUNK_OVERLAP = int(os.getenv("MANUAL_CHUNK_OVERLAP", "16"))
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+MANUAL_CONTEXT_ENABLED = os.getenv("MANUAL_CONTEXT", "0") == "1"
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "2"))
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+
+
+###############################################################################
+# Modello di embedding
+###############################################################################
+def load_embedding_model(name=EMBEDDING_MODEL_NAME):
+    return sentence_transformers.SentenceTransformer(name)
+
+
+###############################################################################
+# Retrieval a batch
+###############################################################################
+@dataclass
+class RetrievalResult:
+    queries: List[str]
+    hits: List[List[Tuple[int, float]]]                  # per query: (id chunk, distanza)
+    chunks: Dict[int, str] = field(default_factory=dict)  # chunk distinti recuperati
+
+    def context_for(self, i: int, max_chars=2000) -> str:
+        """Contesto della i-esima query (chunk in ordine di distanza)."""
+        return "\n".join(self.chunks[cid] for cid, _ in self.hits[i])[:max_chars]
+
+    def shared_context(self, max_chars=4000) -> str:
+        """Tutti i chunk recuperati, ciascuno una sola volta, dal più vicino."""
+        best = {}
+        for hits in self.hits:
+            for cid, dist in hits:
+                best[cid] = min(dist, best.get(cid, dist))
+        ordered = sorted(best, key=lambda cid: (best[cid], cid))
+        return "\n".join(self.chunks[cid] for cid in ordered)[:max_chars]
+
+
+def encode_queries(model, queries: List[str], model_name=EMBEDDING_MODEL_NAME) -> np.ndarray:
+    """
+    Un solo forward pass a batch per le query mai viste con questo modello;
+    le altre arrivano dalla cache degli embedding (embedding_cache.py).
+    """
+    return encode_cached(model, queries, model_name, batch_size=ENCODE_BATCH_SIZE)
+
+
+def search_batch(queries: List[str], idx, chunks, model, k=RETRIEVAL_K) -> RetrievalResult:
+    """Codifica tutte le query in un batch e le cerca con una sola `index.search`."""
+    if not queries:
+        return RetrievalResult([], [])
+    with stage_timer("retrieval_encode"):
+        qemb = encode_queries(model, queries)
+    with stage_timer("retrieval_search"):
+        dist, ids = idx.search(qemb, k)
+    hits = [[(int(c), float(d)) for c, d in zip(row_ids, row_dist) if c >= 0]
+            for row_ids, row_dist in zip(ids, dist)]
+    used = {cid for row in hits for cid, _ in row}
+    logger.info("Retrieval: %d query, %d chunk distinti su %d risultati",
+                len(queries), len(used), sum(len(r) for r in hits))
+    return RetrievalResult(list(queries), hits, {cid: chunks[cid] for cid in sorted(used)})
+
+
+def retrieve_context(query, idx, chunks, model, k=2):
+    """Compatibilità: contesto per una singola query (max 2000 caratteri)."""
+    return search_batch([query], idx, chunks, model, k=k).context_for(0)
+
+
+###############################################################################
+# Risorse condivise (caricate al primo uso)
+###############################################################################
+_resources = None
+_resources_lock = threading.Lock()
+
+
+def get_manual_resources():
+    """(modello, chunk, indice) del manuale, caricati una sola volta per processo."""
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                with stage_timer("manual_load"):
+                    model = load_embedding_model()
+                    manual = ingest_manual(MANUAL_PDF_PATH, model, EMBEDDING_MODEL_NAME,
+                                           chunk_size=MANUAL_CHUNK_TOKENS,
+                                           overlap=MANUAL_CHUNK_OVERLAP)
+                _resources = (model, manual.texts, manual.index)
+    return _resources
+
+
+def manual_signature():
+    """
+    Tutto ciò che determina il contesto del manuale dato ai prompt: cartella
+    dell'indice (hash del PDF, chunking, modello), variante e parametri di
+    ricerca. Fa parte della firma dell'archivio risultati; False se il
+    contesto del manuale è disattivato.
+    """
+    if not MANUAL_CONTEXT_ENABLED:
+        return False
+    signature = {"index": manual_index_key(MANUAL_PDF_PATH, MANUAL_CHUNK_TOKENS,
+                                           MANUAL_CHUNK_OVERLAP, EMBEDDING_MODEL_NAME),
+                 "kind": MANUAL_INDEX_KIND, "k": RETRIEVAL_K}
+    if MANUAL_INDEX_KIND == "ivf":
+        signature["nprobe"] = IVF_NPROBE
+    elif MANUAL_INDEX_KIND == "hnsw":
+        signature["ef_search"] = HNSW_EF_SEARCH
+    return signature
+
+
+def manual_contexts(queries: List[str], k=RETRIEVAL_K, max_chars=2000) -> List[str]:
+    """Contesto del manuale per ogni query, con un solo encode e una sola search."""
+    model, chunks, idx = get_manual_resources()
+    result = search_batch(queries, idx, chunks, model, k=k)
+    return [result.context_for(i, max_chars) for i in range(len(queries))]
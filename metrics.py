@@ -0,0 +1,331 @@
+"""metrics.py
+============
+Strumentazione per fase della pipeline.
+
+Ogni fase misurata con `stage_timer(nome)` registra tempo wall, tempo CPU
+(del thread che la esegue), variazione della memoria residente (RSS) durante
+la fase, picco di RSS del processo dal suo avvio e i token prompt / completion
+delle chiamate LLM fatte al suo interno. Le misure finiscono:
+  - nel `RunMetrics` dell'esecuzione corrente (`metrics_run()`), esportabile
+    come record JSON per run;
+  - in aggregati di processo esposti in formato testo Prometheus, su file
+    (`write_prometheus_textfile`) o da un endpoint HTTP locale
+    (`start_metrics_server`).
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+logger = logging.getLogger("UFP_Agents.metrics")
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+
+_current_run: ContextVar = ContextVar("ufp_metrics_run", default=None)
+_active_stages: ContextVar = ContextVar("ufp_metrics_stages", default=())
+# Le fasi attive sono condivise dai thread che ereditano il contesto (run_concurrently)
+_usage_lock = threading.Lock()
+
+
+def _current_rss_mb() -> Optional[float]:
+    """Memoria residente attuale del processo (MB), se misurabile."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except Exception:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    except Exception:
+        return None
+
+
+def _process_peak_rss_mb() -> Optional[float]:
+    """Picco di memoria residente del processo dal suo avvio (MB), se misurabile."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux riporta KB, macOS byte
+        return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+    except Exception:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / 1024 / 1024, 1)
+    except Exception:
+        return None
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    parent: Optional[str] = None
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    # RSS a fine fase meno RSS a inizio fase: è del processo, quindi include
+    # anche le allocazioni di fasi concorrenti in altri thread
+    rss_delta_mb: Optional[float] = None
+    process_peak_rss_mb: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    llm_calls: int = 0
+    llm_cache_hits: int = 0
+
+
+@dataclass
+class RunMetrics:
+    label: str = ""
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    wall_s: float = 0.0
+    stages: List[StageMetrics] = field(default_factory=list)
+    compaction: List[dict] = field(default_factory=list)   # report di text_compaction.py
+    ocr: List[dict] = field(default_factory=list)          # tempi per immagine di ocr_engine.py
+    degraded: List[dict] = field(default_factory=list)     # errori assorbiti (vedi record_degraded)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, stage: StageMetrics):
+        with self._lock:
+            self.stages.append(stage)
+
+    def breakdown(self):
+        """Righe per fase (aggregando le fasi ripetute, es. più chiamate LLM)."""
+        rows = {}
+        for s in self.stages:
+            row = rows.setdefault(s.name, {"fase": s.name, "esecuzioni": 0, "wall_s": 0.0,
+                                           "cpu_s": 0.0, "max_rss_delta_mb": None,
+                                           "process_peak_rss_mb": None,
+                                           "prompt_tokens": 0, "completion_tokens": 0})
+            row["esecuzioni"] += 1
+            row["wall_s"] = round(row["wall_s"] + s.wall_s, 3)
+            row["cpu_s"] = round(row["cpu_s"] + s.cpu_s, 3)
+            if s.rss_delta_mb is not None:
+                row["max_rss_delta_mb"] = max(row["max_rss_delta_mb"] or 0, s.rss_delta_mb)
+            if s.process_peak_rss_mb is not None:
+                row["process_peak_rss_mb"] = max(row["process_peak_rss_mb"] or 0,
+                                                 s.process_peak_rss_mb)
+            row["prompt_tokens"] += s.prompt_tokens
+            row["completion_tokens"] += s.completion_tokens
+        return list(rows.values())
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "run_id": self.run_id, "label": self.label, "started_at": self.started_at,
+                "wall_s": round(self.wall_s, 3),
+                "stages": [asdict(s) for s in self.stages],
+                "breakdown": self.breakdown(),
+                "compaction": list(self.compaction),
+                "ocr": list(self.ocr),
+                "degraded": list(self.degraded),
+            }
+
+
+###############################################################################
+# Aggregati di processo (formato Prometheus)
+###############################################################################
+_agg_lock = threading.Lock()
+_agg = {}  # stage -> dict di contatori
+
+
+def _update_aggregates(stage: StageMetrics):
+    with _agg_lock:
+        a = _agg.setdefault(stage.name, {"count": 0, "wall": 0.0, "cpu": 0.0,
+                                         "prompt": 0, "completion": 0})
+        a["count"] += 1
+        a["wall"] += stage.wall_s
+        a["cpu"] += stage.cpu_s
+        a["prompt"] += stage.prompt_tokens
+        a["completion"] += stage.completion_tokens
+
+
+_PROM_FAMILIES = [
+    ("ufp_stage_runs_total", "Esecuzioni di ciascuna fase della pipeline.", "count", ""),
+    ("ufp_stage_wall_seconds_total", "Tempo wall cumulato per fase.", "wall", ""),
+    ("ufp_stage_cpu_seconds_total", "Tempo CPU cumulato per fase.", "cpu", ""),
+    ("ufp_llm_tokens_total", "Token LLM per fase e tipo (prompt/completion).", "prompt", ',kind="prompt"'),
+    ("ufp_llm_tokens_total", "", "completion", ',kind="completion"'),
+]
+
+
+def prometheus_text() -> str:
+    lines, declared = [], set()
+    with _agg_lock:
+        stages = sorted(_agg.items())
+    for family, help_text, key, extra in _PROM_FAMILIES:
+        if family not in declared:
+            declared.add(family)
+            lines += [f"# HELP {family} {help_text}", f"# TYPE {family} counter"]
+        for name, a in stages:
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            value = a[key]
+            value = f"{value:.6f}" if isinstance(value, float) else str(value)
+            lines.append(f'{family}{{stage="{label}"{extra}}} {value}')
+    rss = _process_peak_rss_mb()
+    if rss is not None:
+        lines += ["# HELP ufp_process_peak_rss_bytes Picco di memoria residente del processo.",
+                  "# TYPE ufp_process_peak_rss_bytes gauge",
+                  f"ufp_process_peak_rss_bytes {int(rss * 1024 * 1024)}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(path=None) -> str:
+    """Scrive le metriche in formato testo (es. per il textfile collector di node_exporter)."""
+    path = path or os.path.join(METRICS_DIR, "ufp_metrics.prom")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404); return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Avvia (una sola volta per processo) l'endpoint /metrics in un thread daemon."""
+    global _server
+    port = int(port or os.getenv("METRICS_PORT", "9464"))
+    with _agg_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True,
+                             name="metrics-http").start()
+            logger.info("Endpoint metriche Prometheus su http://%s:%d/metrics", host, port)
+    return _server
+
+
+###############################################################################
+# API di strumentazione
+###############################################################################
+@contextmanager
+def metrics_run(label=""):
+    """Apre un record di metriche per un'esecuzione della pipeline."""
+    run = RunMetrics(label=label)
+    token = _current_run.set(run)
+    t0 = time.perf_counter()
+    try:
+        yield run
+    finally:
+        run.wall_s = time.perf_counter() - t0
+        _current_run.reset(token)
+
+
+def current_run() -> Optional[RunMetrics]:
+    return _current_run.get()
+
+
+@contextmanager
+def stage_timer(name):
+    """Misura una fase; le fasi annidate ricevono il nome della fase padre."""
+    parents = _active_stages.get()
+    stage = StageMetrics(name=name, parent=parents[-1].name if parents else None)
+    token = _active_stages.set(parents + (stage,))
+    wall0, cpu0, rss0 = time.perf_counter(), time.thread_time(), _current_rss_mb()
+    try:
+        yield stage
+    finally:
+        stage.wall_s = round(time.perf_counter() - wall0, 4)
+        stage.cpu_s = round(time.thread_time() - cpu0, 4)
+        rss1 = _current_rss_mb()
+        if rss0 is not None and rss1 is not None:
+            stage.rss_delta_mb = round(rss1 - rss0, 1)
+        stage.process_peak_rss_mb = _process_peak_rss_mb()
+        _active_stages.reset(token)
+        _update_aggregates(stage)
+        run = _current_run.get()
+        if run is not None:
+            run.add(stage)
+
+
+def record_stage(name, wall_s):
+    """Registra una fase misurata altrove (es. eseguita in un altro processo)."""
+    stage = StageMetrics(name=name, wall_s=round(wall_s, 4),
+                         process_peak_rss_mb=_process_peak_rss_mb())
+    _update_aggregates(stage)
+    run = _current_run.get()
+    if run is not None:
+        run.add(stage)
+
+
+def record_llm_usage(prompt_tokens=0, completion_tokens=0, cached=False):
+    """
+    Attribuisce i token di una chiamata LLM a tutte le fasi attive. Le fasi
+    padre ricevono aggiornamenti da più thread, quindi i contatori sono
+    aggiornati sotto lock.
+    """
+    with _usage_lock:
+        for stage in _active_stages.get():
+            stage.llm_calls += 1
+            stage.llm_cache_hits += int(cached)
+            stage.prompt_tokens += prompt_tokens
+            stage.completion_tokens += completion_tokens
+
+
+def record_compaction(report: dict):
+    """Registra nella run corrente il report di compattazione di un testo."""
+    run = _current_run.get()
+    if run is not None:
+        with run._lock:
+            run.compaction.append(report)
+
+
+def record_ocr(report: List[dict]):
+    """Registra nella run corrente il report per immagine di un passaggio OCR."""
+    run = _current_run.get()
+    if run is not None:
+        with run._lock:
+            run.ocr.extend(report)
+
+
+def record_degraded(stage, reason):
+    """
+    Registra nella run corrente un errore assorbito (la fase ha prodotto un
+    risultato parziale o vuoto invece di fallire): i risultati di una run
+    degradata non vengono salvati nell'archivio risultati.
+    """
+    logger.warning("Fase %s degradata: %s", stage, reason)
+    run = _current_run.get()
+    if run is not None:
+        with run._lock:
+            run.degraded.append({"stage": stage, "reason": str(reason)})
+
+
+def save_run_metrics(run: RunMetrics, directory=None) -> str:
+    """Salva il record JSON della run in METRICS_DIR/run-<id>.json."""
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"run-{run.run_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run.to_dict(), f, ensure_ascii=False, indent=2)
+    return path
@@ -0,0 +1,259 @@
+"""ocr_engine.py
+===============
+Motore OCR condiviso a livello di processo.
+
+Il `easyocr.Reader` (modelli di detection + recognition) viene costruito UNA
+sola volta per processo, in modo pigro e thread-safe, invece che a ogni
+chiamata di OCR. `warm_up_ocr()` permette all'app di caricarlo all'avvio.
+
+`ocr_images()` passa inoltre da una cache su disco indicizzata per hash del
+blob + configurazione OCR: loghi, banner e diagrammi standard ripetuti nei
+template ARU vengono riconosciuti una sola volta. Con OCR_WORKERS > 1 le
+immagini non in cache vengono distribuite su un pool di processi, ciascuno
+con il proprio Reader già caricato; l'ordine di output resta quello del documento.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlite_cache import SQLiteCache, cache_path
+from lazy_imports import import_timed
+from metrics import record_degraded, record_ocr, stage_timer
+
+logger = logging.getLogger("UFP_Agents.ocr")
+
+OCR_LANGUAGES = ["it", "en"]
+OCR_GPU = os.getenv("OCR_GPU", "0") == "1"
+
+_reader = None
+_load_seconds = None
+_init_lock = threading.Lock()
+_read_lock = threading.Lock()
+
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "64"))
+_ocr_cache = None
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))  # 0/1 = OCR sequenziale in-process
+_pools = {}  # numero di worker -> ProcessPoolExecutor
+
+
+def get_ocr_reader():
+    """Ritorna il Reader EasyOCR condiviso, caricandolo alla prima richiesta."""
+    global _reader, _load_seconds
+    if _reader is not None:
+        return _reader
+    with _init_lock:
+        if _reader is None:
+            t0 = time.perf_counter()
+            easyocr = import_timed("easyocr")  # import pesante (torch): solo quando serve davvero
+            _reader = easyocr.Reader(OCR_LANGUAGES, gpu=OCR_GPU)
+            _load_seconds = time.perf_counter() - t0
+            logger.info("EasyOCR caricato in %.2f s (lingue=%s, gpu=%s)",
+                        _load_seconds, OCR_LANGUAGES, OCR_GPU)
+    return _reader
+
+
+def read_text(image, detail=0):
+    """
+    OCR di una singola immagine (blob, path o array) con il Reader condiviso.
+    Le inferenze sono serializzate: torch usa già più thread per chiamata.
+    """
+    reader = get_ocr_reader()
+    with _read_lock:
+        return reader.readtext(image, detail=detail)
+
+
+def warm_up_ocr(workers=None) -> float:
+    """
+    Hook di warm-up: carica i modelli e ritorna il tempo di caricamento (s).
+    Con `workers` (default OCR_WORKERS) > 1 l'OCR gira nei processi del pool:
+    vengono avviati quelli, ciascuno con il proprio Reader, e il Reader
+    in-process non viene caricato.
+    """
+    workers = OCR_WORKERS if workers is None else workers
+    if workers > 1:
+        t0 = time.perf_counter()
+        # Un task per worker: il pool avvia tutti i processi e ne attende l'inizializzazione
+        list(get_ocr_pool(workers).map(_worker_ready, range(workers)))
+        return time.perf_counter() - t0
+    get_ocr_reader()
+    return _load_seconds or 0.0
+
+
+def ocr_load_seconds():
+    """Tempo impiegato per caricare i modelli, None se non ancora caricati."""
+    return _load_seconds
+
+
+###############################################################################
+# Cache OCR content-addressed
+###############################################################################
+def _ocr_config_signature(detail) -> str:
+    try:
+        from importlib.metadata import version
+        easyocr_version = version("easyocr")
+    except Exception:
+        easyocr_version = "unknown"
+    return json.dumps({"langs": OCR_LANGUAGES, "gpu": OCR_GPU, "detail": detail,
+                       "easyocr": easyocr_version}, sort_keys=True)
+
+
+def get_ocr_cache() -> SQLiteCache:
+    global _ocr_cache
+    if _ocr_cache is None:
+        with _init_lock:
+            if _ocr_cache is None:
+                _ocr_cache = SQLiteCache(cache_path("ocr_cache.sqlite"),
+                                         max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024)
+    return _ocr_cache
+
+
+def _image_bytes(image) -> bytes:
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    with open(image, "rb") as f:
+        return f.read()
+
+
+###############################################################################
+# Pool di processi OCR
+###############################################################################
+def _worker_init(workers):
+    # Ogni worker divide i core disponibili e carica subito il proprio Reader
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    except Exception:
+        pass
+    get_ocr_reader()
+
+
+def _worker_ready(_):
+    return os.getpid()
+
+
+def _ocr_worker(blob, detail):
+    t0 = time.perf_counter()
+    try:
+        result, error = list(read_text(blob, detail=detail)), None
+    except Exception as e:
+        result, error = [], str(e)
+    return result, time.perf_counter() - t0, error
+
+
+def get_ocr_pool(workers=None) -> ProcessPoolExecutor:
+    """
+    Pool di processi OCR condiviso per numero di worker (creato alla prima
+    richiesta). Un pool non viene mai chiuso mentre un altro thread lo usa:
+    richieste con un diverso numero di worker ottengono un pool proprio.
+    """
+    workers = workers or OCR_WORKERS
+    with _init_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                         initializer=_worker_init,
+                                                         initargs=(workers,))
+            logger.info("Pool OCR avviato con %d processi", workers)
+    return pool
+
+
+def _discard_pool(pool):
+    # Pool rotto (worker terminato): lo toglie dal registro, il prossimo uso ne crea uno nuovo
+    with _init_lock:
+        for workers, p in list(_pools.items()):
+            if p is pool:
+                del _pools[workers]
+    pool.shutdown(wait=False)
+
+
+def shutdown_ocr_pool():
+    with _init_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def ocr_images_with_report(images, detail=0, workers=None):
+    """
+    OCR di una lista di immagini (blob o path), nell'ordine ricevuto.
+    Ritorna `(results, report)`:
+      - results: per ogni immagine, la lista di stringhe riconosciute
+        (lista vuota se l'immagine non è leggibile)
+      - report:  per ogni immagine, dict con index, sha256, cached, seconds
+
+    Le immagini identiche nello stesso documento vengono riconosciute una sola
+    volta, e i risultati sono riutilizzati dalla cache su disco tra le esecuzioni.
+    Con `workers` (default OCR_WORKERS) > 1 le immagini mancanti in cache sono
+    elaborate in parallelo sul pool di processi; se il pool si rompe (worker
+    terminato) si ripiega sull'OCR in-process. Il report viene registrato
+    anche nelle metriche della run corrente.
+    """
+    with stage_timer("ocr"):
+        return _ocr_images_with_report(images, detail, OCR_WORKERS if workers is None else workers)
+
+
+def _ocr_images_with_report(images, detail, workers):
+    cache = get_ocr_cache()
+    signature = _ocr_config_signature(detail)
+
+    keys, blobs = [], {}
+    for image in images:
+        blob = _image_bytes(image)
+        key = hashlib.sha256(blob + signature.encode("utf-8")).hexdigest()
+        keys.append(key)
+        blobs.setdefault(key, blob)
+
+    results, timings = {}, {}
+    misses = []
+    for key in blobs:
+        cached = cache.get(key)
+        if cached is not None:
+            results[key] = json.loads(cached)
+            timings[key] = (True, 0.0)
+        else:
+            misses.append(key)
+
+    outcomes = None
+    if workers > 1 and len(misses) > 1:
+        pool = get_ocr_pool(workers)
+        try:
+            outcomes = list(pool.map(_ocr_worker, [blobs[k] for k in misses],
+                                     [detail] * len(misses)))
+        except BrokenProcessPool as e:
+            logger.warning("Pool OCR non utilizzabile (%s): OCR in-process", e)
+            _discard_pool(pool)
+    if outcomes is None:
+        outcomes = (_ocr_worker(blobs[k], detail) for k in misses)
+
+    for key, (result, seconds, error) in zip(misses, outcomes):
+        results[key] = result
+        timings[key] = (False, seconds)
+        if error is None:
+            cache.set(key, json.dumps(result, ensure_ascii=False))
+        else:
+            record_degraded("ocr", f"immagine {key[:12]}: {error}")
+
+    report = [
+        {"index": i, "sha256": key[:16], "cached": timings[key][0],
+         "seconds": round(timings[key][1], 3)}
+        for i, key in enumerate(keys)
+    ]
+    slowest = sorted(report, key=lambda r: r["seconds"], reverse=True)[:5]
+    logger.info("OCR: %d immagini, %d uniche, %d da cache, %.2f s totali (workers=%d)",
+                len(keys), len(blobs), len(blobs) - len(misses),
+                sum(t[1] for t in timings.values()), max(workers, 1))
+    logger.debug("OCR immagini più lente: %s", slowest)
+    record_ocr(report)
+    return [results[key] for key in keys], report
+
+
+def ocr_images(images, detail=0, workers=None):
+    """Come `ocr_images_with_report`, ma ritorna solo i risultati."""
+    return ocr_images_with_report(images, detail=detail, workers=workers)[0]
@@ -0,0 +1,213 @@
+"""pipeline_dag.py
+=================
+Scheduler a grafo di dipendenze (DAG) per la pipeline di stima.
+
+Ogni fase (`Stage`) dichiara per nome le fasi da cui dipende e riceve i loro
+risultati come argomenti keyword. Lo scheduler avvia in parallelo ogni fase
+pronta, su un pool di thread (default), su un pool di processi (fasi CPU-bound,
+funzioni e argomenti devono essere picklabili) oppure nel thread chiamante
+("inline", es. per callback di UI in streaming). I risultati intermedi restano
+in memoria e a fine esecuzione viene calcolato il critical path.
+
+Fasi aggiuntive si registrano con `register_stage` senza modificare run_pipeline:
+
+    @register_stage("conteggio_tabelle", deps=("document",))
+    def conteggio_tabelle(document):
+        return len(document.tables)
+"""
+import time
+import logging
+import contextvars
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from metrics import record_stage
+
+logger = logging.getLogger("UFP_Agents.dag")
+
+EXECUTORS = ("thread", "process", "inline")
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable
+    deps: Tuple[str, ...] = ()
+    executor: str = "thread"
+
+
+@dataclass
+class PipelineRun:
+    results: Dict[str, object] = field(default_factory=dict)
+    timings: Dict[str, Tuple[float, float]] = field(default_factory=dict)  # (inizio, fine)
+    deps: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+    metrics: Optional[dict] = None   # record per fase (vedi metrics.py), se disponibile
+    degraded: List[str] = field(default_factory=list)   # motivi per cui la run è parziale
+
+    def duration(self, name) -> float:
+        start, end = self.timings.get(name, (0.0, 0.0))
+        return end - start
+
+    @property
+    def wall_time(self) -> float:
+        if not self.timings:
+            return 0.0
+        return (max(e for _, e in self.timings.values())
+                - min(s for s, _ in self.timings.values()))
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """Catena di fasi dipendenti con la durata complessiva più lunga."""
+        best: Dict[str, Tuple[float, List[str]]] = {}
+
+        def longest(name):
+            if name not in best:
+                prev = [longest(d) for d in self.deps.get(name, ()) if d in self.timings]
+                base = max(prev, key=lambda x: x[0]) if prev else (0.0, [])
+                best[name] = (base[0] + self.duration(name), base[1] + [name])
+            return best[name]
+
+        if not self.timings:
+            return [], 0.0
+        total, path = max((longest(n) for n in self.timings), key=lambda x: x[0])
+        return path, total
+
+
+class PipelineGraph:
+    def __init__(self, stages=None):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages or []:
+            self.add(stage)
+
+    def add(self, stage: Stage):
+        if stage.executor not in EXECUTORS:
+            raise ValueError(f"Executor non valido per '{stage.name}': {stage.executor}")
+        if stage.name in self.stages:
+            raise ValueError(f"Fase duplicata: {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def add_stage(self, name, func, deps=(), executor="thread"):
+        return self.add(Stage(name, func, tuple(deps), executor))
+
+    def topological_order(self, inputs=()) -> List[str]:
+        """Ordine valido di esecuzione; solleva ValueError su dipendenze mancanti o cicli."""
+        known = set(self.stages) | set(inputs)
+        for stage in self.stages.values():
+            missing = [d for d in stage.deps if d not in known]
+            if missing:
+                raise ValueError(f"La fase '{stage.name}' dipende da fasi inesistenti: {missing}")
+        order, done, visiting = [], set(inputs), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Ciclo nel grafo della pipeline su '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name); order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def run(self, inputs=None, max_workers=8, process_workers=None,
+            on_stage_start=None, on_stage_end=None) -> PipelineRun:
+        """
+        Esegue il grafo. `inputs` sono valori iniziali disponibili come
+        dipendenze (es. {"docx_path": ...}); una fase il cui nome è già tra gli
+        input non viene eseguita. `on_stage_start` / `on_stage_end`
+        sono chiamate nel thread chiamante con il nome della fase.
+        Alla prima fase fallita l'eccezione viene propagata.
+        """
+        inputs = dict(inputs or {})
+        self.topological_order(inputs)
+        run = PipelineRun(results=dict(inputs),
+                          deps={n: s.deps for n, s in self.stages.items()})
+        pending = {n: s for n, s in self.stages.items() if n not in inputs}
+        running = {}
+        threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage")
+        processes: Optional[ProcessPoolExecutor] = None
+        t0 = time.perf_counter()
+
+        def ready():
+            return [s for s in pending.values() if all(d in run.results for d in s.deps)]
+
+        try:
+            while pending or running:
+                for stage in ready():
+                    del pending[stage.name]
+                    kwargs = {d: run.results[d] for d in stage.deps}
+                    if on_stage_start:
+                        on_stage_start(stage.name)
+                    start = time.perf_counter()
+                    if stage.executor == "inline":
+                        # Eseguita subito nel thread chiamante
+                        run.results[stage.name] = stage.func(**kwargs)
+                        run.timings[stage.name] = (start - t0, time.perf_counter() - t0)
+                        if on_stage_end:
+                            on_stage_end(stage.name)
+                        continue
+                    if stage.executor == "process":
+                        if processes is None:
+                            processes = ProcessPoolExecutor(max_workers=process_workers)
+                        future = processes.submit(stage.func, **kwargs)
+                    else:
+                        # Il thread eredita il contesto del chiamante (es. metriche della run)
+                        future = threads.submit(contextvars.copy_context().run,
+                                                stage.func, **kwargs)
+                    running[future] = (stage.name, start)
+
+                if not running:
+                    if pending and not ready():
+                        raise RuntimeError(f"Fasi non eseguibili: {sorted(pending)}")
+                    # Eventuali nuove fasi pronte dopo una fase inline
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, start = running.pop(future)
+                    try:
+                        run.results[name] = future.result()
+                    except Exception:
+                        logger.exception("Fase '%s' fallita", name)
+                        raise
+                    run.timings[name] = (start - t0, time.perf_counter() - t0)
+                    if self.stages[name].executor == "process":
+                        # Nel processo figlio non c'è il contesto metriche: solo tempo wall
+                        record_stage(name, run.duration(name))
+                    if on_stage_end:
+                        on_stage_end(name)
+        finally:
+            for future in running:
+                future.cancel()
+            threads.shutdown(wait=False, cancel_futures=True)
+            if processes is not None:
+                processes.shutdown(wait=False, cancel_futures=True)
+
+        path, total = run.critical_path()
+        logger.info("Pipeline completata in %.2f s; critical path (%.2f s): %s",
+                    run.wall_time, total,
+                    " → ".join(f"{n} ({run.duration(n):.2f}s)" for n in path))
+        return run
+
+
+###############################################################################
+# Registro delle fasi aggiuntive
+###############################################################################
+_registered: List[Stage] = []
+
+
+def register_stage(name, deps=(), executor="thread"):
+    """Decoratore: aggiunge una fase a ogni grafo costruito da run_pipeline."""
+    def decorator(func):
+        _registered.append(Stage(name, func, tuple(deps), executor))
+        return func
+    return decorator
+
+
+def registered_stages() -> List[Stage]:
+    return list(_registered)
@@ -0,0 +1,131 @@
+"""requirement_classifier.py
+==========================
+Segmentazione del testo dei requisiti per label "RF" e classificazione di
+ogni requisito nelle funzioni IFPUG (ILF/EIF/EI/EO/EQ) con una chiamata LLM
+piccola e indipendente, eseguibile in parallelo con gli altri requisiti.
+
+Ogni requisito ha un'impronta del testo normalizzato, label RF esclusa: è ciò
+che permette di riconoscere i requisiti invariati tra due revisioni dello
+stesso ARU anche se rinumerati. Per lo stesso motivo il prompt di
+classificazione non contiene la label, così un requisito rinumerato riusa
+anche la risposta in cache.
+"""
+import re
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, List
+
+from llm_client import chat_completion, run_concurrently
+from sfp_engine import FunctionItem, parse_functions_json
+
+logger = logging.getLogger("UFP_Agents.requirements")
+
+# Versione del prompt di classificazione: incrementarla invalida cache e snapshot
+PROMPT_RF_CLASSIFY_VERSION = "rf-classify-v2"
+
+# "RF001", "RF-12", "RF 3.1", "RF_07a" a inizio riga (eventualmente dopo un elenco puntato)
+RF_LABEL = re.compile(r"^\s*(?:[-•*–]\s*)?\(?(RF[\s_\-.]?\d+(?:\.\d+)*[a-z]?)\b", re.IGNORECASE)
+# Separatori tra label e titolo: "RF001 – Titolo", "RF001: Titolo", "(RF001) Titolo"
+_LABEL_SEPARATOR = re.compile(r"^[\s)\]:.–—\-|]+")
+
+
+@dataclass
+class Requirement:
+    label: str
+    text: str
+
+    @property
+    def body(self) -> str:
+        """Testo del requisito senza la label RF iniziale."""
+        m = RF_LABEL.match(self.text)
+        return _LABEL_SEPARATOR.sub("", self.text[m.end():]) if m else self.text
+
+    @property
+    def fingerprint(self) -> str:
+        normalized = " ".join(self.body.split()).lower()
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def normalize_label(label: str) -> str:
+    return re.sub(r"[\s_\-]", "", label).upper()
+
+
+def split_requirements(requirements_text: str) -> List[Requirement]:
+    """
+    Un requisito inizia da una riga con label RF e prosegue fino alla label
+    successiva. Il testo prima del primo RF (titoli, introduzione) è ignorato;
+    le label ripetute ricevono un suffisso "#2", "#3", ...
+    """
+    reqs, seen = [], {}
+    for line in requirements_text.splitlines():
+        m = RF_LABEL.match(line)
+        if m:
+            label = normalize_label(m.group(1))
+            seen[label] = seen.get(label, 0) + 1
+            if seen[label] > 1:
+                label = f"{label}#{seen[label]}"
+            reqs.append(Requirement(label, line.strip()))
+        elif reqs and line.strip():
+            reqs[-1].text += "\n" + line.strip()
+    return reqs
+
+
+SYSTEM_PROMPT_RF = "Sei un analista Function Point IFPUG esperto (Simple Function Point, CPM 2.2)."
+
+USER_PROMPT_RF = """
+Classifica il seguente requisito funzionale nelle funzioni IFPUG che introduce:
+funzioni dati (ILF, EIF) e processi elementari (EI, EO, EQ).
+Considera solo funzioni chiaramente definite nel testo; un requisito puramente
+descrittivo può non introdurre alcuna funzione.
+
+Rispondi SOLO con un array JSON, senza testo aggiuntivo, nel formato:
+[{{"type": "EI", "name": "Inserimento ordine", "justification": "..."}}]
+
+[REQUISITO]
+{text}
+"""
+
+# Aggiunto al prompt quando è disponibile contesto dal manuale (manual_retrieval.py)
+MANUAL_CONTEXT_BLOCK = """
+[ESTRATTI DAL MANUALE DI CONTEGGIO]
+{context}
+"""
+
+
+def _parse_functions(answer: str, label: str) -> List[FunctionItem]:
+    """Funzioni della risposta; ValueError se la risposta non è un array JSON valido."""
+    try:
+        return parse_functions_json(answer, requirement=label)
+    except ValueError as e:
+        raise ValueError(f"Classificazione {label} non valida: {e}") from e
+
+
+def classify_requirement(req: Requirement, context: str = "") -> List[FunctionItem]:
+    prompt = USER_PROMPT_RF.format(text=req.body)
+    if context:
+        prompt += MANUAL_CONTEXT_BLOCK.format(context=context)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT_RF},
+        {"role": "user", "content": prompt},
+    ]
+    # Errori dell'API e risposte non valide vengono propagati (e le risposte
+    # non valide non restano in cache): una classificazione mancante non deve
+    # finire negli snapshot o nei conteggi come "nessuna funzione"
+    answer = chat_completion(messages, max_tokens=600, temperature=0.0,
+                             prompt_version=PROMPT_RF_CLASSIFY_VERSION,
+                             validate=lambda a: _parse_functions(a, req.label))
+    return _parse_functions(answer, req.label)
+
+
+def classify_requirements(reqs: List[Requirement], contexts=None) -> Dict[str, List[FunctionItem]]:
+    """
+    Classificazione parallela (map); ritorna label -> funzioni.
+    `contexts` (opzionale) è un contesto del manuale per ogni requisito.
+    Se un requisito non può essere classificato l'errore viene propagato.
+    """
+    contexts = contexts or [""] * len(reqs)
+    results = run_concurrently([lambda r=r, c=c: classify_requirement(r, c)
+                                for r, c in zip(reqs, contexts)])
+    return {r.label: fns for r, fns in zip(reqs, results)}
+
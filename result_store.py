@@ -0,0 +1,118 @@
+"""result_store.py
+================
+Archivio persistente dei risultati completi della pipeline (SF, report UFP,
+pre-analisi, info FP), indirizzato per contenuto.
+
+La chiave è `<impronta documento>:<firma>`: l'impronta è `AruDocument.content_hash`
+(testo normalizzato + hash delle immagini), la firma è l'hash di versioni dei
+prompt e deployment del modello (vedi `agente_calcolo.pipeline_signature`).
+Lo stesso ARU, anche ricaricato o rinominato, viene quindi restituito subito;
+cambiando un prompt o il deployment la chiave cambia e la stima viene rifatta.
+
+Le voci non hanno scadenza, quindi vengono salvate solo run complete: una run
+con errori assorbiti (fasi degradate) o con risultati vuoti non viene archiviata.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import List, Optional
+
+from sqlite_cache import SQLiteCache, cache_path
+
+logger = logging.getLogger("UFP_Agents.results")
+
+RESULT_STORE_ENABLED = os.getenv("RESULT_STORE", "1") != "0"
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "2000"))
+
+STORED_RESULTS = ("sf", "ufp", "pre_analysis", "fp_analysis")
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> SQLiteCache:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteCache(cache_path("result_store.sqlite"),
+                                     max_entries=RESULT_STORE_MAX_ENTRIES)
+    return _store
+
+
+def signature_hash(signature: dict) -> str:
+    payload = json.dumps(signature, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def result_key(content_hash: str, signature: dict) -> str:
+    return f"{content_hash}:{signature_hash(signature)}"
+
+
+def lookup_result(content_hash: str, signature: dict) -> Optional[dict]:
+    """Risultati salvati per documento + firma, oppure None."""
+    if not RESULT_STORE_ENABLED:
+        return None
+    raw = get_result_store().get(result_key(content_hash, signature))
+    return json.loads(raw)["results"] if raw is not None else None
+
+
+def incomplete_results(results: dict) -> List[str]:
+    """Risultati da archiviare mancanti, vuoti o con il testo di errore dell'estrazione AI."""
+    return [k for k in STORED_RESULTS
+            if not str(results.get(k) or "").strip()
+            or str(results[k]).startswith("Errore AI durante")]
+
+
+def store_result(content_hash: str, signature: dict, results: dict, filename=None,
+                 degraded=()) -> bool:
+    """
+    Archivia i risultati di una run completa; ritorna False (senza salvare)
+    se la run è degradata (`degraded`) o ha risultati vuoti o di errore.
+    """
+    if not RESULT_STORE_ENABLED:
+        return False
+    problems = list(degraded) + [f"{k} vuoto o in errore" for k in incomplete_results(results)]
+    if problems:
+        logger.warning("Risultati di %s non archiviati (run degradata): %s",
+                       filename or content_hash[:12], "; ".join(problems))
+        return False
+    entry = {
+        "filename": filename,
+        "content_hash": content_hash,
+        "signature": signature,
+        "stored_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {k: results[k] for k in STORED_RESULTS},
+    }
+    get_result_store().set(result_key(content_hash, signature),
+                           json.dumps(entry, ensure_ascii=False))
+    return True
+
+
+def list_results():
+    """Voci dell'archivio (senza i testi), per la vista di amministrazione."""
+    rows = []
+    for e in get_result_store().entries():
+        entry = json.loads(e["value"])
+        rows.append({
+            "key": e["key"],
+            "filename": entry.get("filename"),
+            "deployment": entry.get("signature", {}).get("deployment"),
+            "stored_at": entry.get("stored_at"),
+            "last_access": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(e["last_access"])),
+            "kb": round(e["size"] / 1024, 1),
+        })
+    return rows
+
+
+def evict_result(key: str):
+    get_result_store().delete(key)
+    logger.info("Risultato rimosso dall'archivio: %s", key)
+
+
+def clear_results():
+    get_result_store().clear()
+    logger.info("Archivio risultati svuotato")
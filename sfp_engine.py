@@ -0,0 +1,140 @@
+"""sfp_engine.py
+==============
+Calcolo locale e deterministico dei Simple Function Point (SFP) a partire da
+funzioni già classificate (ILF/EIF/EI/EO/EQ):
+
+    EP  = (EI + EO + EQ) × 4.6
+    LF  = (ILF + EIF) × 7
+    UFP = EP + LF
+
+Le funzioni dati (ILF/EIF) sono contate una sola volta per nome, anche se
+citate da più requisiti; le funzioni transazionali sono contate tutte.
+"""
+import re
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger("UFP_Agents.sfp")
+
+TRANSACTION_TYPES = ("EI", "EO", "EQ")
+DATA_TYPES = ("ILF", "EIF")
+FUNCTION_TYPES = DATA_TYPES + TRANSACTION_TYPES
+
+EP_WEIGHT = 4.6
+LF_WEIGHT = 7
+
+
+@dataclass
+class FunctionItem:
+    type: str
+    name: str
+    justification: str = ""
+    requirement: Optional[str] = None   # label RF di origine
+
+    def __post_init__(self):
+        self.type = self.type.strip().upper()
+        if self.type not in FUNCTION_TYPES:
+            raise ValueError(f"Tipo di funzione non valido: {self.type!r}")
+        self.name = " ".join(self.name.split())
+        if not self.name:
+            raise ValueError("Funzione senza nome")
+
+    @property
+    def key(self):
+        return self.type, re.sub(r"\W+", " ", self.name.lower()).strip()
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def parse_functions_json(answer: str, requirement=None) -> List[FunctionItem]:
+    """
+    Funzioni da una risposta LLM contenente un array JSON di oggetti
+    {"type", "name", "justification", "requirement"}. Solleva ValueError se
+    l'array manca o non è JSON valido; le singole voci non valide sono scartate.
+    """
+    m = re.search(r"\[[\s\S]*\]", answer or "")
+    if not m:
+        raise ValueError(f"nessun array JSON nella risposta: {(answer or '')[:120]!r}")
+    items = json.loads(m.group(0))
+    if not isinstance(items, list):
+        raise ValueError("la risposta non è un array JSON")
+    functions = []
+    for item in items:
+        try:
+            functions.append(FunctionItem(type=str(item.get("type", "")),
+                                          name=str(item.get("name", "")),
+                                          justification=str(item.get("justification") or ""),
+                                          requirement=item.get("requirement") or requirement))
+        except (AttributeError, ValueError) as e:
+            logger.warning("Funzione scartata (%s): %r", e, item)
+    return functions
+
+
+@dataclass
+class SfpResult:
+    counts: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(FUNCTION_TYPES, 0))
+    ep: float = 0.0
+    lf: float = 0.0
+    ufp: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def unique_functions(functions: Iterable[FunctionItem]) -> List[FunctionItem]:
+    """Funzioni contate: ILF/EIF deduplicate per nome, EI/EO/EQ tutte."""
+    seen, out = set(), []
+    for fn in functions:
+        if fn.type in DATA_TYPES:
+            if fn.key in seen:
+                continue
+            seen.add(fn.key)
+        out.append(fn)
+    return out
+
+
+def compute_sfp(functions: Iterable[FunctionItem]) -> SfpResult:
+    counts = dict.fromkeys(FUNCTION_TYPES, 0)
+    for fn in unique_functions(functions):
+        counts[fn.type] += 1
+    ep = round(sum(counts[t] for t in TRANSACTION_TYPES) * EP_WEIGHT, 1)
+    lf = round(sum(counts[t] for t in DATA_TYPES) * LF_WEIGHT, 1)
+    return SfpResult(counts=counts, ep=ep, lf=lf, ufp=round(ep + lf, 1))
+
+
+def sfp_delta(old: SfpResult, new: SfpResult) -> dict:
+    """Differenze (nuovo − vecchio) per tipo di funzione, EP, LF e UFP."""
+    delta = {t: new.counts[t] - old.counts[t] for t in FUNCTION_TYPES}
+    delta.update(ep=round(new.ep - old.ep, 1), lf=round(new.lf - old.lf, 1),
+                 ufp=round(new.ufp - old.ufp, 1))
+    return delta
+
+
+def render_sfp_report(result: SfpResult, functions: List[FunctionItem], adjustments=(),
+                      final_ufp=None, title="Conteggio SFP") -> str:
+    """
+    Report markdown del conteggio: tabella per tipo, calcolo di EP/LF/UFP,
+    eventuali correzioni (clamp, Agile) e riga finale "Totale UFP = N", nello
+    stesso formato del report generato dall'LLM.
+    """
+    c = result.counts
+    final_ufp = int(round(result.ufp)) if final_ufp is None else final_ufp
+    lines = [f"### {title}", "", "| Tipo di funzione | Numero |", "|---|---:|"]
+    lines += [f"| {t} | {c[t]} |" for t in FUNCTION_TYPES]
+    lines += ["",
+              f"EP = (EI + EO + EQ) × {EP_WEIGHT} = ({c['EI']} + {c['EO']} + {c['EQ']}) × "
+              f"{EP_WEIGHT} = {result.ep:g}",
+              f"LF = (ILF + EIF) × {LF_WEIGHT} = ({c['ILF']} + {c['EIF']}) × {LF_WEIGHT} = {result.lf:g}",
+              f"UFP = EP + LF = {result.ep:g} + {result.lf:g} = {result.ufp:g}"]
+    lines += [f"- {note}" for note in adjustments]
+    lines += ["", f"Totale UFP = {final_ufp}"]
+    counted = unique_functions(functions)
+    if counted:
+        lines += ["", "#### Funzioni conteggiate", "",
+                  "| Requisito | Tipo | Funzione | Giustificazione |", "|---|---|---|---|"]
+        lines += [f"| {fn.requirement or '–'} | {fn.type} | {fn.name} | "
+                  f"{fn.justification.replace('|', '/') or '–'} |" for fn in counted]
+    return "\n".join(lines) + "\n"
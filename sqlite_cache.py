@@ -0,0 +1,165 @@
+"""sqlite_cache.py
+=================
+Cache chiave/valore persistente su SQLite, condivisa tra thread e processi.
+
+Supporta eviction LRU limitata per numero di voci e/o byte totali, TTL
+opzionale e contatori di hit/miss. I valori sono stringhe (tipicamente JSON).
+"""
+import os
+import time
+import sqlite3
+import threading
+
+CACHE_DIR = os.getenv("UFP_CACHE_DIR", ".cache")
+
+
+def cache_path(filename: str) -> str:
+    """Path di un file di cache sotto CACHE_DIR (creando la cartella)."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
+
+
+class SQLiteCache:
+    def __init__(self, path, max_entries=None, max_bytes=None, ttl_seconds=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def get_many(self, keys) -> dict:
+        """Valori delle chiavi presenti (una query per blocco di chiavi); le assenti non compaiono."""
+        keys = list(dict.fromkeys(keys))
+        now, found = time.time(), {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                block = keys[i:i + 500]
+                marks = ",".join("?" * len(block))
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM cache WHERE key IN ({marks})", block
+                ).fetchall()
+                for key, value, created in rows:
+                    if not (self.ttl_seconds and now - created > self.ttl_seconds):
+                        found[key] = value
+            if found:
+                self._conn.executemany("UPDATE cache SET last_access = ? WHERE key = ?",
+                                       [(now, k) for k in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        """Come `set` per più coppie (chiave, valore), in una sola transazione."""
+        now = time.time()
+        rows = [(k, v, len(v.encode("utf-8")), now, now) for k, v in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def delete_prefix(self, prefix):
+        """Rimuove tutte le voci la cui chiave inizia con `prefix`."""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?",
+                                     (len(prefix), prefix))
+            self._conn.commit()
+            return cur.rowcount
+
+    def entries(self):
+        """Voci in ordine di ultimo accesso (più recenti prima), senza aggiornare le statistiche."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, size, created, last_access FROM cache"
+                " ORDER BY last_access DESC"
+            ).fetchall()
+        return [dict(zip(("key", "value", "size", "created", "last_access"), r)) for r in rows]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def _evict(self):
+        # Da chiamare con il lock acquisito: rimuove le voci usate meno di recente
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM cache WHERE created < ?",
+                               (time.time() - self.ttl_seconds,))
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache"
+                " ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+        if self.max_bytes:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute(
+                    "SELECT key, size FROM cache ORDER BY last_access ASC"
+                ).fetchall()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
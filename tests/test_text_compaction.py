@@ -0,0 +1,81 @@
+"""Test di text_compaction.compact_text (regole di default, senza COMPACTION_RULES)."""
+from text_compaction import DEFAULT_RULES, OCR_MARKER, CompactionRules, compact_text
+
+RULES = CompactionRules.from_dict({})
+
+
+def compact(text):
+    return compact_text(text, rules=RULES)[0]
+
+
+def test_spazi_e_righe_vuote():
+    assert compact("  Introduzione   al  sistema\n\n\n\nTesto  finale  ") == \
+        "Introduzione al sistema\n\nTesto finale"
+
+
+def test_sezione_boilerplate_eliminata_fino_al_titolo_successivo():
+    text = ("1. Storia delle revisioni\n"
+            "Prima stesura del documento.\n"
+            "2. Requisiti Funzionali\n"
+            "RF01 – Inserimento ordine")
+    out = compact(text)
+    assert "Storia delle revisioni" not in out and "Prima stesura" not in out
+    assert out.startswith("2. Requisiti Funzionali")
+
+
+def test_titolo_approvazione():
+    out = compact("Approvazione\nMario Rossi, responsabile.\nScopo\nGestione ordini.")
+    assert "Mario Rossi" not in out
+    assert "Gestione ordini." in out
+
+
+def test_sezione_funzionale_con_parole_boilerplate_non_eliminata():
+    text = ("3.3 Consultazione storico modifiche\n"
+            "L'utente consulta lo storico delle modifiche di un ordine.")
+    assert compact(text) == text
+
+
+def test_righe_di_revisione_e_celle_unite():
+    text = ("Versione | Data | Autore\n"
+            "1.0 | 01/02/2024 | Rossi\n"
+            "Cliente | Cliente | Anagrafica dei clienti")
+    assert compact(text) == "Cliente | Anagrafica dei clienti"
+
+
+def test_righe_duplicate_solo_nella_stessa_tabella():
+    cliente = "Campo | Tipo | Obbligatorio\nCodice | Alfanumerico | Sì\nCodice | Alfanumerico | Sì"
+    fornitore = "Campo | Tipo | Obbligatorio\nCodice | Alfanumerico | Sì"
+    out = compact(f"Tabella Cliente\n{cliente}\nTabella Fornitore\n{fornitore}")
+    assert out.splitlines() == ["Tabella Cliente",
+                                "Campo | Tipo | Obbligatorio", "Codice | Alfanumerico | Sì",
+                                "Tabella Fornitore",
+                                "Campo | Tipo | Obbligatorio", "Codice | Alfanumerico | Sì"]
+
+
+def test_descrizione_ripetuta_in_requisiti_diversi_conservata():
+    body = "Il sistema registra l'operazione nel log applicativo."
+    text = f"RF01 – Inserimento ordine\n{body}\n{body}\nRF02 – Modifica ordine\n{body}"
+    assert compact(text).splitlines() == ["RF01 – Inserimento ordine", body,
+                                          "RF02 – Modifica ordine", body]
+
+
+def test_rumore_ocr_e_righe_ocr_ripetute():
+    text = f"Testo\n{OCR_MARKER}\n@@\nLogo Azienda Spa\nx\nLogo Azienda Spa"
+    assert compact(text).splitlines() == ["Testo", OCR_MARKER, "Logo Azienda Spa"]
+
+
+def test_report_e_idempotenza():
+    text = "Pagina 3 di 10\nRiservato – uso interno\nScopo\nGestione ordini."
+    out, report = compact_text(text, label="test", rules=RULES)
+    assert out == "Scopo\nGestione ordini."
+    assert report.dropped == {"riga": 2}
+    assert report.lines_before == 4 and report.lines_after == 2
+    assert compact(out) == out
+
+
+def test_regole_personalizzate_sostituiscono_le_chiavi():
+    rules = CompactionRules.from_dict({"drop_lines": [r"^bozza$"]})
+    assert rules.drop_sections and len(rules.drop_lines) == 1
+    assert rules.signature != RULES.signature
+    assert compact_text("Bozza\nPagina 1", rules=rules)[0] == "Pagina 1"
+    assert DEFAULT_RULES["drop_lines"] != ["^bozza$"]
@@ -0,0 +1,236 @@
+"""text_compaction.py
+===================
+Compattazione deterministica del testo di un ARU prima delle chiamate LLM.
+
+In un solo passaggio sulle righe:
+  - spazi compattati e righe vuote consecutive ridotte a una;
+  - celle ripetute consecutive nelle righe di tabella (celle unite, che
+    python-docx restituisce una volta per colonna) tenute una volta;
+  - sezioni boilerplate (storia delle revisioni, lista di distribuzione, ...)
+    eliminate fino al titolo successivo (al più `section_max_lines` righe); i
+    pattern devono corrispondere all'intero titolo (numerazione esclusa), così
+    "3.3 Consultazione storico modifiche" resta;
+  - righe e righe di tabella boilerplate (numeri di pagina, diciture di
+    riservatezza, righe delle tabelle di revisione) eliminate;
+  - righe OCR senza contenuto (loghi: meno di `ocr_min_chars` caratteri
+    alfanumerici) eliminate;
+  - righe ripetute tenute solo alla prima occorrenza: le righe di tabella
+    all'interno della stessa tabella (righe consecutive), le righe OCR in
+    tutto il testo OCR, le altre righe lunghe almeno `dedupe_min_chars`
+    all'interno dello stesso requisito RF; così ogni tabella e ogni
+    requisito conservano tutto il proprio contenuto.
+
+Le righe con label RF e i marcatori di sezione non vengono mai eliminati.
+Le regole sono configurabili con un file JSON (COMPACTION_RULES) che
+sostituisce le chiavi corrispondenti di DEFAULT_RULES; stesso testo e stesse
+regole danno sempre lo stesso risultato, quindi le cache restano valide.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Dict
+
+from chunking import count_tokens, is_heading
+from metrics import record_compaction
+from requirement_classifier import RF_LABEL
+
+logger = logging.getLogger("UFP_Agents.compaction")
+
+INPUT_COMPACTION_ENABLED = os.getenv("INPUT_COMPACTION", "1") != "0"
+COMPACTION_RULES_PATH = os.getenv("COMPACTION_RULES", "")
+COMPACTION_VERSION = "compact-v2"
+
+OCR_MARKER = "[TESTO ESTRATTO DA IMMAGINI]"
+CELL_SEPARATOR = " | "
+
+_SECTION_NUMBER = r"^(\d+(\.\d+)*\.?\s+)?"
+
+DEFAULT_RULES = {
+    # Titoli di sezione il cui contenuto (fino al titolo successivo) viene
+    # eliminato: ancorati all'intero titolo, con numerazione facoltativa
+    "drop_sections": [
+        _SECTION_NUMBER + r"(storia|storico|cronologia)\s+(delle\s+)?(revisioni|versioni|modifiche)$",
+        _SECTION_NUMBER + r"revision\s+history$",
+        _SECTION_NUMBER + r"registro\s+(delle\s+)?modifiche$",
+        _SECTION_NUMBER + r"lista\s+di\s+distribuzione$",
+        _SECTION_NUMBER + r"approvazion[ei](\s+del\s+documento)?$",
+    ],
+    # Righe singole
+    "drop_lines": [
+        r"^pag(ina|\.)?\s*\d+(\s*(di|/)\s*\d+)?$",
+        r"^(documento\s+)?(riservato|confidenziale|confidential)\b.{0,60}$",
+        r"^(copyright\b|©)",
+        r"^tutti\s+i\s+diritti\s+riservati",
+    ],
+    # Righe di tabella (celle unite da " | ")
+    "drop_rows": [
+        r"^(versione|ver\.?|rev\.?|revisione)\s*\|\s*data\b",
+        r"^v?\d+(\.\d+)*\s*\|\s*\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b",
+    ],
+    "section_max_lines": 40,
+    "dedupe_min_chars": 30,
+    "ocr_min_chars": 4,
+}
+
+_PROTECTED = re.compile(r"^(requisiti\s+funzionali|fine\s+req)", re.IGNORECASE)
+
+
+@dataclass
+class CompactionReport:
+    label: str
+    lines_before: int = 0
+    lines_after: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+    dropped: Dict[str, int] = field(default_factory=dict)   # regola -> righe eliminate
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def to_dict(self):
+        return {"label": self.label, "lines_before": self.lines_before,
+                "lines_after": self.lines_after, "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after, "tokens_saved": self.tokens_saved,
+                "dropped": dict(self.dropped)}
+
+
+@dataclass
+class CompactionRules:
+    drop_sections: list
+    drop_lines: list
+    drop_rows: list
+    section_max_lines: int
+    dedupe_min_chars: int
+    ocr_min_chars: int
+    signature: str
+
+    @classmethod
+    def from_dict(cls, rules: dict):
+        merged = {**DEFAULT_RULES, **rules}
+        compile_all = lambda key: [re.compile(p, re.IGNORECASE) for p in merged[key]]
+        signature = hashlib.sha256(json.dumps(merged, sort_keys=True).encode("utf-8")).hexdigest()
+        return cls(compile_all("drop_sections"), compile_all("drop_lines"), compile_all("drop_rows"),
+                   int(merged["section_max_lines"]), int(merged["dedupe_min_chars"]),
+                   int(merged["ocr_min_chars"]),
+                   f"{COMPACTION_VERSION}:{signature[:12]}")
+
+
+_rules = None
+
+
+def get_rules() -> CompactionRules:
+    """Regole da COMPACTION_RULES (se indicato) sopra DEFAULT_RULES, caricate una volta."""
+    global _rules
+    if _rules is None:
+        overrides = {}
+        if COMPACTION_RULES_PATH:
+            with open(COMPACTION_RULES_PATH, encoding="utf-8") as f:
+                overrides = json.load(f)
+        _rules = CompactionRules.from_dict(overrides)
+    return _rules
+
+
+def compaction_signature() -> str:
+    """Versione + hash delle regole, da includere nelle firme delle cache dei risultati."""
+    return get_rules().signature if INPUT_COMPACTION_ENABLED else "off"
+
+
+def _is_title(line: str) -> bool:
+    # Titoli numerati/maiuscoli (chunking.is_heading) o righe brevi senza punteggiatura finale
+    return is_heading(line) or (len(line) <= 80 and line[0].isupper()
+                                and not line.endswith((".", ";", ":", ","))
+                                and CELL_SEPARATOR not in line)
+
+
+def _merge_cells(line: str) -> str:
+    cells = line.split(CELL_SEPARATOR)
+    kept = [c for i, c in enumerate(cells) if i == 0 or c != cells[i - 1]]
+    return CELL_SEPARATOR.join(kept)
+
+
+def compact_text(text: str, label="documento", rules: CompactionRules = None):
+    """Ritorna `(testo compattato, CompactionReport)`."""
+    rules = rules or get_rules()
+    report = CompactionReport(label)
+    out, seen_ocr, seen_rows, seen_prose = [], set(), set(), set()
+    in_ocr, dropping = False, 0   # dropping: righe ancora eliminabili nella sezione corrente
+
+    def drop(rule):
+        report.dropped[rule] = report.dropped.get(rule, 0) + 1
+
+    lines = text.splitlines()
+    report.lines_before = len(lines)
+    for raw in lines:
+        line = " ".join(raw.split())
+        is_row = CELL_SEPARATOR in line
+        if not is_row:
+            seen_rows = set()   # fine della tabella corrente
+        if not line:
+            if out and out[-1]:
+                out.append("")
+            continue
+        if line == OCR_MARKER:
+            in_ocr, dropping = True, 0
+            out.append(line)
+            continue
+        protected = bool(RF_LABEL.match(line) or _PROTECTED.match(line))
+        if protected:
+            seen_prose = set()
+        title = not in_ocr and not protected and _is_title(line)
+        if title and any(p.search(line) for p in rules.drop_sections):
+            dropping = rules.section_max_lines
+            drop("sezione")
+            continue
+        if title or protected:
+            dropping = 0
+        if dropping:
+            dropping -= 1
+            drop("sezione")
+            continue
+        if not protected:
+            if is_row and not in_ocr:
+                line = _merge_cells(line)
+            if is_row and any(p.search(line) for p in rules.drop_rows):
+                drop("riga_tabella")
+                continue
+            if any(p.search(line) for p in rules.drop_lines):
+                drop("riga")
+                continue
+            if in_ocr and sum(ch.isalnum() for ch in line) < rules.ocr_min_chars:
+                drop("ocr")
+                continue
+            key = line.casefold()
+            scope = seen_ocr if in_ocr else seen_rows if is_row else seen_prose
+            if is_row or in_ocr or len(line) >= rules.dedupe_min_chars:
+                if key in scope:
+                    drop("duplicato")
+                    continue
+                scope.add(key)
+        out.append(line)
+
+    while out and not out[-1]:
+        out.pop()
+    compacted = "\n".join(out)
+    report.lines_after = len(out)
+    report.tokens_before = count_tokens(text)
+    report.tokens_after = count_tokens(compacted)
+    return compacted, report
+
+
+def compact_for_llm(text: str, label="documento") -> str:
+    """
+    Compattazione da usare davanti alle chiamate LLM (se INPUT_COMPACTION=1):
+    il risparmio di token viene loggato e registrato nelle metriche della run.
+    """
+    if not INPUT_COMPACTION_ENABLED or not text:
+        return text
+    compacted, report = compact_text(text, label)
+    logger.info("Compattazione %s: %d → %d token (−%d), %d → %d righe %s",
+                label, report.tokens_before, report.tokens_after, report.tokens_saved,
+                report.lines_before, report.lines_after, report.dropped)
+    record_compaction(report.to_dict())
+    return compacted
@@ -0,0 +1,146 @@
+"""warmup.py
+==========
+Warm-up esplicito delle dipendenze pesanti e report dei tempi di avvio.
+
+Con gli import pigri (lazy_imports.py) il costo di caricare modelli e librerie
+si sposta alla prima richiesta; `warm_up()` lo anticipa all'avvio caricando
+SOLO ciò che la pipeline configurata userà:
+  - tokenizer: sempre (budget dei chunk, conteggio token delle chiamate LLM);
+  - ocr:       EasyOCR, a meno di OCR_WARMUP=0 (con OCR_WORKERS > 1 nei
+               processi del pool OCR, non nel processo principale);
+  - manual:    modello di embedding e indice del manuale, solo con
+               MANUAL_CONTEXT=1 e UFP_COUNT_MODE=mapreduce.
+
+`python warmup.py --report` misura in un interprete pulito il tempo di
+`import agente_calcolo` (per pacchetto, con `python -X importtime`) e termina
+con errore se supera STARTUP_BUDGET_SECONDS.
+
+Uso:
+    python warmup.py                 # warm-up dei componenti necessari
+    python warmup.py --report        # report dei tempi di import
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import logging
+import subprocess
+from collections import defaultdict
+from typing import Dict, List
+
+from lazy_imports import import_report
+
+logger = logging.getLogger("UFP_Agents.warmup")
+
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "2.0"))
+OCR_WARMUP = os.getenv("OCR_WARMUP", "1") == "1"
+
+
+def _warm_tokenizer():
+    from chunking import count_tokens
+    count_tokens("warm-up")
+
+
+def _warm_ocr():
+    from ocr_engine import warm_up_ocr
+    warm_up_ocr()
+
+
+def _warm_manual():
+    from manual_retrieval import get_manual_resources
+    get_manual_resources()
+
+
+WARMUPS = {"tokenizer": _warm_tokenizer, "ocr": _warm_ocr, "manual": _warm_manual}
+
+
+def required_components() -> List[str]:
+    """Componenti usati dalla pipeline con la configurazione corrente."""
+    from agente_calcolo import MANUAL_CONTEXT_ENABLED, UFP_COUNT_MODE
+    components = ["tokenizer"]
+    if OCR_WARMUP:
+        components.append("ocr")
+    if MANUAL_CONTEXT_ENABLED and UFP_COUNT_MODE == "mapreduce":
+        components.append("manual")
+    return components
+
+
+def warm_up(components=None) -> Dict[str, float]:
+    """
+    Carica i componenti indicati (default: `required_components()`); ritorna i
+    secondi impiegati per ciascuno. Gli errori sono solo loggati: il componente
+    verrà caricato (o fallirà) alla prima richiesta come senza warm-up.
+    """
+    timings = {}
+    for name in components if components is not None else required_components():
+        t0 = time.perf_counter()
+        try:
+            WARMUPS[name]()
+        except Exception as e:
+            logger.warning("Warm-up %s non riuscito: %s", name, e)
+            continue
+        timings[name] = round(time.perf_counter() - t0, 3)
+    logger.info("Warm-up completato: %s", timings)
+    return timings
+
+
+###############################################################################
+# Report dei tempi di import
+###############################################################################
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def startup_report(module="agente_calcolo", top=10) -> dict:
+    """
+    Importa `module` in un interprete nuovo con `-X importtime`; ritorna il
+    tempo totale e i pacchetti più costosi (tempo proprio dei loro moduli).
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    by_package, total = defaultdict(int), 0
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        self_us, cumulative_us, indent, name = int(m[1]), int(m[2]), m[3], m[4]
+        by_package[name.split(".")[0]] += self_us
+        if name == module and len(indent) <= 1:
+            total = cumulative_us
+    packages = sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return {"module": module, "ok": proc.returncode == 0,
+            "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else None,
+            "seconds": round(total / 1e6, 3),
+            "packages": [{"package": p, "seconds": round(us / 1e6, 3)} for p, us in packages]}
+
+
+def render_startup_report(report, budget=STARTUP_BUDGET_SECONDS) -> str:
+    status = "OK" if report["ok"] and report["seconds"] <= budget else "FUORI BUDGET"
+    lines = [f"import {report['module']}: {report['seconds']:.3f} s "
+             f"(budget {budget:.1f} s) – {status}"]
+    if report["error"]:
+        lines.append(f"errore: {report['error']}")
+    lines += ["", "| Pacchetto | Secondi |", "|---|---:|"]
+    lines += [f"| {p['package']} | {p['seconds']:.3f} |" for p in report["packages"]]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm-up e report dei tempi di avvio")
+    parser.add_argument("--report", action="store_true", help="report dei tempi di import")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS)
+    parser.add_argument("--components", nargs="+", choices=sorted(WARMUPS),
+                        help="componenti da caricare (default: quelli richiesti dalla configurazione)")
+    args = parser.parse_args()
+
+    if args.report:
+        rep = startup_report()
+        print(render_startup_report(rep, args.budget))
+        sys.exit(0 if rep["ok"] and rep["seconds"] <= args.budget else 1)
+
+    import agente_calcolo  # noqa: F401 – configura il logger "UFP_Agents"
+    print(warm_up(args.components))
+    for row in import_report():
+        print(f"{row['module']}: {'caricato' if row['loaded'] else 'non caricato'}"
+              + (f" ({row['seconds']:.2f} s)" if row["seconds"] is not None else ""))